@@ -51,8 +51,9 @@ class GeminiViewModel: ObservableObject {
         
         // Función para generar imagen
         func generateImage() async throws {
-            struct GeneratePlanetImagePayload: Encodable { let kepoi_name: String }
-            let payload = GeneratePlanetImagePayload(kepoi_name: kepoiname)
+            // wait: el backend genera en segundo plano; esperamos a que termine para descargarla
+            struct GeneratePlanetImagePayload: Encodable { let kepoi_name: String; let wait: Bool }
+            let payload = GeneratePlanetImagePayload(kepoi_name: kepoiname, wait: true)
             guard let genReq = APIEndpoint.generatePlanetImage.request(body: APIEndpoint.jsonBody(payload)) else {
                 await MainActor.run { self.response = "No se pudo crear la petición de generación de imagen." }
                 throw URLError(.badURL)
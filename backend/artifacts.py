@@ -0,0 +1,197 @@
+"""On-disk store for trained model artifacts.
+
+An artifact holds everything needed to serve predictions without refitting:
+the fitted classifier, the `StandardScaler`, the feature column names and the
+`model_info` metrics. Artifacts are keyed by a hash of the CSV content plus the
+training hyperparameters, so the same dataset and config always map to the
+same file and a restart (or switching back to a dataset) becomes a file load.
+
+The compiled inference engine of an artifact is stored next to it. Both are
+saved uncompressed and loaded with `mmap_mode`, but only the engine's arrays end
+up mapped, shared by the worker processes of a multi-worker server through the
+page cache. Unpickling the sklearn forest copies its node arrays onto the heap.
+`publish()` records which artifact the workers should serve (`published.json`).
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import joblib
+
+
+# Bump when the artifact layout changes so old files are ignored instead of misread
+ARTIFACT_FORMAT = 3
+
+_digest_cache: Dict[str, tuple] = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the sha256 hex digest of a file's content.
+
+    Results are cached per path and invalidated when the file's size or mtime change,
+    so repeated lookups for an unchanged CSV do not re-read it.
+    """
+    st = os.stat(path)
+    stamp = (st.st_size, st.st_mtime_ns)
+    with _digest_lock:
+        cached = _digest_cache.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _digest_cache[path] = (stamp, digest)
+    return digest
+
+
+def remember_digest(path: str, digest: str):
+    """Record the sha256 of `path` computed elsewhere (e.g. while it was uploaded)."""
+    st = os.stat(path)
+    with _digest_lock:
+        _digest_cache[path] = ((st.st_size, st.st_mtime_ns), digest)
+
+
+def artifact_key(csv_path: str, numest, mxdepth, randstate, extra: Optional[dict] = None) -> str:
+    """Key identifying a model trained on `csv_path` with the given hyperparameters.
+
+    `extra` holds other RandomForest parameters; pass only non-default ones so keys of
+    models trained with the defaults stay the same.
+    """
+    params = {
+        'format': ARTIFACT_FORMAT,
+        'numest': numest,
+        'mxdepth': mxdepth,
+        'randstate': randstate,
+    }
+    if extra:
+        params['extra'] = extra
+    params = json.dumps(params, sort_keys=True)
+    h = hashlib.sha256()
+    h.update(file_digest(csv_path).encode('ascii'))
+    h.update(params.encode('utf-8'))
+    return h.hexdigest()[:32]
+
+
+def artifact_path(artifact_dir: str, key: str) -> str:
+    return os.path.join(artifact_dir, f"model_{key}.joblib")
+
+
+def has_artifact(artifact_dir: str, key: str) -> bool:
+    return os.path.isfile(artifact_path(artifact_dir, key))
+
+
+def _dump_atomic(obj, path: str):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        joblib.dump(obj, tmp, compress=0)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def save_artifact(artifact_dir: str, key: str, model, scaler, X_columns, model_info: dict) -> str:
+    """Persist a trained model under `key`. Written to a temp file first and renamed,
+    so a crash mid-write never leaves a truncated artifact behind."""
+    os.makedirs(artifact_dir, exist_ok=True)
+    path = artifact_path(artifact_dir, key)
+    payload = {
+        'format': ARTIFACT_FORMAT,
+        'model': model,
+        'scaler': scaler,
+        'X_columns': list(X_columns),
+        'model_info': model_info,
+    }
+    # Uncompressed so numpy arrays inside the model can be memory-mapped on load
+    _dump_atomic(payload, path)
+    return path
+
+
+def load_artifact(artifact_dir: str, key: str) -> Optional[Dict[str, Any]]:
+    """Load the artifact stored under `key`, memory-mapping its arrays read-only.
+
+    Returns None if there is no such artifact or it cannot be read.
+    """
+    path = artifact_path(artifact_dir, key)
+    if not os.path.isfile(path):
+        return None
+    try:
+        payload = joblib.load(path, mmap_mode='r')
+    except Exception as e:
+        print(f"Ignoring unreadable model artifact {path}: {e!r}")
+        return None
+    if not isinstance(payload, dict) or payload.get('format') != ARTIFACT_FORMAT:
+        return None
+    return payload
+
+
+def engine_path(artifact_dir: str, key: str) -> str:
+    return os.path.join(artifact_dir, f"engine_{key}.joblib")
+
+
+def save_engine(artifact_dir: str, key: str, engine, report: dict) -> str:
+    """Persist the compiled engine of artifact `key` with its verification report."""
+    os.makedirs(artifact_dir, exist_ok=True)
+    path = engine_path(artifact_dir, key)
+    _dump_atomic({'format': ARTIFACT_FORMAT, 'engine': engine, 'report': report}, path)
+    return path
+
+
+def load_engine(artifact_dir: str, key: str) -> Optional[tuple]:
+    """(engine, report) saved for artifact `key`, memory-mapped, or None."""
+    path = engine_path(artifact_dir, key)
+    if not os.path.isfile(path):
+        return None
+    try:
+        payload = joblib.load(path, mmap_mode='r')
+    except Exception as e:
+        print(f"Ignoring unreadable engine {path}: {e!r}")
+        return None
+    if not isinstance(payload, dict) or payload.get('format') != ARTIFACT_FORMAT:
+        return None
+    return payload['engine'], payload['report']
+
+
+PUBLISHED_FILE = 'published.json'
+
+
+def publish(artifact_dir: str, record: dict):
+    """Record the artifact every worker sharing `artifact_dir` should serve."""
+    os.makedirs(artifact_dir, exist_ok=True)
+    path = os.path.join(artifact_dir, PUBLISHED_FILE)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def published_stamp(artifact_dir: str) -> Optional[int]:
+    """Modification time (ns) of the published record, or None if there is none."""
+    try:
+        return os.stat(os.path.join(artifact_dir, PUBLISHED_FILE)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def read_published(artifact_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(artifact_dir, PUBLISHED_FILE), encoding='utf-8') as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return record if isinstance(record, dict) and record.get('artifact') else None
@@ -0,0 +1,149 @@
+"""Which features drive the model: global importances and per-row attributions.
+
+Global, computed when a forest is fitted:
+
+- `impurity_importance`: sklearn's mean decrease in impurity over the trees;
+- `permutation_importance`: drop in held-out accuracy when one feature's values
+  are shuffled. All repeats of a feature are scored in one stacked batch.
+
+Per row, for the rows of a model version's dataset:
+
+- `RowAttributions`: path contributions (Saabas), the path-based approximation
+  of TreeSHAP. Every split on a row's path credits its feature with the change
+  in class distribution from the node to the child taken, averaged over trees
+  (`CompactForest.contributions`). The base value plus a row's contributions
+  equals its predicted probabilities exactly. A row's contributions are
+  computed when they are asked for and kept in a small LRU cache; only their
+  mean absolute value over the dataset is computed up front, in one streaming
+  pass that keeps nothing per row.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+
+# Held-out rows used by permutation_importance (a deterministic sample beyond that)
+PERMUTATION_MAX_ROWS = 2000
+# Rows whose contributions a RowAttributions keeps, least recently used evicted first
+CACHE_ROWS = 1024
+
+
+def impurity_importance(model, columns: Sequence[str]) -> Dict[str, float]:
+    """Mean decrease in impurity per feature (sums to 1)."""
+    return {str(c): round(float(v), 6) for c, v in zip(columns, model.feature_importances_)}
+
+
+def permutation_importance(predict_proba: Callable, classes: Sequence, X, y, columns: Sequence[str],
+                           n_repeats: int = 5, random_state: int = 0) -> dict:
+    """Accuracy drop per shuffled feature on held-out (already scaled) rows `X`, labels `y`.
+
+    Returns {"baseline_accuracy", "rows", "repeats", "mean": {feature: drop}, "std": {feature: std}}.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    y = np.asarray(y).astype(str)
+    rng = np.random.default_rng(random_state)
+    if len(X) > PERMUTATION_MAX_ROWS:
+        keep = np.sort(rng.choice(len(X), PERMUTATION_MAX_ROWS, replace=False))
+        X, y = X[keep], y[keep]
+    m, n_features = X.shape
+    labels = np.asarray(classes).astype(str)
+    baseline = float((labels[predict_proba(X).argmax(axis=1)] == y).mean())
+
+    drops = np.zeros((n_features, n_repeats))
+    stacked = np.tile(X, (n_repeats, 1))
+    for f in range(n_features):
+        for r in range(n_repeats):
+            stacked[r * m:(r + 1) * m, f] = X[rng.permutation(m), f]
+        pred = labels[predict_proba(stacked).argmax(axis=1)].reshape(n_repeats, m)
+        drops[f] = baseline - (pred == y).mean(axis=1)
+        # Restore the column before shuffling the next one
+        stacked[:, f] = np.tile(X[:, f], n_repeats)
+    return {
+        "baseline_accuracy": round(baseline, 6),
+        "rows": int(m),
+        "repeats": int(n_repeats),
+        "mean": {str(c): round(float(v), 6) for c, v in zip(columns, drops.mean(axis=1))},
+        "std": {str(c): round(float(v), 6) for c, v in zip(columns, drops.std(axis=1))},
+    }
+
+
+class RowAttributions:
+    """Path contributions of a dataset's rows, computed per row on demand.
+
+    `features(row)` returns the scaled feature row (shape (1, n_features)) that
+    `forest` explains. `mean_abs` is the mean absolute contribution of each
+    feature to the predicted class over the dataset (see `compute`).
+    """
+
+    def __init__(self, forest, features: Callable[[int], np.ndarray], columns: Sequence[str],
+                 classes: Sequence[str], mean_abs: Dict[str, float], cache_rows: int = CACHE_ROWS):
+        self.forest = forest
+        self._features = features
+        self.bias = forest.value[forest.roots].mean(axis=0, dtype=np.float64)
+        self.columns = [str(c) for c in columns]
+        self.classes = [str(c) for c in classes]
+        self.mean_abs = mean_abs
+        self.cache_rows = cache_rows
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def compute(cls, forest, X_batches: Iterable, pred_class: np.ndarray, features: Callable[[int], np.ndarray],
+                columns: Sequence[str], classes: Sequence[str]) -> 'RowAttributions':
+        """Measure `mean_abs` over the scaled (start, X) batches of the dataset, rows scored as `pred_class`.
+
+        Each batch's contributions are reduced to per-feature sums and dropped.
+        """
+        total = np.zeros(len(columns))
+        scored = 0
+        for start, X in X_batches:
+            _, contrib = forest.contributions(X)
+            predicted = pred_class[start:start + len(X)]
+            rows = np.flatnonzero(predicted >= 0)
+            total += np.abs(contrib[rows, :, predicted[rows]]).sum(axis=0)
+            scored += rows.size
+        mean_abs = {str(c): round(float(v), 6) for c, v in zip(columns, total / scored)} if scored else {}
+        return cls(forest, features, columns, classes, mean_abs)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes the row cache holds when full (the forest belongs to the caller)."""
+        return int(self.cache_rows * len(self.columns) * len(self.classes) * np.dtype(np.float64).itemsize)
+
+    def row(self, row: int) -> np.ndarray:
+        """Contributions of `row`, shape (n_features, n_classes)."""
+        with self._lock:
+            values = self._cache.get(row)
+            if values is not None:
+                self._cache.move_to_end(row)
+                return values
+        values = self.forest.contributions(self._features(row))[1][0]
+        with self._lock:
+            self._cache[row] = values
+            while len(self._cache) > self.cache_rows:
+                self._cache.popitem(last=False)
+        return values
+
+    def top(self, row: int, class_index: int, limit: Optional[int] = None) -> dict:
+        """The `limit` features (all if None) contributing most to class `class_index` for `row`.
+
+        Returns {"base_value", "contributions": [{"feature", "contribution"}, ...],
+        "other"} with features sorted by absolute contribution; "other" sums the rest.
+        """
+        values = self.row(row)[:, class_index]
+        order = np.argsort(-np.abs(values), kind='stable')
+        shown = order if limit is None else order[:limit]
+        return {
+            "base_value": round(float(self.bias[class_index]), 6),
+            "contributions": [{"feature": self.columns[f], "contribution": round(float(values[f]), 6)}
+                              for f in shown],
+            "other": round(float(values[order[len(shown):]].sum()), 6),
+        }
+
+
+def ranked(scores: Dict[str, float]) -> List[dict]:
+    """[{"feature", "importance"}, ...] sorted by decreasing importance."""
+    return [{"feature": f, "importance": v} for f, v in sorted(scores.items(), key=lambda kv: -kv[1])]
@@ -0,0 +1,417 @@
+"""Reproducible benchmarks for the backend.
+
+Generates synthetic Kepler-shaped CSVs (the real cumulative table's column names:
+identifiers, dispositions and metadata from `COLUMNS_TO_DROP` plus the numeric
+koi_* features), then for each size:
+
+- times `load_csv` (without and with the `.npy` cache), `preprocess`,
+  `train_model` (a fresh fit, artifacts disabled) and `predict_by_kepid`;
+- drives `/GeneralData`, `/planet/kepoi/<name>`, `/predict/<kepid>` and
+  `/planets` through Flask's test client.
+
+Every measurement records latency percentiles, throughput and the peak resident
+memory seen while it ran. Results are written as JSON so runs on different
+commits can be compared (`--compare`).
+
+Usage (from backend/):
+    python benchmark.py                                  # 10k, 100k and 1M rows
+    python benchmark.py --sizes 10000 --numest 20 --out before.json
+    python benchmark.py --sizes 10000 --numest 20 --out after.json --compare before.json
+
+Synthetic CSVs are generated once into `--workdir` and reused. The server's own
+directories (uploads, artifacts, caches) are created there too, so a run never
+touches the real ones.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+GENERATE_CHUNK_ROWS = 100_000
+
+# Numeric columns of the cumulative KOI table: (name, generator(rng, n))
+FEATURES = {
+    'koi_fpflag_nt': lambda r, n: r.integers(0, 2, n),
+    'koi_fpflag_ss': lambda r, n: r.integers(0, 2, n),
+    'koi_fpflag_co': lambda r, n: r.integers(0, 2, n),
+    'koi_fpflag_ec': lambda r, n: r.integers(0, 2, n),
+    'koi_period': lambda r, n: r.lognormal(2.5, 1.2, n),
+    'koi_period_err1': lambda r, n: r.lognormal(-9, 2, n),
+    'koi_period_err2': lambda r, n: -r.lognormal(-9, 2, n),
+    'koi_time0bk': lambda r, n: r.normal(160, 40, n),
+    'koi_time0bk_err1': lambda r, n: r.lognormal(-5, 1.5, n),
+    'koi_time0bk_err2': lambda r, n: -r.lognormal(-5, 1.5, n),
+    'koi_impact': lambda r, n: r.gamma(1.5, 0.4, n),
+    'koi_impact_err1': lambda r, n: r.lognormal(-1.5, 1, n),
+    'koi_impact_err2': lambda r, n: -r.lognormal(-1.5, 1, n),
+    'koi_duration': lambda r, n: r.lognormal(1.4, 0.6, n),
+    'koi_duration_err1': lambda r, n: r.lognormal(-2, 1, n),
+    'koi_duration_err2': lambda r, n: -r.lognormal(-2, 1, n),
+    'koi_depth': lambda r, n: r.lognormal(6, 1.8, n),
+    'koi_depth_err1': lambda r, n: r.lognormal(3, 1, n),
+    'koi_depth_err2': lambda r, n: -r.lognormal(3, 1, n),
+    'koi_prad': lambda r, n: r.lognormal(1, 1.2, n),
+    'koi_prad_err1': lambda r, n: r.lognormal(-0.5, 1, n),
+    'koi_prad_err2': lambda r, n: -r.lognormal(-0.5, 1, n),
+    'koi_teq': lambda r, n: r.normal(1000, 400, n).clip(100),
+    'koi_insol': lambda r, n: r.lognormal(4, 2.5, n),
+    'koi_insol_err1': lambda r, n: r.lognormal(3, 2, n),
+    'koi_insol_err2': lambda r, n: -r.lognormal(3, 2, n),
+    'koi_model_snr': lambda r, n: r.lognormal(3.5, 1.3, n),
+    'koi_tce_plnt_num': lambda r, n: r.integers(1, 5, n),
+    'koi_steff': lambda r, n: r.normal(5700, 700, n),
+    'koi_steff_err1': lambda r, n: r.normal(140, 40, n),
+    'koi_steff_err2': lambda r, n: -r.normal(160, 40, n),
+    'koi_slogg': lambda r, n: r.normal(4.3, 0.4, n),
+    'koi_slogg_err1': lambda r, n: r.lognormal(-2, 0.5, n),
+    'koi_slogg_err2': lambda r, n: -r.lognormal(-2, 0.5, n),
+    'koi_srad': lambda r, n: r.lognormal(0, 0.4, n),
+    'koi_srad_err1': lambda r, n: r.lognormal(-1.5, 0.8, n),
+    'koi_srad_err2': lambda r, n: -r.lognormal(-1.5, 0.8, n),
+    'ra': lambda r, n: r.uniform(280, 302, n),
+    'dec': lambda r, n: r.uniform(36, 52, n),
+    'koi_kepmag': lambda r, n: r.normal(14.3, 1.3, n),
+}
+DISPOSITIONS = ('CONFIRMED', 'FALSE POSITIVE', 'CANDIDATE')
+DISPOSITION_WEIGHTS = (0.3, 0.5, 0.2)
+# Share of missing values in each feature column
+MISSING_RATE = 0.03
+
+
+# --- synthetic data ---
+
+def _metadata(name, rng, n, start, disp):
+    """Values for the non-feature columns listed in COLUMNS_TO_DROP."""
+    ids = np.arange(start, start + n)
+    if name == 'kepid':
+        # About 1.3 KOIs per star, like the real table
+        return 757_000 + (ids * 10 // 13)
+    if name == 'kepoi_name':
+        return [f"K{i:05d}.{i % 3 + 1:02d}" for i in ids]
+    if name == 'kepler_name':
+        return [f"Kepler-{i} b" if d == 'CONFIRMED' else None for i, d in zip(ids, disp)]
+    if name in ('koi_disposition', 'koi_pdisposition'):
+        return disp
+    if name == 'koi_score':
+        return rng.random(n).round(3)
+    if name == 'koi_vet_date':
+        return ['2018-08-16'] * n
+    if name == 'koi_vet_stat':
+        return ['Done'] * n
+    if name == 'koi_tce_delivname':
+        return ['q1_q17_dr25_tce'] * n
+    if name == 'koi_comment':
+        return ['NO_COMMENT'] * n
+    return [f"{name[4:].upper()}_SYNTH"] * n
+
+
+def generate_kepler_csv(path, n_rows, columns_to_drop, seed=0):
+    """Write a synthetic cumulative-KOI-shaped CSV with `n_rows` rows, in chunks."""
+    rng = np.random.default_rng(seed)
+    tmp = f"{path}.tmp"
+    header = True
+    for start in range(0, n_rows, GENERATE_CHUNK_ROWS):
+        n = min(GENERATE_CHUNK_ROWS, n_rows - start)
+        disp = rng.choice(DISPOSITIONS, n, p=DISPOSITION_WEIGHTS)
+        data = {name: _metadata(name, rng, n, start, disp) for name in columns_to_drop}
+        for name, gen in FEATURES.items():
+            values = np.asarray(gen(rng, n), dtype=np.float64)
+            # Features are weakly informative so the forest has something to learn
+            if name in ('koi_fpflag_nt', 'koi_fpflag_ss', 'koi_fpflag_co'):
+                values = np.where(disp == 'FALSE POSITIVE', rng.random(n) < 0.6, values).astype(np.float64)
+            values[rng.random(n) < MISSING_RATE] = np.nan
+            data[name] = values
+        pd.DataFrame(data).to_csv(tmp, index=False, header=header, mode='w' if header else 'a')
+        header = False
+    os.replace(tmp, path)
+    return path
+
+
+def dataset_path(workdir, n_rows, seed):
+    return os.path.join(workdir, f"kepler_synth_{n_rows}_s{seed}.csv")
+
+
+# --- measurement ---
+
+def _rss_bytes():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class PeakMemory:
+    """Samples the process RSS in a thread; `peak` is the high-water mark above the start."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start = None
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start = _rss_bytes()
+        if self.start is not None:
+            self.peak = self.start
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = _rss_bytes()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            rss = _rss_bytes()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+        return False
+
+    def result(self):
+        if self.start is None:
+            return {}
+        return {"rss_start_mb": round(self.start / 2**20, 1), "peak_rss_mb": round(self.peak / 2**20, 1),
+                "peak_growth_mb": round((self.peak - self.start) / 2**20, 1)}
+
+
+def summarize(seconds, extra=None):
+    """Latency percentiles (ms) and throughput for a list of per-call durations."""
+    s = np.asarray(seconds, dtype=np.float64)
+    total = float(s.sum())
+    out = {
+        "calls": int(len(s)),
+        "total_s": round(total, 4),
+        "mean_ms": round(float(s.mean()) * 1e3, 3),
+        "min_ms": round(float(s.min()) * 1e3, 3),
+        "p50_ms": round(float(np.percentile(s, 50)) * 1e3, 3),
+        "p90_ms": round(float(np.percentile(s, 90)) * 1e3, 3),
+        "p99_ms": round(float(np.percentile(s, 99)) * 1e3, 3),
+        "max_ms": round(float(s.max()) * 1e3, 3),
+        "per_second": round(len(s) / total, 2) if total else None,
+    }
+    out.update(extra or {})
+    return out
+
+
+def measure(fn, calls, setup=None):
+    """Run `fn` `calls` times (after `setup()` each time, untimed). Returns (summary, last result)."""
+    seconds = []
+    result = None
+    with PeakMemory() as mem:
+        for _ in range(calls):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            result = fn()
+            seconds.append(time.perf_counter() - start)
+    return summarize(seconds, mem.result()), result
+
+
+def measure_requests(client, urls, warmup=1):
+    """GET every url in turn through the test client."""
+    for url in urls[:warmup]:
+        client.get(url)
+    seconds = []
+    sizes = []
+    statuses = {}
+    with PeakMemory() as mem:
+        for url in urls:
+            start = time.perf_counter()
+            resp = client.get(url)
+            body = resp.get_data()
+            seconds.append(time.perf_counter() - start)
+            sizes.append(len(body))
+            statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+    extra = {"mean_bytes": int(np.mean(sizes)), "statuses": {str(k): v for k, v in sorted(statuses.items())}}
+    extra.update(mem.result())
+    out = summarize(seconds, extra)
+    total = out['total_s']
+    out['mb_per_second'] = round(sum(sizes) / 2**20 / total, 2) if total else None
+    return out
+
+
+# --- benchmark ---
+
+def bench_size(nasa, csv_path, args, rng):
+    results = {"dataset": {"path": os.path.basename(csv_path), "bytes": os.path.getsize(csv_path)}, "phases": {}}
+    phases = results['phases']
+
+    nasa.cfg['path'] = csv_path
+    cache_dir = nasa.ingest.cache_dir_for(csv_path)
+
+    def drop_cache():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print(f"  load_csv (no cache) x{args.repeat}")
+    nasa.cfg['dataset_cache'] = False
+    phases['load_csv'], df = measure(lambda: nasa.load_csv(csv_path), args.repeat)
+    nasa.cfg['dataset_cache'] = True
+    print("  load_csv (building the cache)")
+    phases['load_csv_cache_build'], _ = measure(lambda: nasa.load_csv(csv_path), 1, setup=drop_cache)
+    print(f"  load_csv (cached) x{args.repeat}")
+    phases['load_csv_cached'], df = measure(lambda: nasa.load_csv(csv_path), args.repeat)
+    results['dataset']['rows_kept'] = int(len(df))
+
+    print(f"  preprocess x{args.repeat}")
+    phases['preprocess'], _ = measure(lambda: nasa.preprocess(df), args.repeat)
+    del df
+
+    print(f"  train_model x{args.train_repeat} (numest={nasa.cfg['numest']})")
+    phases['train_model'], ok = measure(nasa.train_model, args.train_repeat)
+    if not ok:
+        raise RuntimeError(f"Training failed: {nasa.model_info}")
+    mv = nasa.active_version
+    results['model'] = {k: mv.model_info.get(k) for k in ('accuracy', 'n_features', 'n_samples')}
+
+    records = mv.dataset.records_at(rng.integers(0, len(mv.dataset), args.requests))
+    kepids = [r['kepid'] for r in records]
+    names = [r['kepoi_name'] for r in records]
+
+    print(f"  predict_by_kepid x{args.requests}")
+    it = iter(kepids)
+    phases['predict_by_kepid'], _ = measure(lambda: nasa.predict_by_kepid(next(it)), len(kepids))
+
+    client = nasa.app.test_client()
+    heavy = max(3, args.requests // 20)
+    endpoints = {
+        '/GeneralData': ['/GeneralData'] * heavy,
+        '/planet/kepoi/<kepoi_name>': [f"/planet/kepoi/{n}" for n in names],
+        '/predict/<kepid>': [f"/predict/{k}" for k in kepids],
+        '/planets': ['/planets'] * heavy,
+    }
+    results['endpoints'] = {}
+    for route, urls in endpoints.items():
+        print(f"  GET {route} x{len(urls)}")
+        results['endpoints'][route] = measure_requests(client, urls)
+    return results
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True, text=True,
+                             timeout=10)
+        commit = out.stdout.strip() or None
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=HERE,
+                               capture_output=True, text=True, timeout=10).stdout.strip()
+        return f"{commit}-dirty" if commit and dirty else commit
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    import flask
+    import sklearn
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sklearn": sklearn.__version__,
+        "flask": flask.__version__ if hasattr(flask, '__version__') else None,
+        "rss_source": "psutil" if psutil is not None else "/proc/self/statm",
+    }
+
+
+def compare(new, old_path):
+    """Print the change of p50 latency (and peak memory growth) for every shared measurement."""
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    print(f"\nCompared with {old_path} (commit {old.get('environment', {}).get('commit')}):")
+    for size, res in new['sizes'].items():
+        before = old.get('sizes', {}).get(size)
+        if before is None:
+            continue
+        print(f"  {size} rows")
+        for group in ('phases', 'endpoints'):
+            for name, m in res.get(group, {}).items():
+                b = before.get(group, {}).get(name)
+                if not b or not b.get('p50_ms'):
+                    continue
+                change = (m['p50_ms'] - b['p50_ms']) / b['p50_ms'] * 100
+                mem = ''
+                if 'peak_growth_mb' in m and 'peak_growth_mb' in b:
+                    mem = f"  peak +{b['peak_growth_mb']} -> +{m['peak_growth_mb']} MB"
+                print(f"    {name:<30} p50 {b['p50_ms']:>10.2f} -> {m['p50_ms']:>10.2f} ms ({change:+.1f}%){mem}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the nasa.py backend on synthetic Kepler CSVs")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="rows per dataset")
+    parser.add_argument('--workdir', default=os.path.join(HERE, 'benchmark_data'),
+                        help="where datasets and server state are kept (default: backend/benchmark_data)")
+    parser.add_argument('--out', default=None, help="results file (default: <workdir>/results-<commit>.json)")
+    parser.add_argument('--compare', default=None, help="earlier results file to compare against")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the data and the request mix")
+    parser.add_argument('--numest', type=int, default=None, help="trees per forest (default: the server's cfg)")
+    parser.add_argument('--mxdepth', type=int, default=None, help="max tree depth (default: the server's cfg)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs of load_csv / preprocess")
+    parser.add_argument('--train-repeat', type=int, default=1, help="runs of train_model")
+    parser.add_argument('--requests', type=int, default=200, help="calls per lookup endpoint")
+    args = parser.parse_args(argv)
+
+    workdir = os.path.abspath(args.workdir)
+    os.makedirs(workdir, exist_ok=True)
+    # nasa.py creates its directories under the cwd at import time
+    os.chdir(workdir)
+    os.environ.setdefault('GENAI_BACKEND', 'stub')
+    sys.path.insert(0, HERE)
+    import nasa
+
+    nasa.cfg.update(use_artifacts=False, artifact_dir=os.path.join(workdir, 'model_artifacts'))
+    if args.numest is not None:
+        nasa.cfg['numest'] = args.numest
+    if args.mxdepth is not None:
+        nasa.cfg['mxdepth'] = args.mxdepth
+
+    results = {"environment": environment(), "args": vars(args),
+               "config": {k: nasa.cfg[k] for k in ('numest', 'mxdepth', 'randstate')}, "sizes": {}}
+    rng = np.random.default_rng(args.seed)
+    for n_rows in args.sizes:
+        path = dataset_path(workdir, n_rows, args.seed)
+        if not os.path.isfile(path):
+            print(f"Generating {n_rows} rows -> {path}")
+            generate_kepler_csv(path, n_rows, nasa.COLUMNS_TO_DROP, seed=args.seed)
+        print(f"Benchmarking {n_rows} rows")
+        results['sizes'][str(n_rows)] = bench_size(nasa, path, args, rng)
+
+    out = args.out or os.path.join(workdir, f"results-{results['environment']['commit'] or 'local'}.json")
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"Results written to {out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
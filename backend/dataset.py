@@ -0,0 +1,180 @@
+"""Typed columns of the per-row fields the API serves (the GeneralData entry).
+
+The detail, search and prediction endpoints return the same dozen fields for
+a row. `CompactDataset` holds them for every row of a model version as typed
+arrays and builds an entry only when one is asked for:
+
+- `kepid` as an integer array, with the dtype's minimum marking missing ids;
+- `kepoi_name` and `kepler_name` as Arrow-backed string arrays (one buffer per
+  column, not one Python object per row), `koi_disposition` as a categorical;
+- the served measurements (`koi_period`, `koi_depth`, ...) as float64, which keeps
+  the CSV precision (NaN for missing).
+
+The arrays are the processed dataframe's own columns wherever they already have
+these types: the numeric ones memory-mapped from the ingest cache, the
+categorical disposition. Name columns parsed as Python objects are converted
+once and `shared_frame()` puts the converted arrays back into the dataframe, so
+every field is stored once for the frame (`/planets`, `/stats`, queries, model
+features) and the entries.
+
+`record(i)` returns the entry of row `i`, and `records_json()` the GeneralData
+body, encoded a chunk of rows at a time.
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import payloads
+
+
+STR_FIELDS = ('kepler_name', 'kepoi_name', 'koi_disposition')
+NUM_FIELDS = ('koi_steff', 'koi_duration', 'koi_srad', 'koi_slogg', 'koi_model_snr', 'koi_depth', 'koi_period')
+# Rows turned into dicts at a time by records_json()
+CHUNK_ROWS = 5000
+
+
+def _strings(df: pd.DataFrame, col: str):
+    """String column as a categorical or Arrow string array (the frame's own when it is one); None if absent."""
+    if col not in df:
+        return None
+    s = df[col]
+    if isinstance(s.dtype, pd.CategoricalDtype) or isinstance(s.dtype, pd.StringDtype):
+        return s.array
+    values = s.astype(str).astype(object).where(s.notna().to_numpy(), None)
+    return pd.array(values.tolist(), dtype=str)
+
+
+def _numbers(df: pd.DataFrame, col: str) -> Optional[np.ndarray]:
+    """Served numeric column: int when integer without gaps, else float64 with NaN; None if absent."""
+    if col not in df:
+        return None
+    s = df[col]
+    if pd.api.types.is_integer_dtype(s.dtype) and not s.isna().any():
+        return s.to_numpy()
+    if s.dtype == np.float64:
+        return s.to_numpy()
+    return pd.to_numeric(s, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _ids(df: pd.DataFrame, col: str) -> np.ndarray:
+    """Truncated integer ids (the column itself when it is integer); the dtype's minimum where missing."""
+    if col not in df:
+        return np.full(len(df), np.iinfo(np.int32).min, dtype=np.int32)
+    s = df[col]
+    if pd.api.types.is_integer_dtype(s.dtype) and isinstance(s.dtype, np.dtype):
+        return s.to_numpy()
+    vals = pd.to_numeric(s, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    valid = np.isfinite(vals)
+    ints = np.trunc(np.where(valid, vals, 0)).astype(np.int64)
+    info = np.iinfo(np.int32)
+    dtype = np.int32 if (not valid.any() or (ints[valid].min() > info.min and ints[valid].max() <= info.max)) else np.int64
+    ints = ints.astype(dtype)
+    ints[~valid] = np.iinfo(dtype).min
+    return ints
+
+
+def _shares(a, b) -> bool:
+    if isinstance(a, np.ndarray) and isinstance(b, np.ndarray):
+        return np.shares_memory(a, b)
+    return a is b
+
+
+class CompactDataset:
+    """The GeneralData fields of every row as typed arrays."""
+
+    def __init__(self, strings: Dict[str, Optional[pd.api.extensions.ExtensionArray]],
+                 numbers: Dict[str, Optional[np.ndarray]], kepid: np.ndarray):
+        self.strings = strings
+        self.numbers = numbers
+        self.kepid = kepid
+        self._missing_id = np.iinfo(kepid.dtype).min
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'CompactDataset':
+        return cls({f: _strings(df, f) for f in STR_FIELDS}, {f: _numbers(df, f) for f in NUM_FIELDS},
+                   _ids(df, 'kepid'))
+
+    def shared_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """`df` with the string columns this dataset converted replaced by its arrays.
+
+        Returns `df` itself when there is nothing to replace. Other columns are not
+        copied (copy-on-write), so memory-mapped ones stay mapped.
+        """
+        converted = {f: a for f, a in self.strings.items() if a is not None and df[f].array is not a}
+        if not converted:
+            return df
+        df = df.assign(**converted)
+        for f in converted:
+            self.strings[f] = df[f].array
+        return df
+
+    def __len__(self):
+        return len(self.kepid)
+
+    def _arrays(self) -> dict:
+        arrays = {f: a for f, a in self.strings.items() if a is not None}
+        arrays.update({f: a for f, a in self.numbers.items() if a is not None})
+        arrays['kepid'] = self.kepid
+        return arrays
+
+    def nbytes_outside(self, df: pd.DataFrame) -> int:
+        """Bytes of the arrays that are not columns (or views of columns) of `df`."""
+        total = 0
+        for f, a in self._arrays().items():
+            if f in df and _shares(a, df[f].to_numpy() if isinstance(a, np.ndarray) else df[f].array):
+                continue
+            total += a.nbytes
+        return int(total)
+
+    def _column(self, field: str, start: int, stop: int) -> List:
+        """Values of `field` for rows start..stop as JSON-ready Python objects (None where missing)."""
+        if field in self.strings:
+            arr = self.strings[field]
+            if arr is None:
+                return [None] * (stop - start)
+            if isinstance(arr, pd.Categorical):
+                codes = arr.codes[start:stop]
+                values = np.asarray(arr.categories, dtype=object)[np.maximum(codes, 0)]
+                values[codes < 0] = None
+                return values.tolist()
+            return arr[start:stop].to_numpy(dtype=object, na_value=None).tolist()
+        if field == 'kepid':
+            part = self.kepid[start:stop]
+            values = part.astype(object)
+            values[part == self._missing_id] = None
+            return values.tolist()
+        arr = self.numbers[field]
+        if arr is None:
+            return [None] * (stop - start)
+        part = arr[start:stop]
+        if part.dtype.kind != 'f':
+            return part.tolist()
+        values = part.astype(object)
+        values[np.isnan(part)] = None
+        return values.tolist()
+
+    def records(self, start: int = 0, stop: Optional[int] = None) -> List[dict]:
+        """GeneralData entries of rows start..stop, built column-wise."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = max(0, min(start, stop))
+        cols = {f: self._column(f, start, stop) for f in STR_FIELDS + NUM_FIELDS}
+        cols['kepid'] = self._column('kepid', start, stop)
+        cols['name'] = [k if k not in (None, '') else o for k, o in zip(cols['kepler_name'], cols['kepoi_name'])]
+        keys = list(cols)
+        return [dict(zip(keys, vals)) for vals in zip(*(cols[k] for k in keys))]
+
+    def record(self, i: int) -> dict:
+        """GeneralData entry of row position `i`."""
+        return self.records(int(i), int(i) + 1)[0]
+
+    def records_at(self, rows: Iterable[int]) -> List[dict]:
+        return [self.record(i) for i in rows]
+
+    def records_json(self, start: int = 0, chunk_rows: int = CHUNK_ROWS) -> bytes:
+        """JSON array of the entries from row `start` on, as `payloads.dumps(self.records(start))` would give."""
+        parts = []
+        for s in range(start, len(self), chunk_rows):
+            parts.append(payloads.dumps(self.records(s, s + chunk_rows))[1:-1])
+        return b'[' + b','.join(parts) + b']'
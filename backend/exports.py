@@ -0,0 +1,189 @@
+"""Streaming table exports (JSON, NDJSON, CSV, Arrow) straight from DataFrame columns.
+
+`/planets` used to build one dict per row for the whole dataset and serialize it
+in one go. These generators instead encode each selected column of a
+fixed-size chunk of rows at once (NumPy does the number formatting) and yield
+the chunk's text, so memory stays flat and the first bytes leave immediately.
+
+Values match what `json.dumps` / `csv` would produce from the records, except
+that float32 features are written with their shortest float32 representation
+(`0.3` rather than `0.30000001192092896`). Missing values are `null` in JSON and
+empty in CSV.
+
+Arrow output (IPC stream format, one record batch per chunk) needs the optional
+`pyarrow` package.
+"""
+
+import csv
+import io
+import json
+from typing import Callable, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+FORMATS = ('json', 'ndjson', 'csv', 'arrow')
+MIMETYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+# Rows encoded and yielded per chunk
+CHUNK_ROWS = 2000
+
+
+def arrow_available() -> bool:
+    return pa is not None
+
+
+def _float_texts(values: np.ndarray, missing: str) -> List[str]:
+    """Shortest round-trip text of each float (per its own dtype), `missing` for NaN/inf."""
+    texts = values.astype(str)
+    finite = np.isfinite(values)
+    if not finite.all():
+        texts = np.where(finite, texts, missing)
+    return texts.tolist()
+
+
+def _column_encoder(series: pd.Series, for_json: bool) -> Callable[[int, int], List[str]]:
+    """Return encode(start, stop) -> list of value texts for rows start..stop of `series`.
+
+    JSON texts are JSON literals; CSV texts are raw cell values (the csv writer quotes them).
+    """
+    dtype = series.dtype
+    missing = 'null' if for_json else ''
+
+    if isinstance(dtype, pd.CategoricalDtype):
+        cats = [json.dumps(str(c)) if for_json else str(c) for c in dtype.categories]
+        lookup = np.array(cats + [missing], dtype=object)
+        codes = series.cat.codes.to_numpy()
+        return lambda a, b: lookup[codes[a:b]].tolist()
+
+    if pd.api.types.is_bool_dtype(dtype) and not series.hasnans:
+        values = series.to_numpy(dtype=bool)
+        true, false = ('true', 'false') if for_json else ('True', 'False')
+        return lambda a, b: np.where(values[a:b], true, false).tolist()
+
+    if pd.api.types.is_integer_dtype(dtype):
+        if series.hasnans:
+            # Nullable integers
+            values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            return lambda a, b: [missing if v != v else str(int(v)) for v in values[a:b].tolist()]
+        values = series.to_numpy()
+        return lambda a, b: values[a:b].astype(str).tolist()
+
+    if pd.api.types.is_float_dtype(dtype):
+        values = series.to_numpy(dtype=dtype.numpy_dtype if hasattr(dtype, 'numpy_dtype') else dtype,
+                                 na_value=np.nan)
+        return lambda a, b: _float_texts(values[a:b], missing)
+
+    # Strings and anything else
+    values = series.to_numpy(dtype=object)
+    if for_json:
+        def encode(a, b):
+            return [missing if v is None or v is pd.NA or v != v else json.dumps(v if isinstance(v, str) else str(v))
+                    for v in values[a:b].tolist()]
+    else:
+        def encode(a, b):
+            return [missing if v is None or v is pd.NA or v != v else str(v) for v in values[a:b].tolist()]
+    return encode
+
+
+def _chunks(start: int, stop: int, chunk_rows: int):
+    for a in range(start, stop, chunk_rows):
+        yield a, min(stop, a + chunk_rows)
+
+
+def iter_json(df: pd.DataFrame, fields: Sequence[str], start: int, stop: int, ndjson: bool = False,
+              chunk_rows: int = CHUNK_ROWS) -> Iterator[str]:
+    """A JSON array of row objects (or NDJSON, one object per line) for rows start..stop."""
+    encoders = [_column_encoder(df[f], for_json=True) for f in fields]
+    keys = [json.dumps(str(f)) + ':' for f in fields]
+    first = True
+    if not ndjson:
+        yield '['
+    for a, b in _chunks(start, stop, chunk_rows):
+        cols = [enc(a, b) for enc in encoders]
+        objects = ['{' + ','.join([k + v for k, v in zip(keys, row)]) + '}' for row in zip(*cols)]
+        if ndjson:
+            yield '\n'.join(objects) + '\n'
+        else:
+            yield ('' if first else ',') + ','.join(objects)
+        first = False
+    if not ndjson:
+        yield ']'
+
+
+def iter_csv(df: pd.DataFrame, fields: Sequence[str], start: int, stop: int,
+             chunk_rows: int = CHUNK_ROWS) -> Iterator[str]:
+    """CSV with a header row, for rows start..stop."""
+    encoders = [_column_encoder(df[f], for_json=False) for f in fields]
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerow(fields)
+    for a, b in _chunks(start, stop, chunk_rows):
+        writer.writerows(zip(*[enc(a, b) for enc in encoders]))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def _arrow_schema(df: pd.DataFrame, fields: Sequence[str]):
+    # Inferred from a few rows, with object columns declared as strings so every
+    # chunk (including all-null ones) has the same schema
+    sample = df[list(fields)].iloc[:100]
+    schema = pa.Schema.from_pandas(sample, preserve_index=False)
+    for i, f in enumerate(fields):
+        dtype = sample[f].dtype
+        if not isinstance(dtype, pd.CategoricalDtype) and (dtype == object or pd.api.types.is_string_dtype(dtype)):
+            schema = schema.set(i, pa.field(str(f), pa.string()))
+    return schema
+
+
+def iter_arrow(df: pd.DataFrame, fields: Sequence[str], start: int, stop: int,
+               chunk_rows: int = CHUNK_ROWS) -> Iterator[bytes]:
+    """Arrow IPC stream with one record batch per chunk, for rows start..stop."""
+    if pa is None:
+        raise RuntimeError("Arrow output needs the pyarrow package")
+    schema = _arrow_schema(df, fields)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        yield _drain(sink)
+        for a, b in _chunks(start, stop, chunk_rows):
+            part = df[list(fields)].iloc[a:b]
+            writer.write_batch(pa.RecordBatch.from_pandas(part, schema=schema, preserve_index=False))
+            yield _drain(sink)
+    yield _drain(sink)
+
+
+def _drain(sink: io.BytesIO) -> bytes:
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+def iter_table(fmt: str, df: pd.DataFrame, fields: Optional[Sequence[str]] = None, offset: int = 0,
+               limit: Optional[int] = None, chunk_rows: int = CHUNK_ROWS):
+    """Generator for `fmt` over rows offset..offset+limit of `df`, columns `fields` (all by default)."""
+    fields = list(df.columns) if fields is None else list(fields)
+    start = min(max(0, offset), len(df))
+    stop = len(df) if limit is None else min(len(df), start + max(0, limit))
+    if fmt == 'json':
+        return iter_json(df, fields, start, stop, chunk_rows=chunk_rows)
+    if fmt == 'ndjson':
+        return iter_json(df, fields, start, stop, ndjson=True, chunk_rows=chunk_rows)
+    if fmt == 'csv':
+        return iter_csv(df, fields, start, stop, chunk_rows=chunk_rows)
+    if fmt == 'arrow':
+        return iter_arrow(df, fields, start, stop, chunk_rows=chunk_rows)
+    raise ValueError(f"Unknown format '{fmt}'. Use one of: {', '.join(FORMATS)}")
@@ -0,0 +1,227 @@
+"""Flattened RandomForest inference.
+
+`CompactForest.from_sklearn()` copies a fitted `RandomForestClassifier` into a few
+flat NumPy arrays holding every node of every tree:
+
+- `feature` (negative for leaves) and `threshold` (float32);
+- `children` (absolute ids of the left and right child of node `i` at `2*i` and
+  `2*i + 1`) and `missing_left` (NaN routing);
+- `value` (class probabilities of each node, float32 by default).
+
+`predict_proba()` walks all (row, tree) pairs one level at a time with vectorized
+NumPy operations, so scoring one row or a small batch has no per-call estimator,
+validation or thread-pool overhead. Large batches are still faster through
+sklearn's compiled traversal; callers pick by batch size (`SMALL_BATCH_ROWS`)
+while they hold the sklearn forest. Saved next to a model artifact, the engine
+is loaded memory-mapped, unlike the sklearn trees (unpickling copies them).
+`contributions()` walks the same paths and attributes each row's probabilities
+to the features split on along the way (see attribution.py).
+
+Predictions match sklearn's: like sklearn, inputs are cast to float32, and each
+threshold is rounded *down* to float32, so `x <= threshold` gives the same answer
+for every float32 `x` as sklearn's float64 comparison. NaN values follow each
+node's `missing_go_to_left`. Probabilities are averaged in float64; with float32
+leaf values they agree with sklearn to ~1e-7. `compile_forest()` checks this on
+sample rows and keeps float64 leaf values if any predicted class differs.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+
+# Batches up to this many rows are faster here than through sklearn
+SMALL_BATCH_ROWS = 256
+# (row, tree) pairs traversed together; bounds the working set of `apply()`
+CHUNK_PAIRS = 65536
+
+
+def _threshold_float32(threshold: np.ndarray) -> np.ndarray:
+    """Largest float32 <= each float64 threshold (exact `x <= t` for float32 x)."""
+    t32 = threshold.astype(np.float32)
+    up = t32.astype(np.float64) > threshold
+    t32[up] = np.nextafter(t32[up], np.float32(-np.inf))
+    return t32
+
+
+class CompactForest:
+    """A RandomForestClassifier as flat node arrays with a vectorized traversal."""
+
+    def __init__(self, feature, threshold, children, missing_left, value, roots, classes, n_features):
+        # Node ids index arrays on every level, so they are kept as intp (no casts)
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes
+        self.n_features = n_features
+
+    @classmethod
+    def from_sklearn(cls, model, value_dtype=np.float32) -> 'CompactForest':
+        trees = [est.tree_ for est in model.estimators_]
+        counts = [t.node_count for t in trees]
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+        if sum(counts) >= np.iinfo(np.int32).max:
+            raise ValueError("Forest too large for int32 node ids")
+        n_features = int(model.n_features_in_)
+
+        feature = np.concatenate([t.feature for t in trees]).astype(np.intp)
+        threshold = _threshold_float32(np.concatenate([t.threshold for t in trees]))
+        # Leaves point at themselves, so finished (row, tree) pairs stay put
+        left = np.concatenate([np.where(t.children_left >= 0, t.children_left + off, np.arange(t.node_count) + off)
+                               for t, off in zip(trees, offsets)])
+        right = np.concatenate([np.where(t.children_right >= 0, t.children_right + off, np.arange(t.node_count) + off)
+                                for t, off in zip(trees, offsets)])
+        children = np.empty(2 * len(left), dtype=np.intp)
+        children[0::2] = left
+        children[1::2] = right
+        missing_left = np.concatenate([np.asarray(t.missing_go_to_left, dtype=bool) for t in trees])
+
+        # Same per-tree normalization as DecisionTreeClassifier.predict_proba
+        values = []
+        for t in trees:
+            v = np.asarray(t.value[:, 0, :], dtype=np.float64)
+            norm = v.sum(axis=1, keepdims=True)
+            norm[norm == 0.0] = 1.0
+            values.append(v / norm)
+        value = np.concatenate(values).astype(value_dtype)
+        return cls(feature, threshold, children, missing_left, value, offsets.astype(np.intp),
+                   np.asarray(model.classes_), n_features)
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.feature)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.feature, self.threshold, self.children,
+                                      self.missing_left, self.value, self.roots))
+
+    def apply(self, X) -> np.ndarray:
+        """Leaf node id reached by every row in every tree, shape (n_rows, n_trees)."""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"X has shape {X.shape}; expected (n, {self.n_features})")
+        m, n_trees = len(X), self.n_trees
+        leaves = np.empty((m, n_trees), dtype=np.intp)
+        step = max(1, CHUNK_PAIRS // n_trees)
+        for start in range(0, m, step):
+            leaves[start:start + step] = self._apply_chunk(X[start:start + step]).reshape(-1, n_trees)
+        return leaves
+
+    def _apply_chunk(self, X: np.ndarray) -> np.ndarray:
+        m, n_features = X.shape
+        flat = np.ascontiguousarray(X).ravel()
+        node = np.tile(self.roots, m)
+        # Offset of each pair's row in `flat`; X[row, f] is flat[base + f]
+        base = np.repeat(np.arange(m, dtype=np.intp) * n_features, self.n_trees)
+        feat = self.feature[node]
+        active = np.flatnonzero(feat >= 0)
+        n, base, feat = node[active], base[active], feat[active]
+        while active.size:
+            x = flat[base + feat]
+            go_right = ~(x <= self.threshold[n])
+            nan = np.isnan(x)
+            if nan.any():
+                go_right[nan] = ~self.missing_left[n[nan]]
+            n = self.children[2 * n + go_right]
+            node[active] = n
+            feat = self.feature[n]
+            inner = feat >= 0
+            if not inner.all():
+                active, n, base, feat = active[inner], n[inner], base[inner], feat[inner]
+        return node
+
+    def predict_proba(self, X) -> np.ndarray:
+        leaves = self.apply(X)
+        return self.value[leaves].sum(axis=1, dtype=np.float64) / self.n_trees
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def contributions(self, X):
+        """Per-feature contributions of every row's path to its class probabilities.
+
+        Returns (bias, contributions): the forest's mean root distribution, shape
+        (n_classes,), and float64 contributions of shape (n_rows, n_features, n_classes).
+        Each split credits its feature with the change in class distribution from the
+        node to the child taken, averaged over trees, so for every row
+        `bias + contributions.sum(axis=1)` equals `predict_proba()`.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"X has shape {X.shape}; expected (n, {self.n_features})")
+        m = len(X)
+        out = np.empty((m, self.n_features, self.value.shape[1]), dtype=np.float64)
+        step = max(1, CHUNK_PAIRS // self.n_trees)
+        for start in range(0, m, step):
+            out[start:start + step] = self._contributions_chunk(X[start:start + step])
+        bias = self.value[self.roots].mean(axis=0, dtype=np.float64)
+        return bias, out
+
+    def _contributions_chunk(self, X: np.ndarray) -> np.ndarray:
+        # Same level-by-level walk as _apply_chunk, summing each step into (row, feature) slots
+        m, n_features = X.shape
+        n_classes = self.value.shape[1]
+        flat = np.ascontiguousarray(X).ravel()
+        n = np.tile(self.roots, m)
+        base = np.repeat(np.arange(m, dtype=np.intp) * n_features, self.n_trees)
+        feat = self.feature[n]
+        inner = feat >= 0
+        n, base, feat = n[inner], base[inner], feat[inner]
+        acc = np.zeros((n_classes, m * n_features), dtype=np.float64)
+        while n.size:
+            x = flat[base + feat]
+            go_right = ~(x <= self.threshold[n])
+            nan = np.isnan(x)
+            if nan.any():
+                go_right[nan] = ~self.missing_left[n[nan]]
+            child = self.children[2 * n + go_right]
+            delta = self.value[child].astype(np.float64) - self.value[n]
+            slot = base + feat
+            for c in range(n_classes):
+                acc[c] += np.bincount(slot, weights=delta[:, c], minlength=m * n_features)
+            n = child
+            feat = self.feature[n]
+            inner = feat >= 0
+            if not inner.all():
+                n, base, feat = n[inner], base[inner], feat[inner]
+        return (acc / self.n_trees).T.reshape(m, n_features, n_classes)
+
+
+def sklearn_nbytes(model) -> int:
+    """Approximate memory held by the trees of a fitted sklearn forest."""
+    total = 0
+    for est in model.estimators_:
+        state = est.tree_.__getstate__()
+        total += state['nodes'].nbytes + state['values'].nbytes
+    return total
+
+
+def compile_forest(model, X_check: Optional[np.ndarray] = None):
+    """Export `model` and verify it against sklearn on `X_check` rows.
+
+    Returns (engine, report). Leaf values are float32 unless that changes a predicted
+    class on the check rows, in which case they are kept as float64.
+    """
+    engine = CompactForest.from_sklearn(model)
+    report = {'trees': engine.n_trees, 'nodes': engine.n_nodes, 'value_dtype': 'float32'}
+    if X_check is not None and len(X_check):
+        expected = model.predict_proba(X_check)
+        got = engine.predict_proba(X_check)
+        mismatches = int((expected.argmax(axis=1) != got.argmax(axis=1)).sum())
+        if mismatches:
+            engine = CompactForest.from_sklearn(model, value_dtype=np.float64)
+            got = engine.predict_proba(X_check)
+            mismatches = int((expected.argmax(axis=1) != got.argmax(axis=1)).sum())
+            report['value_dtype'] = 'float64'
+        report.update(verified_rows=int(len(X_check)), max_abs_diff=float(np.abs(expected - got).max()),
+                      class_mismatches=mismatches)
+    report.update(bytes=engine.nbytes, sklearn_bytes=sklearn_nbytes(model))
+    return engine, report
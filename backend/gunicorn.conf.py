@@ -0,0 +1,18 @@
+"""gunicorn settings for `gunicorn -c gunicorn.conf.py wsgi:app` (see wsgi.py).
+
+Values can be overridden on the command line, e.g. `--workers 8 --bind 0.0.0.0:8000`.
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv('NASA_BIND', '0.0.0.0:80')
+# One process per core for CPU-bound scoring; threads cover I/O-bound requests (Gemini, images)
+workers = int(os.getenv('NASA_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.getenv('NASA_THREADS', 4))
+# Streamed exports and ?wait=1 requests can take a while
+timeout = 300
+graceful_timeout = 30
+# Workers must not be forked from a preloaded app: job queue threads do not survive a fork
+preload_app = False
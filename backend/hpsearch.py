@@ -0,0 +1,274 @@
+"""Hyperparameter search for the RandomForest model.
+
+`run_search()` evaluates a grid of RandomForest settings with stratified k-fold
+cross-validation and successive halving: every candidate is first scored on a
+small subsample of each fold's training rows, the best `1/factor` survive, and
+the survivors are scored again with `factor` times more rows, until the last
+round uses the full folds.
+
+Fold splits and their scaled matrices are computed once per dataset and saved as
+`.npy` files (`prepare_folds()`), so every candidate, every round and later
+searches on the same data reuse them. Fits run in a process pool whose workers
+memory-map those files instead of receiving copies of the data.
+"""
+
+import itertools
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import multiprocessing
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import StratifiedKFold
+from sklearn.preprocessing import StandardScaler
+
+
+# Bump when the fold bundle layout changes
+FOLDS_FORMAT = 1
+
+# Names accepted in a grid; the server's cfg names are aliases of sklearn's
+PARAM_ALIASES = {'numest': 'n_estimators', 'mxdepth': 'max_depth', 'randstate': 'random_state'}
+SEARCH_PARAMS = ('n_estimators', 'max_depth', 'random_state', 'max_features',
+                 'min_samples_leaf', 'min_samples_split', 'criterion')
+INT_PARAMS = ('n_estimators', 'max_depth', 'random_state', 'min_samples_leaf', 'min_samples_split')
+
+MAX_CANDIDATES = 500
+# Smallest number of training rows a candidate is ever scored on
+MIN_RESOURCES = 100
+
+
+def _param_value(name, value):
+    if value is None:
+        return None
+    if name == 'max_depth' and value in (0, '0'):
+        return None
+    if name in INT_PARAMS:
+        return int(value)
+    if name == 'max_features' and not isinstance(value, str):
+        return float(value) if float(value) <= 1 else int(value)
+    return value
+
+
+def _values(name, spec):
+    """Values for one grid entry: a list, {"values": [...]}, {"min", "max", "step"} or a scalar."""
+    if isinstance(spec, dict):
+        if 'values' in spec:
+            spec = spec['values']
+        else:
+            try:
+                lo, hi = spec['min'], spec['max']
+            except KeyError:
+                raise ValueError(f"Range for '{name}' needs 'min' and 'max'")
+            step = spec.get('step', 1)
+            if not step or step <= 0 or hi < lo:
+                raise ValueError(f"Invalid range for '{name}'")
+            spec = list(np.arange(lo, hi + step / 2, step).tolist())
+    if not isinstance(spec, (list, tuple)):
+        spec = [spec]
+    if not spec:
+        raise ValueError(f"No values for '{name}'")
+    return [_param_value(name, v) for v in spec]
+
+
+def expand_grid(grid: dict, base: Optional[dict] = None) -> List[dict]:
+    """Candidate parameter dicts for `grid`, on top of the `base` parameters."""
+    axes = {}
+    for key, spec in grid.items():
+        name = PARAM_ALIASES.get(key, key)
+        if name not in SEARCH_PARAMS:
+            raise ValueError(f"Unknown parameter '{key}'. Allowed: {', '.join(list(PARAM_ALIASES) + list(SEARCH_PARAMS))}")
+        axes[name] = _values(name, spec)
+    n = math.prod(len(v) for v in axes.values()) if axes else 1
+    if n > MAX_CANDIDATES:
+        raise ValueError(f"Grid has {n} candidates; at most {MAX_CANDIDATES} are allowed")
+    names = list(axes)
+    return [dict(base or {}, **dict(zip(names, combo))) for combo in itertools.product(*(axes[k] for k in names))]
+
+
+# --- fold bundles ---
+
+def folds_dir_for(root: str, dataset_key: str, n_folds: int, seed: int) -> str:
+    return os.path.join(root, f"folds_{dataset_key[:16]}_k{n_folds}_s{seed}")
+
+
+def prepare_folds(folds_dir: str, X, y, n_folds: int = 5, seed: int = 42) -> dict:
+    """Write (once) the scaled train/validation matrices of each stratified fold.
+
+    Each fold's StandardScaler is fitted on its own training rows, as the server's
+    training does. Matrices are float32; labels are class indices. Returns the meta dict.
+    """
+    meta_path = os.path.join(folds_dir, 'meta.json')
+    if os.path.isfile(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format') == FOLDS_FORMAT:
+            return meta
+
+    classes, codes = np.unique(np.asarray(y).astype(str), return_inverse=True)
+    X = np.asarray(X, dtype=np.float64)
+    tmp = f"{folds_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        rng = np.random.default_rng(seed)
+        skf = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=seed)
+        sizes = []
+        for i, (tr, va) in enumerate(skf.split(X, codes)):
+            scl = StandardScaler().fit(X[tr])
+            np.save(os.path.join(tmp, f"X_tr_{i}.npy"), scl.transform(X[tr]).astype(np.float32))
+            np.save(os.path.join(tmp, f"y_tr_{i}.npy"), codes[tr].astype(np.int16))
+            np.save(os.path.join(tmp, f"X_va_{i}.npy"), scl.transform(X[va]).astype(np.float32))
+            np.save(os.path.join(tmp, f"y_va_{i}.npy"), codes[va].astype(np.int16))
+            # Subsampling order for the halving rounds: a prefix of this permutation
+            np.save(os.path.join(tmp, f"order_{i}.npy"), rng.permutation(len(tr)).astype(np.int64))
+            sizes.append(int(len(tr)))
+        meta = {'format': FOLDS_FORMAT, 'n_folds': n_folds, 'seed': seed, 'n_rows': int(len(X)),
+                'n_features': int(X.shape[1]), 'classes': classes.tolist(), 'train_sizes': sizes}
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        shutil.rmtree(folds_dir, ignore_errors=True)
+        os.replace(tmp, folds_dir)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return meta
+
+
+# --- worker side ---
+
+_folds = {}
+
+
+def _load_folds(folds_dir: str, n_folds: int):
+    """Process pool initializer: memory-map the fold matrices once per worker."""
+    _folds.clear()
+    for i in range(n_folds):
+        _folds[i] = {name: np.load(os.path.join(folds_dir, f"{name}_{i}.npy"), mmap_mode='r')
+                     for name in ('X_tr', 'y_tr', 'X_va', 'y_va', 'order')}
+
+
+def _fit_and_score(cand: int, params: dict, fold: int, n_rows: int):
+    d = _folds[fold]
+    start = time.perf_counter()
+    rows = np.sort(d['order'][:n_rows])
+    clf = RandomForestClassifier(n_jobs=1, **params)
+    clf.fit(d['X_tr'][rows], d['y_tr'][rows])
+    score = float((clf.predict(d['X_va']) == d['y_va']).mean())
+    return cand, fold, score, time.perf_counter() - start
+
+
+# --- driver ---
+
+def _rounds(n_candidates: int, n_rows: int, factor: int, halving: bool):
+    """Number of training rows used in each round of successive halving."""
+    if not halving or n_candidates <= 1:
+        return [n_rows]
+    rounds = int(math.ceil(math.log(n_candidates, factor))) + 1
+    # Never go below MIN_RESOURCES rows in the first round
+    while rounds > 1 and n_rows / factor ** (rounds - 1) < min(MIN_RESOURCES, n_rows):
+        rounds -= 1
+    return [int(n_rows / factor ** (rounds - 1 - r)) for r in range(rounds)]
+
+
+def run_search(folds_dir: str, meta: dict, candidates: List[dict], factor: int = 3, halving: bool = True,
+               workers: int = 1, on_progress: Optional[Callable[..., None]] = None,
+               check_cancelled: Optional[Callable[[], None]] = None) -> dict:
+    """Successive-halving cross-validation of `candidates` over the prepared folds.
+
+    `on_progress(progress=, **details)` is called after every fit; `check_cancelled()`
+    may raise to stop the search (pending fits are cancelled). Returns the best
+    candidate, a leaderboard and per-round statistics.
+    """
+    n_folds = meta['n_folds']
+    n_rows = min(meta['train_sizes'])
+    schedule = _rounds(len(candidates), n_rows, factor, halving)
+
+    # Total fits, to report progress
+    total = 0
+    alive = len(candidates)
+    for r in range(len(schedule)):
+        total += alive * n_folds
+        alive = max(1, int(math.ceil(alive / factor)))
+
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_load_folds, initargs=(folds_dir, n_folds))
+    else:
+        _load_folds(folds_dir, n_folds)
+
+    results: Dict[int, dict] = {}
+    rounds = []
+    stats = {'done': 0, 'fit_seconds': 0.0, 'tree_rows': 0}
+    started = time.perf_counter()
+
+    def record(task, outcome, scores, r):
+        c, _, score, secs = outcome
+        scores[c].append(score)
+        stats['done'] += 1
+        stats['fit_seconds'] += secs
+        stats['tree_rows'] += task[1].get('n_estimators', 100) * task[3]
+        if on_progress is not None:
+            elapsed = time.perf_counter() - started
+            on_progress(progress=stats['done'] / total, round=r + 1, rounds=len(schedule),
+                        fits_done=stats['done'], fits_total=total,
+                        fits_per_second=stats['done'] / elapsed if elapsed else None,
+                        tree_rows_per_second=stats['tree_rows'] / elapsed if elapsed else None)
+
+    survivors = list(range(len(candidates)))
+    try:
+        for r, rows in enumerate(schedule):
+            tasks = [(c, candidates[c], f, rows) for c in survivors for f in range(n_folds)]
+            scores = {c: [] for c in survivors}
+            if pool is None:
+                for t in tasks:
+                    if check_cancelled is not None:
+                        check_cancelled()
+                    record(t, _fit_and_score(*t), scores, r)
+            else:
+                pending = {pool.submit(_fit_and_score, *t): t for t in tasks}
+                while pending:
+                    finished, _ = wait(list(pending), timeout=1.0, return_when=FIRST_COMPLETED)
+                    if check_cancelled is not None:
+                        try:
+                            check_cancelled()
+                        except Exception:
+                            for fut in pending:
+                                fut.cancel()
+                            raise
+                    for fut in finished:
+                        record(pending.pop(fut), fut.result(), scores, r)
+
+            for c in survivors:
+                s = np.asarray(scores[c])
+                results[c] = {'params': candidates[c], 'mean_score': float(s.mean()),
+                              'std_score': float(s.std()), 'n_rows': rows, 'round': r + 1}
+            ranked = sorted(survivors, key=lambda c: (-results[c]['mean_score'], c))
+            rounds.append({'round': r + 1, 'n_rows': rows, 'n_candidates': len(survivors),
+                           'best_score': results[ranked[0]]['mean_score']})
+            if r < len(schedule) - 1:
+                survivors = ranked[:max(1, int(math.ceil(len(survivors) / factor)))]
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    # Candidates that reached later rounds rank first, then by score
+    leaderboard = sorted(results.values(), key=lambda e: (-e['round'], -e['mean_score']))
+    elapsed = time.perf_counter() - started
+    return {
+        'best': leaderboard[0],
+        'leaderboard': leaderboard[:20],
+        'rounds': rounds,
+        'n_candidates': len(candidates),
+        'n_folds': n_folds,
+        'fits': stats['done'],
+        'elapsed': elapsed,
+        'fit_seconds': stats['fit_seconds'],
+        'fits_per_second': stats['done'] / elapsed if elapsed else None,
+        'tree_rows_per_second': stats['tree_rows'] / elapsed if elapsed else None,
+    }
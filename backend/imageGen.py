@@ -1,19 +1,56 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import io
 from PIL import Image
 import json
+import threading
 import time
-from typing import Optional, Dict, Any
+from typing import Callable, Optional, Dict, Any
 
 # --- Configuration ---
-# Default HF inference API (change if you host your own endpoint)
-API_URL = "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-base-1.0"
+# Default HF inference API. Override with HF_API_URL (e.g. your own endpoint or a local stub server)
+API_URL = os.getenv('HF_API_URL') or "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-base-1.0"
 
 # By default read the token from environment variable 'HF_TOKEN' or 'HF_HUGGINGFACE_TOKEN'
 # It's safer to set this in your shell or systemd unit than hard-coding it.
 DEFAULT_HF_TOKEN = os.getenv('HF_TOKEN') or os.getenv('HF_HUGGINGFACE_TOKEN')
 
+# Retries for 503 "model is loading" answers, with exponential backoff (seconds)
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 2.0
+MAX_BACKOFF = 30.0
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size: int = 4) -> requests.Session:
+    """Shared keep-alive session, so repeated calls reuse TLS connections to the API."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            s.mount('https://', adapter)
+            s.mount('http://', adapter)
+            _session = s
+        return _session
+
+
+def _retry_delay(resp: requests.Response, attempt: int, backoff: float) -> float:
+    """Seconds to wait before retrying a 503: the API's estimated_time if given, else exponential."""
+    delay = backoff * (2 ** attempt)
+    try:
+        estimated = float(resp.json().get('estimated_time'))
+        if estimated > 0:
+            delay = estimated
+    except Exception:
+        pass
+    return min(delay, MAX_BACKOFF)
+
 
 def _detect_content_type_and_return(response: requests.Response):
     content_type = response.headers.get('content-type', '')
@@ -48,7 +85,12 @@ def generate_image(prompt: str,
                    exoplanet_name: Optional[str] = None,
                    wait_for_model: bool = True,
                    return_bytes: bool = False,
-                   timeout: int = 120) -> Dict[str, Any]:
+                   timeout: int = 120,
+                   session: Optional[requests.Session] = None,
+                   retries: int = DEFAULT_RETRIES,
+                   backoff: float = DEFAULT_BACKOFF,
+                   check_cancelled: Optional[Callable[[], None]] = None,
+                   save: bool = True) -> Dict[str, Any]:
     """Generate an image using the HF Inference API.
 
     Args:
@@ -59,9 +101,14 @@ def generate_image(prompt: str,
       wait_for_model: If True, pass option to wait for model to load.
       return_bytes: If True, include raw bytes in the returned dict under 'content'.
       timeout: HTTP request timeout in seconds.
+      session: requests.Session to use (defaults to the shared keep-alive session).
+      retries: How many times to retry a 503 (model loading) response.
+      backoff: Base delay in seconds between retries (doubled each attempt).
+      check_cancelled: Called before each attempt; may raise to abort (used by background jobs).
+      save: If False, nothing is written and the image bytes are returned under 'content'.
 
     Returns:
-      dict with keys: 'ok' (bool), and on success either 'path' or 'content'. On error 'error' key is set.
+      dict with keys: 'ok' (bool), and on success 'path' and/or 'content'. On error 'error' key is set.
     """
     hf_token = hf_token or DEFAULT_HF_TOKEN
     if not hf_token:
@@ -70,10 +117,21 @@ def generate_image(prompt: str,
     headers = {"Authorization": f"Bearer {hf_token}"}
     payload = {"inputs": prompt, "options": {"wait_for_model": bool(wait_for_model)}}
 
-    try:
-        resp = requests.post(api_url, headers=headers, json=payload, timeout=timeout)
-    except Exception as e:
-        return {"ok": False, "error": f"Request failed: {e}"}
+    session = session or get_session()
+    attempt = 0
+    while True:
+        if check_cancelled is not None:
+            check_cancelled()
+        try:
+            resp = session.post(api_url, headers=headers, json=payload, timeout=timeout)
+        except Exception as e:
+            return {"ok": False, "error": f"Request failed: {e}"}
+        if resp.status_code != 503 or attempt >= retries:
+            break
+        delay = _retry_delay(resp, attempt, backoff)
+        print(f"Image model not ready (503), retrying in {delay:.1f}s")
+        time.sleep(delay)
+        attempt += 1
 
     if resp.status_code >= 400:
         # Try to extract error details
@@ -92,6 +150,8 @@ def generate_image(prompt: str,
     # If we got bytes (image) save or return them
     if isinstance(result, (bytes, bytearray)):
         content = bytes(result)
+        if not save:
+            return {"ok": True, "content": content}
 
         # If an exoplanet_name is provided, save to ./exoplanets/<sanitized_name>.png
         if exoplanet_name:
@@ -103,27 +163,36 @@ def generate_image(prompt: str,
         if output_path is None:
             ts = int(time.time())
             output_path = f"generated_image_{ts}.png"
-
-        # Try to write image via PIL to validate and ensure format
+            # If file exists, append a counter to avoid overwriting
+            n = 1
+            while os.path.exists(output_path):
+                output_path = f"generated_image_{ts}_{n}.png"
+                n += 1
+
+        # PNG bytes for a .png path are written as-is; anything else is converted via PIL.
+        # Written to a temp file and renamed so readers never see a partial image.
+        parent = os.path.dirname(output_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        tmp = f"{output_path}.{threading.get_ident()}.tmp"
+        fmt = Image.registered_extensions().get(os.path.splitext(output_path)[1].lower(), 'PNG')
         try:
-            image = Image.open(io.BytesIO(content))
-            # Ensure parent dir exists
-            parent = os.path.dirname(output_path)
-            if parent:
-                os.makedirs(parent, exist_ok=True)
-            image.save(output_path)
-        except Exception:
-            # If PIL fails, still try raw write
-            try:
-                with open(output_path, 'wb') as f:
+            if fmt == 'PNG' and content.startswith(PNG_SIGNATURE):
+                with open(tmp, 'wb') as f:
                     f.write(content)
-            except Exception as e:
-                return {"ok": False, "error": f"Failed to save image: {e}"}
-
-        # If file exists, append timestamp to avoid overwriting
-        if os.path.exists(output_path):
-            base, ext = os.path.splitext(output_path)
-            output_path = f"{base}_{int(time.time())}{ext}"
+            else:
+                try:
+                    Image.open(io.BytesIO(content)).save(tmp, format=fmt)
+                except Exception:
+                    # If PIL fails, still try raw write
+                    with open(tmp, 'wb') as f:
+                        f.write(content)
+            os.replace(tmp, output_path)
+        except Exception as e:
+            return {"ok": False, "error": f"Failed to save image: {e}"}
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
 
         ret = {"ok": True, "path": output_path}
         if return_bytes:
@@ -0,0 +1,232 @@
+"""Content-addressed store for generated exoplanet images.
+
+Images live in one directory (`exoplanets/` by default) under the sha256 of their
+bytes (`<digest>.png`), so identical images are stored once and a file name
+never changes meaning. `manifest.json` maps each normalized kepoi_name to its
+current digest and is kept in memory, so lookups are dict hits and never list
+the directory.
+
+Variants are derived lazily from the original and cached next to it:
+
+- `webp`: full-size WebP;
+- `thumb`: WebP downscaled to `THUMB_SIZE` pixels on the long side (list views).
+
+Replacing a planet's image removes the previous files once no other planet
+points at them. Images written by older versions (`<kepoi_name>.png`, plus the
+`_<timestamp>` copies `generate_image` used to leave behind) are adopted on
+startup: the newest copy per planet is kept, the rest are deleted.
+"""
+
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from PIL import Image, features
+
+
+MANIFEST_NAME = 'manifest.json'
+THUMB_SIZE = 256
+WEBP_QUALITY = 80
+
+VARIANTS = ('original', 'webp', 'thumb')
+
+# Pillow builds without libwebp fall back to PNG variants
+_VARIANT_FORMAT = 'WEBP' if features.check('webp') else 'PNG'
+
+_FORMAT_EXT = {'PNG': 'png', 'JPEG': 'jpg', 'WEBP': 'webp', 'GIF': 'gif'}
+_EXT_MIME = {'png': 'image/png', 'jpg': 'image/jpeg', 'webp': 'image/webp', 'gif': 'image/gif'}
+_LEGACY_EXTS = ('.png', '.jpg', '.jpeg')
+_TIMESTAMP_SUFFIX = re.compile(r'_\d{9,}$')
+# Files the store itself wrote: <digest> or <digest>.<variant>
+_STORED_NAME = re.compile(r'[0-9a-f]{64}(\.[a-z]+)?$')
+
+
+def normalize_name(name) -> str:
+    return str(name).strip().upper()
+
+
+def is_stored_file(filename: str) -> bool:
+    """True if `filename` has the shape of a file written by the store (safe to serve by name)."""
+    base, ext = os.path.splitext(filename)
+    return ext[1:].lower() in _EXT_MIME and bool(_STORED_NAME.match(base))
+
+
+def mimetype_for(filename: str) -> str:
+    return _EXT_MIME.get(filename.rsplit('.', 1)[-1].lower(), 'application/octet-stream')
+
+
+class ImageStore:
+    """kepoi_name -> content-hashed image files, with derived variants."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        # normalized name -> {"name", "digest", "file", "variants": {variant: file}, "updated_at"}
+        self._entries: Dict[str, dict] = {}
+        os.makedirs(root, exist_ok=True)
+        self._load_manifest()
+        self._adopt_legacy_files()
+
+    # --- manifest ---
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.root, MANIFEST_NAME)
+
+    def _load_manifest(self):
+        path = self._manifest_path()
+        if not os.path.isfile(path):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entries = json.load(f).get('images', {})
+        except Exception as e:
+            print(f"Ignoring unreadable image manifest {path}: {e!r}")
+            return
+        # Drop entries whose file disappeared (a handful of stats, not a directory scan)
+        self._entries = {k: v for k, v in entries.items()
+                         if os.path.isfile(os.path.join(self.root, v.get('file', '')))}
+
+    def _save_manifest(self):
+        path = self._manifest_path()
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'images': self._entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+
+    def _adopt_legacy_files(self):
+        """One-time migration of `<name>.png` files written before the store existed."""
+        legacy = {}
+        for fname in os.listdir(self.root):
+            base, ext = os.path.splitext(fname)
+            if ext.lower() not in _LEGACY_EXTS or _STORED_NAME.match(base):
+                continue
+            path = os.path.join(self.root, fname)
+            if not os.path.isfile(path):
+                continue
+            key = normalize_name(_TIMESTAMP_SUFFIX.sub('', base))
+            legacy.setdefault(key, []).append((os.path.getmtime(path), path, _TIMESTAMP_SUFFIX.sub('', base)))
+        if not legacy:
+            return
+        for key, files in legacy.items():
+            files.sort()
+            _, newest, display = files[-1]
+            if key not in self._entries:
+                with open(newest, 'rb') as f:
+                    self.put(display, f.read(), save_manifest=False)
+            for _, path, _ in files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        with self._lock:
+            self._save_manifest()
+        print(f"Adopted {sum(len(v) for v in legacy.values())} legacy image file(s) into the image store")
+
+    # --- writes ---
+
+    def _write_file(self, fname: str, data: bytes):
+        path = os.path.join(self.root, fname)
+        if os.path.exists(path):
+            return
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _release(self, entry: dict):
+        """Delete `entry`'s files unless another planet still uses the same digest. Holds _lock."""
+        if any(e['digest'] == entry['digest'] for e in self._entries.values()):
+            return
+        for fname in [entry['file'], *entry.get('variants', {}).values()]:
+            try:
+                os.remove(os.path.join(self.root, fname))
+            except OSError:
+                pass
+
+    def put(self, name: str, content: bytes, save_manifest: bool = True) -> dict:
+        """Store `content` as the image of `name` and return its manifest entry."""
+        digest = hashlib.sha256(content).hexdigest()
+        try:
+            fmt = Image.open(io.BytesIO(content)).format
+        except Exception:
+            raise ValueError("Content is not a readable image")
+        fname = f"{digest}.{_FORMAT_EXT.get(fmt, 'png')}"
+        self._write_file(fname, content)
+
+        key = normalize_name(name)
+        with self._lock:
+            previous = self._entries.get(key)
+            variants = {}
+            # Reuse variants already derived for this digest under another name
+            for e in self._entries.values():
+                if e['digest'] == digest:
+                    variants = dict(e.get('variants', {}))
+                    break
+            entry = {'name': str(name).strip(), 'digest': digest, 'file': fname,
+                     'variants': variants, 'updated_at': time.time()}
+            self._entries[key] = entry
+            if previous is not None and previous['digest'] != digest:
+                self._release(previous)
+            if save_manifest:
+                self._save_manifest()
+        return dict(entry)
+
+    def remove(self, name: str) -> bool:
+        with self._lock:
+            entry = self._entries.pop(normalize_name(name), None)
+            if entry is None:
+                return False
+            self._release(entry)
+            self._save_manifest()
+        return True
+
+    # --- reads ---
+
+    def get(self, name: str) -> Optional[dict]:
+        entry = self._entries.get(normalize_name(name))
+        return dict(entry) if entry is not None else None
+
+    def names(self):
+        return sorted(e['name'] for e in self._entries.values())
+
+    def path(self, fname: str) -> str:
+        return os.path.join(self.root, fname)
+
+    def variant_file(self, name: str, variant: str = 'original') -> Optional[str]:
+        """File name (relative to root) of `variant` for `name`, deriving it on first use."""
+        if variant not in VARIANTS:
+            raise ValueError(f"Unknown variant '{variant}'. Use one of: {', '.join(VARIANTS)}")
+        entry = self._entries.get(normalize_name(name))
+        if entry is None:
+            return None
+        if variant == 'original':
+            return entry['file']
+        fname = entry.get('variants', {}).get(variant)
+        if fname is not None:
+            return fname
+
+        digest = entry['digest']
+        with Image.open(self.path(entry['file'])) as img:
+            img.load()
+            if variant == 'thumb':
+                img.thumbnail((THUMB_SIZE, THUMB_SIZE))
+            if img.mode not in ('RGB', 'RGBA'):
+                img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+            buf = io.BytesIO()
+            img.save(buf, format=_VARIANT_FORMAT, quality=WEBP_QUALITY)
+        fname = f"{digest}.{variant}.{_FORMAT_EXT[_VARIANT_FORMAT]}"
+        self._write_file(fname, buf.getvalue())
+        with self._lock:
+            for e in self._entries.values():
+                if e['digest'] == digest:
+                    e.setdefault('variants', {})[variant] = fname
+            self._save_manifest()
+        return fname
+
+    def __len__(self):
+        return len(self._entries)
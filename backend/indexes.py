@@ -0,0 +1,112 @@
+"""Lookup indexes over a processed Kepler dataframe.
+
+A `DatasetIndex` is built once per model version. It keeps the normalized
+`kepoi_name` values and the `kepid` values of every row sorted, with the row
+positions in the same order. A detail lookup is a binary search returning a
+slice of positions, and prefix queries (e.g. every KOI of a star, `K00001.*`)
+are a binary search for the range of names that start with the prefix. Plain
+arrays take a fraction of the memory of a dict of per-key arrays.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+_EMPTY = np.empty(0, dtype=np.int64)
+# Sorts after every character a name can contain: the end of a prefix range
+_PREFIX_END = '\U0010FFFF'
+
+
+def normalize_kepoi(name) -> str:
+    """Normalization used for case-insensitive kepoi_name matching."""
+    return str(name).strip().upper()
+
+
+def _sorted_keys(keys: np.ndarray, positions: np.ndarray):
+    """(keys, positions) ordered by key, positions ascending within a key."""
+    order = np.argsort(keys, kind='stable')
+    return keys[order], positions[order]
+
+
+def _merged(keys, positions, new_keys, new_positions):
+    """Sorted arrays with sorted `new_*` inserted; new positions come after the old ones of a key."""
+    at = np.searchsorted(keys, new_keys, side='right')
+    if keys.dtype.kind == 'U' and new_keys.dtype.kind == 'U':
+        width = max(keys.dtype.itemsize, new_keys.dtype.itemsize) // 4
+        keys = keys.astype(f'<U{width}')
+    return np.insert(keys, at, new_keys), np.insert(positions, at, new_positions)
+
+
+class DatasetIndex:
+    """Row-position indexes for `kepoi_name` and `kepid`."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.n_rows = len(df)
+
+        names, name_rows = np.array([], dtype='U1'), _EMPTY
+        if 'kepoi_name' in df:
+            raw = df['kepoi_name']
+            valid_pos = np.flatnonzero(raw.notna().to_numpy())
+            if valid_pos.size:
+                names = np.array(raw.iloc[valid_pos].astype(str).str.strip().str.upper().tolist(), dtype=str)
+                name_rows = valid_pos.astype(np.int64)
+        self._names, self._name_rows = _sorted_keys(names, name_rows)
+
+        kepids, kepid_rows = np.array([], dtype=np.int64), _EMPTY
+        if 'kepid' in df:
+            ids = pd.to_numeric(df['kepid'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+            valid = np.isfinite(ids)
+            kepids = ids[valid].astype(np.int64)
+            kepid_rows = np.flatnonzero(valid).astype(np.int64)
+        self._kepids, self._kepid_rows = _sorted_keys(kepids, kepid_rows)
+
+    def extended(self, df_new: pd.DataFrame, offset: int) -> 'DatasetIndex':
+        """New index covering this one plus `df_new`, whose rows start at position `offset`.
+
+        The appended rows are sorted and merged in; this index stays valid for the
+        version that owns it.
+        """
+        added = DatasetIndex(df_new)
+        idx = DatasetIndex.__new__(DatasetIndex)
+        idx.n_rows = offset + added.n_rows
+        idx._names, idx._name_rows = _merged(self._names, self._name_rows, added._names, added._name_rows + offset)
+        idx._kepids, idx._kepid_rows = _merged(self._kepids, self._kepid_rows, added._kepids,
+                                               added._kepid_rows + offset)
+        return idx
+
+    @property
+    def nbytes(self) -> int:
+        return int(self._names.nbytes + self._name_rows.nbytes + self._kepids.nbytes + self._kepid_rows.nbytes)
+
+    def _name_range(self, lo_key: str, hi_key: str):
+        return (int(np.searchsorted(self._names, lo_key, side='left')),
+                int(np.searchsorted(self._names, hi_key, side='right')))
+
+    def by_kepoi(self, name) -> np.ndarray:
+        """Row positions whose kepoi_name matches `name` case-insensitively."""
+        key = normalize_kepoi(name)
+        lo, hi = self._name_range(key, key)
+        return self._name_rows[lo:hi] if hi > lo else _EMPTY
+
+    def by_kepid(self, kepid) -> np.ndarray:
+        """Row positions with the given kepid."""
+        try:
+            key = int(kepid)
+        except (TypeError, ValueError):
+            return _EMPTY
+        lo = int(np.searchsorted(self._kepids, key, side='left'))
+        hi = int(np.searchsorted(self._kepids, key, side='right'))
+        return self._kepid_rows[lo:hi] if hi > lo else _EMPTY
+
+    def search(self, pattern: str, limit=None) -> np.ndarray:
+        """Row positions matching `pattern`: an exact kepoi_name, or a prefix when it ends with `*`.
+
+        Results are ordered by kepoi_name, then by row position.
+        """
+        pattern = str(pattern).strip()
+        if not pattern.endswith('*'):
+            return self.by_kepoi(pattern)
+        p = normalize_kepoi(pattern.rstrip('*'))
+        lo, hi = self._name_range(p, p + _PREFIX_END)
+        rows = self._name_rows[lo:hi]
+        return rows[:limit] if limit is not None else rows
@@ -0,0 +1,359 @@
+"""Dtype-aware Kepler CSV ingestion with a memory-mapped columnar cache.
+
+`load_kepler_csv()` replaces a plain `pd.read_csv()` of the whole cumulative
+table:
+
+- only the columns the server uses are parsed (`usecols`): the identifier and
+  name columns, `koi_disposition` and every numeric column (the features);
+  free text, provenance and vetting metadata are skipped;
+- dtypes are declared up front (float32 features, float64 for the values served
+  to clients, integers for kepid and integer-valued columns such as the
+  `koi_fpflag_*` flags, categorical disposition);
+- rows are filtered by disposition while the file is read in chunks;
+- the result is written as a `.npy` bundle next to the CSV
+  (`<name>.csv.npycache/`), which later loads memory-map instead of parsing text.
+
+The cache is rebuilt automatically when the CSV's size or mtime change.
+`append_csv_rows()` adds rows to an existing CSV and carries its cache forward
+without re-parsing the rows already there.
+"""
+
+import csv
+import io
+import json
+import os
+import shutil
+import threading
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+# Bump when the schema or bundle layout changes so stale caches are rebuilt
+CACHE_FORMAT = 2
+CACHE_SUFFIX = '.npycache'
+
+CHUNK_ROWS = 100_000
+# Rows parsed with default inference to decide which undeclared columns are numeric
+SAMPLE_ROWS = 2_000
+
+# --- declared schema ---
+ID_COLUMNS = ('kepid',)
+STRING_COLUMNS = ('kepoi_name', 'kepler_name')
+CATEGORY_COLUMNS = {
+    'koi_disposition': ('CANDIDATE', 'CONFIRMED', 'FALSE POSITIVE', 'NOT DISPOSITIONED'),
+}
+# Never read: free text, provenance and vetting metadata (neither features nor served)
+SKIP_COLUMNS = (
+    'koi_pdisposition', 'koi_score', 'koi_comment', 'koi_vet_stat', 'koi_vet_date',
+    'koi_disp_prov', 'koi_fittype', 'koi_parm_prov', 'koi_limbdark_mod', 'koi_trans_mod',
+    'koi_datalink_dvr', 'koi_datalink_dvs', 'koi_tce_delivname', 'koi_sparprov',
+)
+# Values returned to clients by GeneralData/predict keep full CSV precision
+PRECISE_COLUMNS = (
+    'koi_steff', 'koi_duration', 'koi_srad', 'koi_slogg', 'koi_model_snr', 'koi_depth', 'koi_period',
+)
+FEATURE_DTYPE = np.float32
+# Columns whose values are whole numbers (kepid, and features the sample infers as integers).
+# They are read as float64 and narrowed to the smallest integer dtype once the whole column
+# is known to have no gaps, as pandas' own inference would; otherwise they stay floats.
+INTEGER_DTYPE = np.int64
+# Columns a CSV must have to be used as a dataset (identifiers and the training target)
+REQUIRED_COLUMNS = ('kepid', 'kepoi_name', 'koi_disposition')
+
+_cache_locks = {}
+_cache_locks_guard = threading.Lock()
+
+
+def cache_dir_for(csv_path: str) -> str:
+    return csv_path + CACHE_SUFFIX
+
+
+def _lock_for(path: str) -> threading.Lock:
+    with _cache_locks_guard:
+        return _cache_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def infer_schema(csv_path: str):
+    """Return (usecols, dtypes) for a Kepler CSV.
+
+    Declared columns get their declared dtype; undeclared columns are kept as float32
+    features when a sample of rows parses as numeric, and skipped otherwise.
+    """
+    sample = pd.read_csv(csv_path, nrows=SAMPLE_ROWS)
+    return schema_from_sample(sample)
+
+
+def schema_from_sample(sample: pd.DataFrame):
+    """Schema (usecols, dtypes) derived from the first rows of a Kepler table."""
+    usecols = []
+    dtypes = {}
+    for col in sample.columns:
+        if col in SKIP_COLUMNS:
+            continue
+        if col in ID_COLUMNS:
+            dtypes[col] = INTEGER_DTYPE
+        elif col in PRECISE_COLUMNS:
+            # float64: keeps served values at CSV precision
+            dtypes[col] = np.float64
+        elif col in STRING_COLUMNS or col in CATEGORY_COLUMNS:
+            dtypes[col] = object
+        elif pd.api.types.is_integer_dtype(sample[col].dtype):
+            dtypes[col] = INTEGER_DTYPE
+        elif pd.api.types.is_numeric_dtype(sample[col].dtype) and not pd.api.types.is_bool_dtype(sample[col].dtype):
+            dtypes[col] = FEATURE_DTYPE
+        else:
+            continue
+        usecols.append(col)
+    return usecols, dtypes
+
+
+def validate_header(columns) -> None:
+    """Raise ValueError unless `columns` (a CSV header) fits the Kepler schema."""
+    columns = [str(c).strip() for c in columns]
+    if not columns or not any(columns):
+        raise ValueError("The CSV has no header row")
+    duplicated = sorted({c for c in columns if columns.count(c) > 1})
+    if duplicated:
+        raise ValueError(f"Duplicated columns: {', '.join(duplicated)}")
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+    known = set(ID_COLUMNS) | set(STRING_COLUMNS) | set(CATEGORY_COLUMNS) | set(SKIP_COLUMNS)
+    if not [c for c in columns if c not in known]:
+        raise ValueError("No feature columns besides identifiers and metadata")
+
+
+def _read_dtypes(dtypes):
+    """dtypes for pd.read_csv: integer columns are parsed as float64 (they may have gaps)."""
+    if dtypes is None:
+        return None
+    return {col: np.float64 if dt is INTEGER_DTYPE else dt for col, dt in dtypes.items()}
+
+
+def integer_column(values, col: str) -> np.ndarray:
+    """An INTEGER_DTYPE column as the smallest int dtype holding it, or as floats if it has gaps.
+
+    kepid keeps float64 in that case (every id stays exact), other columns become features.
+    """
+    arr = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    if len(arr) and np.isfinite(arr).all() and (arr == np.trunc(arr)).all():
+        return pd.to_numeric(pd.Series(arr.astype(np.int64)), downcast='integer').to_numpy()
+    return arr if col in ID_COLUMNS else arr.astype(FEATURE_DTYPE)
+
+
+def _finalize(df: pd.DataFrame) -> pd.DataFrame:
+    for col, cats in CATEGORY_COLUMNS.items():
+        if col in df:
+            df[col] = pd.Categorical(df[col], categories=list(cats))
+    return df.reset_index(drop=True)
+
+
+def iter_csv_chunks(csv_path, usecols, dtypes, dispositions: Optional[Iterable[str]] = None,
+                    chunk_rows: int = CHUNK_ROWS):
+    """Yield typed DataFrame chunks of the CSV (a path or file object), filtered to `dispositions` if given."""
+    keep = set(dispositions) if dispositions is not None else None
+    reader = pd.read_csv(csv_path, usecols=usecols, dtype=_read_dtypes(dtypes), chunksize=chunk_rows)
+    for chunk in reader:
+        if keep is not None:
+            chunk = chunk[chunk['koi_disposition'].isin(keep)]
+        yield chunk
+
+
+def frame_from_chunks(chunks, usecols, dtypes) -> pd.DataFrame:
+    """Concatenate typed chunks into the table `read_kepler_csv()` returns."""
+    if not chunks:
+        return _finalize(pd.DataFrame(columns=usecols))
+    df = pd.concat(chunks, ignore_index=True)
+    for col, dt in dtypes.items():
+        if col not in df:
+            continue
+        if dt is INTEGER_DTYPE:
+            df[col] = integer_column(df[col], col)
+        elif dt is FEATURE_DTYPE and pd.api.types.is_numeric_dtype(df[col].dtype):
+            df[col] = df[col].astype(FEATURE_DTYPE)
+    return _finalize(df)
+
+
+def read_kepler_csv(csv_path: str, dispositions: Optional[Iterable[str]] = None,
+                    chunk_rows: int = CHUNK_ROWS) -> pd.DataFrame:
+    """Parse the CSV in typed, filtered chunks (no cache involved)."""
+    usecols, dtypes = infer_schema(csv_path)
+    try:
+        chunks = list(iter_csv_chunks(csv_path, usecols, dtypes, dispositions, chunk_rows))
+    except (ValueError, TypeError):
+        # A column looked numeric in the sample but is not; fall back to inferred dtypes
+        chunks = list(iter_csv_chunks(csv_path, usecols, None, dispositions, chunk_rows))
+    return frame_from_chunks(chunks, usecols, dtypes)
+
+
+def _source_stamp(csv_path: str, dispositions) -> dict:
+    st = os.stat(csv_path)
+    return {
+        'format': CACHE_FORMAT,
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'dispositions': sorted(dispositions) if dispositions is not None else None,
+    }
+
+
+def write_cache(df: pd.DataFrame, cache_dir: str, stamp: dict):
+    """Write `df` as one .npy file per column plus meta.json.
+
+    Strings are stored as fixed-width unicode ('' for missing) and categoricals as
+    int codes, so every file can be memory-mapped. The bundle is built in a temp
+    directory and renamed into place.
+    """
+    tmp = f"{cache_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    columns = []
+    try:
+        for i, col in enumerate(df.columns):
+            s = df[col]
+            fname = f"{i:04d}.npy"
+            entry = {'name': col, 'file': fname}
+            if isinstance(s.dtype, pd.CategoricalDtype):
+                entry['kind'] = 'category'
+                entry['categories'] = [str(c) for c in s.cat.categories]
+                arr = s.cat.codes.to_numpy(dtype=np.int16)
+            elif pd.api.types.is_numeric_dtype(s.dtype):
+                entry['kind'] = 'numeric'
+                arr = s.to_numpy()
+            else:
+                entry['kind'] = 'string'
+                values = s.astype(object).where(s.notna(), '').astype(str).to_numpy()
+                width = max(1, max((len(v) for v in values), default=1))
+                arr = values.astype(f'<U{width}')
+            np.save(os.path.join(tmp, fname), arr, allow_pickle=False)
+            columns.append(entry)
+        meta = dict(stamp, rows=len(df), columns=columns)
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.replace(tmp, cache_dir)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def read_cache(cache_dir: str, stamp: Optional[dict] = None) -> Optional[pd.DataFrame]:
+    """Load a bundle written by `write_cache`, memory-mapping numeric columns.
+
+    Returns None if the bundle is missing, unreadable or (when `stamp` is given) stale.
+    """
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if not os.path.isfile(meta_path):
+        return None
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if stamp is not None and any(meta.get(k) != v for k, v in stamp.items()):
+            return None
+        data = {}
+        for entry in meta['columns']:
+            arr = np.load(os.path.join(cache_dir, entry['file']), mmap_mode='r', allow_pickle=False)
+            if entry['kind'] == 'category':
+                data[entry['name']] = pd.Categorical.from_codes(np.asarray(arr), categories=entry['categories'])
+            elif entry['kind'] == 'string':
+                values = np.asarray(arr).astype(object)
+                values[values == ''] = np.nan
+                data[entry['name']] = values
+            else:
+                data[entry['name']] = arr
+        return pd.DataFrame(data, copy=False)
+    except Exception as e:
+        print(f"Ignoring unreadable dataset cache {cache_dir}: {e!r}")
+        return None
+
+
+def load_kepler_csv(csv_path: str, dispositions: Optional[Iterable[str]] = None,
+                    use_cache: bool = True) -> pd.DataFrame:
+    """Load the filtered, typed Kepler table for `csv_path`, via the columnar cache when valid."""
+    if not use_cache:
+        return read_kepler_csv(csv_path, dispositions)
+
+    cache_dir = cache_dir_for(csv_path)
+    with _lock_for(csv_path):
+        stamp = _source_stamp(csv_path, dispositions)
+        df = read_cache(cache_dir, stamp)
+        if df is not None:
+            return df
+        df = read_kepler_csv(csv_path, dispositions)
+        try:
+            write_cache(df, cache_dir, stamp)
+        except Exception as e:
+            # The cache only speeds up later loads; never fail the load because of it
+            print(f"Writing dataset cache {cache_dir} failed: {e!r}")
+        return df
+
+
+def store_cache(csv_path: str, df: pd.DataFrame, dispositions: Optional[Iterable[str]] = None):
+    """Write `df`, already parsed from `csv_path` (e.g. while it was uploaded), as its columnar cache."""
+    with _lock_for(csv_path):
+        write_cache(df, cache_dir_for(csv_path), _source_stamp(csv_path, dispositions))
+
+
+def read_csv_header(csv_path: str):
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        return next(csv.reader(f), [])
+
+
+def append_csv_rows(csv_path: str, csv_text: str, dispositions: Optional[Iterable[str]] = None,
+                    use_cache: bool = True) -> pd.DataFrame:
+    """Append the rows of `csv_text` (a CSV with a header line) to `csv_path`.
+
+    The new rows are written in the existing column order; columns they lack are left
+    empty and columns the dataset does not have raise ValueError. Returns the appended
+    rows typed and filtered like `load_kepler_csv()`. When the columnar cache of the
+    file was current, it is extended with those rows instead of being rebuilt from the CSV.
+    """
+    header = read_csv_header(csv_path)
+    if not header:
+        raise ValueError(f"{csv_path} has no header")
+    new = pd.read_csv(io.StringIO(csv_text), dtype=str, keep_default_na=False)
+    extra = [c for c in new.columns if c not in header]
+    if extra:
+        raise ValueError(f"Columns not present in the dataset: {', '.join(map(str, extra))}")
+    if 'koi_disposition' not in new.columns:
+        raise ValueError("Missing required column 'koi_disposition'")
+
+    cache_dir = cache_dir_for(csv_path)
+    with _lock_for(csv_path):
+        old_stamp = _source_stamp(csv_path, dispositions)
+        cached = read_cache(cache_dir, old_stamp) if use_cache else None
+
+        # Raw text is appended as given (as strings), so values keep their CSV spelling
+        with open(csv_path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            needs_newline = False
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) not in (b'\n', b'\r')
+        with open(csv_path, 'a', encoding='utf-8', newline='') as f:
+            if needs_newline:
+                f.write('\n')
+            new.reindex(columns=header, fill_value='').to_csv(f, header=False, index=False)
+
+        # Parse the appended rows with the dataset's schema
+        usecols, dtypes = infer_schema(csv_path)
+        parsed = pd.read_csv(io.StringIO(csv_text), usecols=[c for c in usecols if c in new.columns])
+        parsed = parsed.reindex(columns=usecols)
+        for col, dt in dtypes.items():
+            if dt is object:
+                continue
+            if dt is INTEGER_DTYPE:
+                parsed[col] = integer_column(parsed[col], col)
+                continue
+            parsed[col] = pd.to_numeric(parsed[col], errors='coerce').astype(dt)
+        if dispositions is not None:
+            parsed = parsed[parsed['koi_disposition'].isin(set(dispositions))]
+        rows = _finalize(parsed)
+
+        if cached is not None and list(cached.columns) == list(rows.columns):
+            try:
+                write_cache(pd.concat([cached, rows], ignore_index=True),
+                            cache_dir, _source_stamp(csv_path, dispositions))
+            except Exception as e:
+                print(f"Writing dataset cache {cache_dir} failed: {e!r}")
+        return rows
@@ -0,0 +1,200 @@
+"""Background job queue used by the NASA ML server.
+
+Long-running work (model training, image generation, ...) is submitted to a
+`JobQueue`, which runs it on a small pool of daemon worker threads and keeps a
+bounded history of finished jobs so clients can poll their status by id.
+
+Jobs submitted with the same `key` are coalesced: while a job with that key is
+still queued, further submissions return the queued job instead of adding a new
+one. With `join_running=True` a submission also attaches to a job that is
+already running (used to de-duplicate identical requests).
+"""
+
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised from inside a job function to stop it after a cancel request."""
+
+
+class Job:
+    """A unit of background work and its observable state."""
+
+    def __init__(self, kind: str, fn: Callable[['Job'], Any], key: Optional[str] = None,
+                 params: Optional[dict] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.fn = fn
+        self.params = dict(params or {})
+        self.status = QUEUED
+        self.phase = None
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.coalesced = 0
+        # Free-form progress details (counters, throughput, ...) published by the job
+        self.details = {}
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """Raise JobCancelled if cancellation was requested. Call between work steps."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def update(self, phase: Optional[str] = None, progress: Optional[float] = None, **details):
+        """Report progress (0..1), the current phase name and/or extra `details` values."""
+        if phase is not None:
+            self.phase = phase
+        if progress is not None:
+            self.progress = max(0.0, min(1.0, float(progress)))
+        if details:
+            self.details = dict(self.details, **details)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the job finished. Returns False on timeout."""
+        return self._done.wait(timeout)
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'phase': self.phase,
+            'progress': self.progress,
+            'details': self.details,
+            'params': self.params,
+            'coalesced': self.coalesced,
+            'error': self.error,
+            'result': self.result,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'elapsed': elapsed,
+        }
+
+
+class JobQueue:
+    """FIFO job queue served by `workers` daemon threads."""
+
+    def __init__(self, name: str, workers: int = 1, history: int = 200):
+        self.name = name
+        self.history = history
+        self._lock = threading.Lock()
+        self._jobs: 'OrderedDict[str, Job]' = OrderedDict()
+        self._pending = queue.Queue()
+        self._threads = []
+        for i in range(max(1, int(workers))):
+            t = threading.Thread(target=self._worker, name=f"{name}-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, kind: str, fn: Callable[[Job], Any], key: Optional[str] = None,
+               params: Optional[dict] = None, join_running: bool = False) -> Job:
+        """Queue `fn(job)` for execution and return its Job.
+
+        If `key` is given and an unfinished job with the same key exists, that job is
+        returned instead (its params are updated with the new ones while it is still queued).
+        """
+        with self._lock:
+            if key is not None:
+                for job in reversed(self._jobs.values()):
+                    if job.key != key or job.done:
+                        continue
+                    if job.status == QUEUED:
+                        job.params.update(params or {})
+                        job.coalesced += 1
+                        return job
+                    if job.status == RUNNING and join_running and not job.cancel_requested():
+                        job.coalesced += 1
+                        return job
+            job = Job(kind, fn, key=key, params=params)
+            self._jobs[job.id] = job
+            self._trim()
+        self._pending.put(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Request cancellation. Queued jobs are cancelled immediately, running jobs
+        stop at their next `check_cancelled()` call."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return job
+            job._cancel.set()
+            if job.status == QUEUED:
+                self._finish(job, CANCELLED)
+        return job
+
+    def _trim(self):
+        # Drop the oldest finished jobs once the history limit is exceeded
+        excess = len(self._jobs) - self.history
+        if excess <= 0:
+            return
+        for job_id in [j.id for j in self._jobs.values() if j.done][:excess]:
+            del self._jobs[job_id]
+
+    def _finish(self, job: Job, status: str, result: Any = None, error: Optional[str] = None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        if status == SUCCEEDED:
+            job.progress = 1.0
+        job._done.set()
+
+    def _worker(self):
+        while True:
+            job = self._pending.get()
+            try:
+                with self._lock:
+                    if job.done:
+                        continue
+                    job.status = RUNNING
+                    job.started_at = time.time()
+                try:
+                    result = job.fn(job)
+                except JobCancelled:
+                    self._finish(job, CANCELLED)
+                except Exception as e:
+                    self._finish(job, FAILED, error=str(e))
+                else:
+                    self._finish(job, SUCCEEDED, result=result)
+            finally:
+                self._pending.task_done()
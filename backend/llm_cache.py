@@ -0,0 +1,147 @@
+"""Persistent cache for LLM explanations.
+
+The Gemini prompts built by the server are deterministic for a given model
+version and planet row, so their answers can be reused. `ExplanationCache`
+keeps answers in memory (LRU, bounded by `max_entries`) and mirrors them to one
+JSON file per entry on disk so they survive restarts. Identical requests that
+arrive while a call is in flight wait for that call instead of starting
+another one. Errors are never cached.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+
+class ExplanationCache:
+    """Prompt-hash keyed LRU cache with disk persistence and request coalescing."""
+
+    def __init__(self, cache_dir: Optional[str], max_entries: int = 1000):
+        self.cache_dir = cache_dir
+        self.max_entries = max(1, int(max_entries))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, str]' = OrderedDict()
+        self._inflight = {}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load_disk()
+
+    @staticmethod
+    def key(model: str, prompt: str) -> str:
+        h = hashlib.sha256()
+        h.update(model.encode('utf-8'))
+        h.update(b'\0')
+        h.update(prompt.encode('utf-8'))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_disk(self):
+        # Oldest files first so the most recently written entries survive eviction
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    files.append((os.path.getmtime(path), name[:-5], path))
+                except OSError:
+                    continue
+        files.sort()
+        for _, key, path in files:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._entries[key] = json.load(f)['text']
+            except Exception:
+                continue
+        self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            key, _ = self._entries.popitem(last=False)
+            if self.cache_dir:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+
+    def _store(self, key: str, model: str, text: str):
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            self._evict()
+        if self.cache_dir:
+            tmp = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump({'model': model, 'text': text}, f, ensure_ascii=False)
+                os.replace(tmp, self._path(key))
+            except OSError as e:
+                print("Persisting explanation failed:", repr(e))
+
+    def get(self, model: str, prompt: str) -> Optional[str]:
+        key = self.key(model, prompt)
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+
+    def get_or_compute(self, model: str, prompt: str,
+                       compute: Callable[[str], Tuple[Optional[str], Optional[str]]]):
+        """Return (text, error, cached) for `prompt`, calling `compute(prompt)` on a miss.
+
+        `compute` returns (text, error) like `call_genai_and_get_text`. Concurrent
+        callers with the same model and prompt share a single `compute` call.
+        """
+        key = self.key(model, prompt)
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return text, None, True
+            self.misses += 1
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = {'done': threading.Event(), 'result': (None, "Explanation call did not complete")}
+                self._inflight[key] = flight
+
+        if not leader:
+            flight['done'].wait()
+            text, err = flight['result']
+            return text, err, False
+
+        try:
+            text, err = compute(prompt)
+            if not err and text is not None:
+                self._store(key, model, text)
+            flight['result'] = (text, err)
+            return text, err, False
+        except Exception as e:
+            flight['result'] = (None, str(e))
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight['done'].set()
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries)
+            self._entries.clear()
+        if self.cache_dir:
+            for key in keys:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,254 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+A small dependency-free registry: `Counter`, `Histogram` and `Gauge` families
+with labels. `Gauge` values may come from a callback evaluated at scrape time,
+for values that are cheaper to read than to keep up to date (cache sizes, the
+memory held by the served version). `render()` produces the body served by
+`/metrics`.
+
+`PhaseTimer` times the named phases of a multi-step operation (a model fit).
+The code being timed only calls `mark_phase(name)` when a phase starts, which
+keeps it free of timing boilerplate; marks outside an active timer are ignored.
+"""
+
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+
+# Seconds; Prometheus client defaults plus a few long buckets for training
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+                   300.0, 1800.0)
+# Bytes: 256 B .. 256 MB in powers of 4
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(11))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return 'NaN'
+    value = float(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def lines(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Set explicitly, or computed by `callback()` at scrape time.
+
+    The callback returns a number (no labels) or a dict of label-value tuples to numbers.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), callback: Optional[Callable] = None):
+        super().__init__(name, help_text, labels)
+        self.callback = callback
+        self._values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def lines(self):
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception as e:
+                print(f"Collecting {self.name} failed:", repr(e))
+                return []
+            if not isinstance(values, dict):
+                values = {(): values}
+            items = sorted((tuple(str(x) for x in k), v) for k, v in values.items())
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def lines(self):
+        with self._lock:
+            items = sorted((k, ([*s[0]], s[1], s[2])) for k, s in self._series.items())
+        out = []
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, c in zip((*self.buckets, math.inf), counts):
+                cumulative += c
+                le = '+Inf' if math.isinf(bound) else _format_value(bound)
+                out.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', le))} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            out.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            out.append(f"{self.name}_count{labels} {n}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), callback=None) -> Gauge:
+        return self.register(Gauge(name, help_text, labels, callback))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.header())
+            lines.extend(m.lines())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# --- phase timing ---
+
+_active = threading.local()
+
+
+class PhaseTimer:
+    """Times consecutive phases marked with `mark_phase()` in this thread.
+
+    On exit each phase's duration is observed in `histogram` (labels `operation`
+    and `phase`) and kept in `seconds`. A phase lasts until the next different
+    mark or the end of the block; repeated marks of the same phase extend it.
+    """
+
+    def __init__(self, histogram: Optional[Histogram], operation: str):
+        self.histogram = histogram
+        self.operation = operation
+        self.seconds: Dict[str, float] = {}
+        self._phase = None
+        self._since = None
+        self._outer = None
+
+    def __enter__(self):
+        self._outer = getattr(_active, 'timer', None)
+        _active.timer = self
+        self._since = time.perf_counter()
+        return self
+
+    def mark(self, phase: str):
+        if phase == self._phase:
+            return
+        now = time.perf_counter()
+        self._close(now)
+        self._phase = phase
+        self._since = now
+
+    def _close(self, now):
+        if self._phase is not None:
+            self.seconds[self._phase] = self.seconds.get(self._phase, 0.0) + now - self._since
+
+    def __exit__(self, exc_type, exc, tb):
+        self._close(time.perf_counter())
+        _active.timer = self._outer
+        if self.histogram is not None:
+            # Phases of failed or cancelled runs are not representative
+            if exc_type is None:
+                for phase, secs in self.seconds.items():
+                    self.histogram.observe(secs, operation=self.operation, phase=phase)
+        return False
+
+    def total(self) -> float:
+        return sum(self.seconds.values())
+
+
+def mark_phase(phase: str):
+    """Start `phase` of the PhaseTimer active in this thread, if any."""
+    timer = getattr(_active, 'timer', None)
+    if timer is not None:
+        timer.mark(phase)
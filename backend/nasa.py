@@ -7,28 +7,60 @@ trains a RandomForest classifier on the Kepler dataset and exposes endpoints to:
 - update hyperparameters (numest, mxdepth, randstate)
 - update CSV path
 
+Training runs in a background job queue (see `jobs.py`); the fitted model and
+its dataset are published together as an immutable `ModelVersion` so reads keep
+serving the previous version while a retrain is in progress.
+
 Run: python nasa.py  (server binds 0.0.0.0:80)
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from werkzeug.utils import secure_filename
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
-from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, confusion_matrix, classification_report
-import joblib
+import cProfile
+import contextlib
+import copy
+import csv
+import io
+import itertools
 import threading
 import json
 import os
+import pstats
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
 from typing import Optional
 
 # Load environment variables from .env (if present) early
 load_dotenv()
 
-from imageGen import generate_image
+from imageGen import generate_image, get_session, API_URL as IMAGE_API_URL
+from jobs import JobQueue, JobCancelled, SUCCEEDED
+import artifacts
+import attribution
+import forest_engine
+import ingest
+from payloads import CachedPayload
+from dataset import CompactDataset, NUM_FIELDS as GENERAL_NUM_FIELDS
+from indexes import DatasetIndex, normalize_kepoi
+import stats
+import exports
+import hpsearch
+import metrics
+import trainer
+from query import QueryIndex, QueryError, RANGE_COLUMNS, DEFAULT_SORT, decode_cursor
+from registry import ModelRegistry
+from similarity import SimilarityIndex
+from uploads import UploadStore, UploadError
+from llm_cache import ExplanationCache
+from image_store import ImageStore, is_stored_file, mimetype_for
 
 
 # --- optional Google GenAI client ---
@@ -60,20 +92,109 @@ cfg = {
     "numest": 100,
     "mxdepth": 100,
     "randstate": 42,
+    # Other RandomForest parameters (sklearn names, sklearn defaults; see FOREST_DEFAULTS)
+    "max_features": "sqrt",
+    "min_samples_leaf": 1,
+    "min_samples_split": 2,
+    "criterion": "gini",
     # Directory where uploaded CSVs (via API) are stored
     "upload_dir": os.path.join(os.getcwd(), "uploaded_csvs"),
+    # Directory where trained models are persisted (see artifacts.py)
+    "artifact_dir": os.path.join(os.getcwd(), "model_artifacts"),
+    # Reuse a saved model when the CSV content and hyperparameters match
+    "use_artifacts": True,
+    # Request body limit for /predict/batch, which streams its input (None = unlimited)
+    "batch_max_bytes": 2 * 1024 * 1024 * 1024,
+    # Keep a memory-mapped columnar copy of each loaded CSV next to it (see ingest.py)
+    "dataset_cache": True,
+    # Gemini explanations are cached on disk here (see llm_cache.py)
+    "explanation_cache_dir": os.path.join(os.getcwd(), "explanation_cache"),
+    "explanation_cache_size": 1000,
+    # Image generation endpoint (HF inference API or a compatible/stub server) and worker count
+    "image_api_url": IMAGE_API_URL,
+    "image_workers": 2,
+    # Generated planet images (content-addressed, see image_store.py)
+    "image_dir": os.path.join(os.getcwd(), "exoplanets"),
+    # Trees added per /append_csv batch, and the share of appended rows (vs. the last
+    # full fit) beyond which an append falls back to a full refit
+    "append_estimators": 10,
+    "append_refit_ratio": 0.5,
+    # Processes used by /config/search for cross-validation fits
+    "search_workers": max(1, min(4, os.cpu_count() or 1)),
+    # Allow `?profile=1` on any request to return a cProfile summary instead (see /metrics docs)
+    "profiling": False,
+    # Uploaded CSVs served next to the active one (see registry.py): memory budget in bytes
+    # and maximum number of datasets kept loaded (None = no limit)
+    "registry_memory_budget": 2 * 1024 * 1024 * 1024,
+    "registry_max_datasets": 8,
+    # CPU budget of model fits (threads; None = every core), so a retrain leaves cores to serving
+    "training_cpus": max(1, (os.cpu_count() or 2) // 2),
+    # Fit in a separate, lower-priority process instead of a thread of the server (see trainer.py)
+    "training_process": False,
+    "training_nice": 10,
+    # Multi-worker serving (see wsgi.py): workers sharing artifact_dir fit one at a time and
+    # load the versions the others publish, checking for one at most every sync_interval seconds
+    "shared_artifacts": False,
+    "sync_interval": 2.0,
+    # Per-row feature attributions (see attribution.py; their mean is measured with every model version), and
+    # shuffles per feature for the permutation importances computed after a fit (0 = skip)
+    "attributions": True,
+    "importance_repeats": 5,
+    # Out-of-core training (see _fit_forest_out_of_core): when set, fits keep their working set
+    # under this many bytes by streaming the features into memory-mapped float32 matrices,
+    # written to training_scratch_dir (None = a temp dir in artifact_dir; use a disk, not tmpfs)
+    "training_memory_budget": None,
+    "training_scratch_dir": None,
 }
 
-# Globals for data and model
-model = None
-scaler = None
-df_processed = None
-X_columns = None
+# RandomForest parameters configurable besides numest / mxdepth / randstate
+FOREST_DEFAULTS = {"max_features": "sqrt", "min_samples_leaf": 1, "min_samples_split": 2, "criterion": "gini"}
+
+# Globals for data and model.
+# The trained model, scaler, feature columns and processed dataframe are published
+# together as one ModelVersion. Request handlers read `active_version` once and use
+# only that object, so a retrain swapping in a new version never mixes state.
+active_version = None
 model_info = {}
+version_lock = threading.Lock()
+
+# Retrains run one at a time on a background worker, never in a request thread
+training_jobs = JobQueue('training', workers=1)
+
+# Image generation calls an external API; a few run in parallel over one pooled session
+image_jobs = JobQueue('images', workers=cfg['image_workers'])
+image_store = ImageStore(cfg['image_dir'])
+
+# Hyperparameter searches run one at a time; each fans its fits out to a process pool
+search_jobs = JobQueue('search', workers=1)
 
 # Ensure upload directory exists
 os.makedirs(cfg['upload_dir'], exist_ok=True)
 
+# Explanations are deterministic per prompt (which embeds the model version's
+# metrics or the row and its prediction), so answers are reused across requests
+explanation_cache = ExplanationCache(cfg['explanation_cache_dir'], cfg['explanation_cache_size'])
+
+# Metrics served by /metrics (see metrics.py)
+HTTP_REQUESTS = metrics.REGISTRY.counter(
+    'nasa_http_requests_total', 'HTTP requests by route, method and status.', ('route', 'method', 'status'))
+HTTP_LATENCY = metrics.REGISTRY.histogram(
+    'nasa_http_request_duration_seconds', 'Time until the response is returned (streamed bodies excluded).',
+    ('route', 'method'))
+HTTP_RESPONSE_BYTES = metrics.REGISTRY.histogram(
+    'nasa_http_response_size_bytes', 'Response body sizes, when known up front.', ('route',),
+    buckets=metrics.SIZE_BUCKETS)
+CACHE_REQUESTS = metrics.REGISTRY.counter(
+    'nasa_cache_requests_total', 'Cache lookups by cache and result (hit/miss).', ('cache', 'result'))
+TRAINING_RUNS = metrics.REGISTRY.counter(
+    'nasa_training_runs_total', 'Model version builds by operation and outcome.', ('operation', 'outcome'))
+UPLOADS = metrics.REGISTRY.counter(
+    'nasa_uploads_total', 'Finished resumable uploads by outcome (saved, deduplicated, rejected).', ('outcome',))
+UPLOAD_BYTES = metrics.REGISTRY.counter('nasa_upload_bytes_total', 'Bytes accepted by resumable upload chunks.')
+TRAINING_PHASE_SECONDS = metrics.REGISTRY.histogram(
+    'nasa_training_phase_seconds', 'Duration of each phase of successful model version builds.',
+    ('operation', 'phase'))
+
 # Columns to drop (same as original script)
 COLUMNS_TO_DROP = [
     'kepid', 'kepoi_name', 'kepler_name', 'koi_disposition', 'koi_pdisposition',
@@ -83,169 +204,1063 @@ COLUMNS_TO_DROP = [
 ]
 
 
+# Keep only CONFIRMED and FALSE POSITIVE rows for binary classification
+KEEP_DISPOSITIONS = ('CONFIRMED', 'FALSE POSITIVE')
+
+# Resumable uploads in progress (see uploads.py); unfinished ones expire after a day
+upload_store = UploadStore(os.path.join(cfg['upload_dir'], '.uploads'), dispositions=KEEP_DISPOSITIONS)
+
+
 def load_csv(path):
-    """Load CSV and apply initial filtering used for binary classification."""
-    df = pd.read_csv(path)
-    # Keep only CONFIRMED and FALSE POSITIVE rows for binary classification
-    df = df[df['koi_disposition'].isin(['CONFIRMED', 'FALSE POSITIVE'])]
-    return df
+    """Load CSV and apply initial filtering used for binary classification.
+
+    Parsing goes through ingest.py: declared dtypes, only used columns, filtered
+    while reading in chunks, and a memory-mapped columnar cache next to the CSV.
+    """
+    with config_lock:
+        use_cache = bool(cfg.get('dataset_cache', True))
+    return ingest.load_kepler_csv(path, dispositions=KEEP_DISPOSITIONS, use_cache=use_cache)
+
+
+def feature_columns(df):
+    """The model's feature columns of `df`: numeric columns that are not identifiers or metadata."""
+    return df.drop(columns=COLUMNS_TO_DROP, errors='ignore').select_dtypes(include=np.number).columns
 
 
 def preprocess(df):
     """Return X (numeric features) and y (target) and the processed df."""
     y = df['koi_disposition']
-    X = df.drop(columns=COLUMNS_TO_DROP, errors='ignore').select_dtypes(include=np.number)
-    X = X.copy()
+    X = df[feature_columns(df)].copy()
     # Fill missing values with column mean
     X.fillna(X.mean(), inplace=True)
     return X, y, df
 
 
-def train_model():
-    """Train the RandomForest model with current configuration.
+def prepare_features(df, X_columns, means):
+    """Apply preprocess's feature selection and mean imputation to new rows.
+
+    Columns are aligned to the trained `X_columns` (missing ones become NaN) and
+    gaps are filled with the training column `means`.
+    """
+    X = df.reindex(columns=X_columns)
+    X = X.apply(pd.to_numeric, errors='coerce')
+    return X.fillna(means)
+
+
+class ModelVersion:
+    """Immutable snapshot of a fitted model and the dataset it was trained on.
+
+    Built by `fit_model_version()` and published with `install_version()`. Nothing
+    mutates a version after it is installed; a retrain builds a new one instead.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, model, scaler, X_columns, df_processed, model_info, feature_means=None, dataset_key=None,
+                 base=None, artifact_dir=None):
+        self.id = next(ModelVersion._ids)
+        self.created_at = time.time()
+        self._model = model
+        self.artifact_dir = artifact_dir
+        self.scaler = scaler
+        self.X_columns = X_columns
+        self.model_info = model_info
+        # Column means used by preprocess' imputation: every row is scored with its gaps
+        # filled with them, the dataset's own rows as well as /predict/batch input
+        if feature_means is None:
+            feature_means = df_processed[X_columns].apply(pd.to_numeric, errors='coerce').mean()
+        self.feature_means = feature_means
+        # Content hash of the source CSV; keys caches shared by versions of the same dataset
+        self.dataset_key = dataset_key or f"version-{self.id}"
+        # GeneralData fields as typed arrays (see dataset.py). The frame keeps serving
+        # /planets, /stats, queries and the model features; it shares those arrays, so the
+        # names are stored once and the numeric columns stay memory-mapped.
+        self.dataset = CompactDataset.from_frame(df_processed)
+        df_processed = self.dataset.shared_frame(df_processed)
+        self.df_processed = df_processed
+        if base is None:
+            # Served as pre-serialized bytes
+            self.general_payload = CachedPayload(self.dataset.records_json())
+            # kepid / kepoi_name -> row positions
+            self.index = DatasetIndex(df_processed)
+        else:
+            # Appended version: `base`'s rows come first, so only the new rows are encoded
+            n_base = len(base.df_processed)
+            added = df_processed.iloc[n_base:].reset_index(drop=True)
+            self.general_payload = base.general_payload.extended(self.dataset.records(n_base))
+            self.index = base.index.extended(added, n_base)
+        # Prediction + class probabilities for every row, scored once
+        self.classes, self.pred_class, self.pred_proba = predict_table(model, scaler, X_columns, feature_means,
+                                                                      df_processed)
+        # Flattened copy of the forest for small batches (see forest_engine)
+        self.engine = compile_engine(model, scaler, X_columns, feature_means, df_processed, model_info, artifact_dir)
+        # Feature contributions behind each row's prediction (on demand), and the global importances
+        self.attributions = compute_attributions(self.engine, model, scaler, X_columns, feature_means, df_processed,
+                                                 self.pred_class, self.classes)
+        importance = dict(model_info.get('feature_importance') or {})
+        if 'impurity' not in importance:
+            importance['impurity'] = attribution.impurity_importance(model, X_columns)
+        if self.attributions is not None:
+            importance['mean_abs_contribution'] = self.attributions.mean_abs
+        model_info['feature_importance'] = importance
+        self._model_lock = threading.Lock()
+        if self.engine is not None and artifact_dir and model_info.get('artifact'):
+            # The sklearn forest is on disk; the engine scores every batch from now on
+            self._model = None
+        # Dashboard charts with default parameters
+        self.stats_payload = chart_payload(self, 'dashboard', {})
+        self._memory = None
+        self._query_index = None
+        self._query_index_lock = threading.Lock()
+        self._similarity_index = None
+        self._similarity_index_lock = threading.Lock()
+
+    @property
+    def model(self):
+        """The fitted RandomForestClassifier, reloaded from its artifact if it was released.
+
+        The reload happens once, on first use; the forest is then kept. It is a private
+        heap copy: unpickling a tree copies its node arrays, so `mmap_mode` does not
+        map them. Scoring never needs it once the forest is released (see
+        `predict_proba`), and appends take their own copy (`model_copy`).
+        """
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    saved = artifacts.load_artifact(self.artifact_dir, self.model_info['artifact'])
+                    if saved is None:
+                        raise RuntimeError(f"Model artifact {self.model_info['artifact']} is no longer available")
+                    self._model = saved['model']
+                    # sklearn_model is now resident
+                    self._memory = None
+        return self._model
+
+    def model_copy(self):
+        """A copy of the fitted forest that the caller may modify (e.g. to grow more trees).
+
+        Unpickled from the artifact when the forest was released, without keeping it
+        here, and a deep copy of the resident forest otherwise.
+        """
+        if self._model is None:
+            saved = artifacts.load_artifact(self.artifact_dir, self.model_info['artifact'])
+            if saved is not None:
+                return saved['model']
+        return copy.deepcopy(self.model)
+
+    def predict_proba(self, X_scaled):
+        """Class probabilities for scaled rows.
+
+        Small batches go through the compact engine. Larger ones go through the
+        resident sklearn forest, which is faster per row in bulk, and through the
+        engine too when the forest was released: its arrays are memory-mapped from
+        the artifact, while reloading the forest would copy it onto this worker's heap.
+        """
+        if self.engine is not None and (len(X_scaled) <= forest_engine.SMALL_BATCH_ROWS or self._model is None):
+            return self.engine.predict_proba(X_scaled)
+        return self.model.predict_proba(X_scaled)
+
+    @property
+    def query_index(self):
+        """Sorted columns and masks for /planets/query, built on first use."""
+        if self._query_index is None:
+            with self._query_index_lock:
+                if self._query_index is None:
+                    self._query_index = QueryIndex(self.df_processed, self.pred_class, self.classes)
+        return self._query_index
+
+    @property
+    def similarity_index(self):
+        """Nearest-neighbour index over the scaled feature rows, built on first use."""
+        if self._similarity_index is None:
+            with self._similarity_index_lock:
+                if self._similarity_index is None:
+                    features = prepare_features(self.df_processed, self.X_columns, self.feature_means)
+                    self._similarity_index = SimilarityIndex(self.scaler.transform(features))
+        return self._similarity_index
+
+    def memory_usage(self):
+        """Approximate bytes held by this version, per component (computed once)."""
+        if self._memory is None:
+            engine_info = self.model_info.get('engine') or {}
+            self._memory = {
+                "df_processed": int(self.df_processed.memory_usage(index=True, deep=True).sum()),
+                # Body plus its compressed variants ('identity' is the body itself)
+                "general_payload": sum(len(v) for v in self.general_payload.variants.values()),
+                # Only the arrays that are not columns of df_processed
+                "dataset": self.dataset.nbytes_outside(self.df_processed),
+                "index": self.index.nbytes,
+                "predictions": int(self.pred_class.nbytes + self.pred_proba.nbytes),
+                # Memory-mapped from the artifact (page cache shared by workers) when engine_info['mapped']
+                "engine": int(engine_info.get('bytes', 0)),
+                # Full row cache, plus the forest it walks when that is not the engine
+                "attributions": self._attribution_bytes(),
+                # Heap copy of the forest: kept when it was never released, or reloaded (see `model`)
+                "sklearn_model": int(forest_engine.sklearn_nbytes(self._model)) if self._model is not None else 0,
+            }
+        return self._memory
+
+    def _attribution_bytes(self):
+        if self.attributions is None:
+            return 0
+        forest = self.attributions.forest
+        return self.attributions.nbytes + (forest.nbytes if forest is not self.engine else 0)
+
+    def prediction_for(self, i):
+        """Precomputed {"prediction", "probabilities"} for row position `i`, or None if unavailable."""
+        c = self.pred_class[i]
+        if c < 0:
+            return None
+        probs = self.pred_proba[i]
+        return {
+            "prediction": self.classes[c],
+            "probabilities": {cls: round(float(p), 6) for cls, p in zip(self.classes, probs)},
+        }
+
+
+# Rows scaled and scored per model call when building the prediction table
+PREDICTION_BATCH_ROWS = 50_000
+
+
+def predict_table(model, scaler, X_columns, means, df):
+    """Score every row of `df` in fixed-size batches, gaps filled with the training `means`.
+
+    Rows get the same `prepare_features` as /predict/batch input, so posting a
+    dataset row there gives its precomputed prediction. Returns (classes, pred_class, pred_proba): class labels as str, the predicted
+    class index per row as int16 (-1 where the batch could not be scored) and
+    class probabilities as float32.
+    """
+    classes = [str(c) for c in model.classes_]
+    n = len(df)
+    pred_class = np.full(n, -1, dtype=np.int16)
+    pred_proba = np.zeros((n, len(classes)), dtype=np.float32)
+    for start in range(0, n, PREDICTION_BATCH_ROWS):
+        stop = min(n, start + PREDICTION_BATCH_ROWS)
+        try:
+            probs = model.predict_proba(scaler.transform(prepare_features(df.iloc[start:stop], X_columns, means)))
+        except Exception as e:
+            print(f"Scoring rows {start}-{stop} failed:", repr(e))
+            continue
+        # Same rule as RandomForestClassifier.predict: argmax of the probabilities
+        pred_class[start:stop] = probs.argmax(axis=1)
+        pred_proba[start:stop] = probs
+    return classes, pred_class, pred_proba
+
+
+# Rows of the dataset the compact engine is checked against sklearn on
+ENGINE_CHECK_ROWS = 2000
+
+
+def compile_engine(model, scaler, X_columns, means, df, model_info, artifact_dir=None):
+    """Compile `model` with forest_engine and record the report in model_info['engine'].
+
+    Returns None (sklearn keeps serving everything) if compiling fails or the engine
+    disagrees with sklearn on a predicted class of the check rows (imputed with `means`). The engine of a saved artifact is
+    stored next to it and loaded memory-mapped by later versions and other workers.
+    """
+    key = model_info.get('artifact') if artifact_dir else None
+    if key is not None:
+        saved = artifacts.load_engine(artifact_dir, key)
+        if saved is not None:
+            engine, report = saved
+            model_info['engine'] = dict(report, mapped=True)
+            return engine
+    try:
+        step = max(1, len(df) // ENGINE_CHECK_ROWS)
+        sample = df.iloc[::step].iloc[:ENGINE_CHECK_ROWS]
+        X_check = scaler.transform(prepare_features(sample, X_columns, means)) if len(sample) else None
+        engine, report = forest_engine.compile_forest(model, X_check)
+    except Exception as e:
+        print("Compiling the inference engine failed:", repr(e))
+        model_info['engine'] = {"error": str(e)}
+        return None
+    model_info['engine'] = report
+    if report.get('class_mismatches'):
+        print(f"Inference engine disagrees with sklearn on {report['class_mismatches']} rows; not using it")
+        return None
+    if key is not None:
+        try:
+            artifacts.save_engine(artifact_dir, key, engine, report)
+        except Exception as e:
+            print("Saving the inference engine failed:", repr(e))
+    return engine
+
+
+# Rows per contributions call while measuring the mean |contribution| (float64 per feature and class)
+ATTRIBUTION_BATCH_ROWS = 10_000
+
 
-    Updates globals: model, scaler, X_columns, df_processed, model_info
+def compute_attributions(engine, model, scaler, X_columns, means, df, pred_class, classes):
+    """Per-row path contributions of `df` (see attribution.py), computed on demand.
+
+    Their mean absolute value is measured now, in batches; a row's own
+    contributions when it is asked for. Rows are imputed with `means` as for
+    `predict_table`, so they explain its predictions. Returns None when disabled
+    by cfg['attributions'] or if computing them fails.
     """
-    global model, scaler, X_columns, df_processed, model_info
     with config_lock:
-        path = cfg['path']
-        numest = int(cfg['numest'])
-        mxdepth = None if cfg['mxdepth'] in [None, 0] else int(cfg['mxdepth'])
-        randstate = int(cfg['randstate'])
+        if not cfg.get('attributions', True):
+            return None
 
-    if not os.path.exists(path):
-        model_info = {"error": f"CSV file not found at path: {path}"}
-        return False
+    def scaled(start, stop):
+        return scaler.transform(prepare_features(df.iloc[start:stop], X_columns, means))
 
     try:
-        df = load_csv(path)
-        X, y, df_proc = preprocess(df)
+        forest = engine if engine is not None else forest_engine.CompactForest.from_sklearn(model)
+        batches = ((start, scaled(start, start + ATTRIBUTION_BATCH_ROWS))
+                   for start in range(0, len(df), ATTRIBUTION_BATCH_ROWS))
+        return attribution.RowAttributions.compute(forest, batches, pred_class, lambda row: scaled(row, row + 1),
+                                                   X_columns, classes)
+    except Exception as e:
+        print("Computing feature attributions failed:", repr(e))
+        return None
+
+
+# (dataset_key, chart, params) -> CachedPayload, least recently used evicted first
+stats_cache = OrderedDict()
+stats_cache_lock = threading.Lock()
+STATS_CACHE_SIZE = 256
+
+
+def chart_payload(mv, name, params):
+    """Serialized chart `name` ('dashboard' for all defaults) for mv's dataset, cached per dataset hash."""
+    key = (mv.dataset_key, name, tuple(sorted(params.items())))
+    with stats_cache_lock:
+        payload = stats_cache.get(key)
+        if payload is not None:
+            stats_cache.move_to_end(key)
+            CACHE_REQUESTS.inc(cache='stats', result='hit')
+            return payload
+    CACHE_REQUESTS.inc(cache='stats', result='miss')
+    if name == 'dashboard':
+        data = stats.dashboard(mv.df_processed)
+    else:
+        data = stats.compute_chart(mv.df_processed, name, params)
+    payload = CachedPayload.from_obj(data)
+    with stats_cache_lock:
+        stats_cache[key] = payload
+        while len(stats_cache) > STATS_CACHE_SIZE:
+            stats_cache.popitem(last=False)
+    return payload
+
+
+def install_version(mv):
+    """Atomically make `mv` the version served by every endpoint."""
+    global active_version, model_info
+    with version_lock:
+        active_version = mv
+        model_info = mv.model_info
+
+
+def _report(job, phase, progress):
+    """Publish training progress on the job (if any) and stop if it was cancelled.
+
+    Also starts `phase` of the running metrics.PhaseTimer, if any.
+    """
+    metrics.mark_phase(phase)
+    if job is None:
+        return
+    job.check_cancelled()
+    job.update(phase=phase, progress=progress)
+
+
+def _training_settings():
+    """Snapshot of the cfg values that define a trained model."""
+    with config_lock:
+        return {
+            "path": cfg['path'],
+            "numest": int(cfg['numest']),
+            "mxdepth": None if cfg['mxdepth'] in [None, 0] else int(cfg['mxdepth']),
+            "randstate": int(cfg['randstate']),
+            "forest": {k: cfg.get(k, v) for k, v in FOREST_DEFAULTS.items()},
+            "artifact_dir": cfg['artifact_dir'],
+            "use_artifacts": bool(cfg.get('use_artifacts', True)),
+            "cfg": cfg.copy(),
+        }
+
+
+def _non_default_forest(settings):
+    return {k: v for k, v in settings['forest'].items() if v != FOREST_DEFAULTS[k]}
+
 
-        # Train/test split
+def _artifact_extra(settings):
+    """Artifact key parameters besides numest / mxdepth / randstate.
+
+    Non-default forest parameters, and the out-of-core budget: chunked fits grow a
+    different forest than a fit on the whole matrix.
+    """
+    extra = _non_default_forest(settings)
+    budget = settings['cfg'].get('training_memory_budget')
+    if budget is not None:
+        extra['training_memory_budget'] = int(budget)
+    return extra
+
+
+def find_artifact_key(settings=None):
+    """Artifact key for the configured CSV + hyperparameters if a saved model exists, else None."""
+    settings = settings or _training_settings()
+    if not settings['use_artifacts'] or not os.path.exists(settings['path']):
+        return None
+    key = artifacts.artifact_key(settings['path'], settings['numest'], settings['mxdepth'], settings['randstate'],
+                                 _artifact_extra(settings))
+    return key if artifacts.has_artifact(settings['artifact_dir'], key) else None
+
+
+def _training_lock(settings):
+    """Serializes fits across the workers sharing the artifact directory (see trainer.TrainingLock)."""
+    if not settings['cfg'].get('shared_artifacts'):
+        return contextlib.nullcontext()
+    return trainer.TrainingLock(os.path.join(settings['artifact_dir'], 'training.lock'))
+
+
+def _fit_forest(settings, X, y, job=None):
+    """Split, scale, fit and evaluate a forest on X, y. Returns (model, scaler, model_info)."""
+    randstate = settings['randstate']
+
+    # Train/test split
+    _report(job, 'split', 0.15)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=randstate, stratify=y
+    )
+
+    # Scale
+    _report(job, 'scale', 0.2)
+    scl = StandardScaler()
+    X_train_scaled = scl.fit_transform(X_train)
+    X_test_scaled = scl.transform(X_test)
+
+    # Fit with the training CPU budget, in a separate process if configured. Inside a job
+    # the forest is grown in batches of trees (warm_start) so progress can be reported and
+    # cancellation honoured; the result is identical to a single fit.
+    _report(job, 'fit', 0.25)
+    params = dict(settings['forest'], n_estimators=settings['numest'], max_depth=settings['mxdepth'],
+                  random_state=randstate)
+    run_cfg = settings['cfg']
+    clf = trainer.fit_forest(
+        X_train_scaled, y_train, params, n_jobs=run_cfg.get('training_cpus'),
+        in_process=not run_cfg.get('training_process'), nice=int(run_cfg.get('training_nice') or 0),
+        on_progress=None if job is None else (lambda done: _report(job, 'fit', 0.25 + 0.65 * done)),
+        check_cancelled=None if job is None else job.check_cancelled)
+
+    return clf, scl, _evaluate_forest(settings, clf, X_test_scaled, y_test, X.columns, len(X), job)
+
+
+def _evaluate_forest(settings, clf, X_test, y_test, columns, n_samples, job=None, chunk_rows=None):
+    """model_info of a fitted forest: held-out metrics and global importances.
+
+    `chunk_rows` scores X_test (e.g. a memory map) that many rows at a time.
+    """
+    _report(job, 'evaluate', 0.9)
+    if chunk_rows:
+        y_pred = np.concatenate([clf.predict(X_test[start:start + chunk_rows])
+                                 for start in range(0, len(X_test), chunk_rows)])
+    else:
+        y_pred = clf.predict(X_test)
+    info = {
+        "accuracy": accuracy_score(y_test, y_pred),
+        "confusion_matrix": confusion_matrix(y_test, y_pred).tolist(),
+        "classification_report": classification_report(y_test, y_pred, output_dict=True),
+        "n_features": len(columns),
+        "n_samples": n_samples,
+        "config": settings['cfg']
+    }
+
+    # Global importances; saved with the artifact, unlike the per-row attributions
+    _report(job, 'importance', 0.92)
+    importance = {"impurity": attribution.impurity_importance(clf, columns)}
+    repeats = int(settings['cfg'].get('importance_repeats') or 0)
+    if repeats > 0:
+        importance["permutation"] = attribution.permutation_importance(
+            clf.predict_proba, clf.classes_, X_test, y_test, columns, repeats, settings['randstate'])
+    info["feature_importance"] = importance
+    return info
+
+
+def _fit_forest_out_of_core(settings, df, X_columns, means, job=None):
+    """`_fit_forest` within cfg['training_memory_budget'] bytes, for datasets larger than memory.
+
+    The feature columns of `df` (memory-mapped from the dataset cache when it is on)
+    are read a chunk of rows at a time. The scaler is fitted in a pass over the
+    training rows, and a second pass writes the imputed, scaled rows to float32
+    memory-mapped matrices on disk. The forest is fitted on the mapped training
+    matrix when it takes at most half the budget, and otherwise as sub-forests on
+    chunks that do (trainer.fit_forest_chunked). The split, scaler and metrics are
+    those of `_fit_forest`. Returns (model, scaler, model_info).
+    """
+    run_cfg = settings['cfg']
+    randstate = settings['randstate']
+    budget = int(run_cfg['training_memory_budget'])
+    columns = list(X_columns)
+    n_features = len(columns)
+    chunk_rows = trainer.rows_per_chunk(budget, n_features)
+    # Column arrays as stored in df: no copy, and memory maps when loaded from the cache
+    sources = [df[c].to_numpy() for c in columns]
+    fill = np.asarray(means.reindex(columns), dtype=np.float64)
+
+    def block(idx):
+        """Imputed rows `idx` of the feature columns as a float64 frame."""
+        out = np.empty((len(idx), n_features))
+        for j, values in enumerate(sources):
+            out[:, j] = values[idx]
+        np.copyto(out, fill, where=np.isnan(out))
+        return pd.DataFrame(out, columns=columns, copy=False)
+
+    # Same rows as train_test_split(X, y) in _fit_forest: the split depends only on y
+    _report(job, 'split', 0.15)
+    y = np.asarray(df['koi_disposition'])
+    train_idx, test_idx = train_test_split(np.arange(len(y)), test_size=0.2, random_state=randstate, stratify=y)
+
+    _report(job, 'scale', 0.17)
+    scl = StandardScaler()
+    for start in range(0, len(train_idx), chunk_rows):
+        scl.partial_fit(block(train_idx[start:start + chunk_rows]))
+        if job is not None:
+            job.check_cancelled()
+
+    scratch = run_cfg.get('training_scratch_dir') or settings['artifact_dir']
+    os.makedirs(scratch, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix='nasa-ooc-', dir=scratch)
+    try:
+        _report(job, 'write_matrix', 0.2)
+        matrices = []
+        for name, idx in (('X_train', train_idx), ('X_test', test_idx)):
+            matrix = np.lib.format.open_memmap(os.path.join(workdir, f'{name}.npy'), mode='w+',
+                                               dtype=np.float32, shape=(len(idx), n_features))
+            for start in range(0, len(idx), chunk_rows):
+                matrix[start:start + chunk_rows] = scl.transform(block(idx[start:start + chunk_rows]))
+                if job is not None:
+                    job.check_cancelled()
+            matrix.flush()
+            matrices.append(matrix)
+        X_train, X_test = matrices
+        y_train, y_test = y[train_idx], y[test_idx]
+
+        _report(job, 'fit', 0.25)
+        params = dict(settings['forest'], n_estimators=settings['numest'], max_depth=settings['mxdepth'],
+                      random_state=randstate)
+        fit_kwargs = dict(
+            n_jobs=run_cfg.get('training_cpus'), in_process=not run_cfg.get('training_process'),
+            nice=int(run_cfg.get('training_nice') or 0), tmp_dir=workdir,
+            on_progress=None if job is None else (lambda done: _report(job, 'fit', 0.25 + 0.65 * done)),
+            check_cancelled=None if job is None else job.check_cancelled)
+        fit_rows = (budget // 2) // (n_features * 4)
+        if len(train_idx) <= fit_rows:
+            clf, mode, chunks = trainer.fit_forest(X_train, y_train, params, **fit_kwargs), 'mmap', 1
+        else:
+            clf, chunks = trainer.fit_forest_chunked(X_train, y_train, params, fit_rows, **fit_kwargs)
+            mode = 'chunked'
+
+        info = _evaluate_forest(settings, clf, X_test, y_test, columns, len(y), job, chunk_rows)
+        info["out_of_core"] = {"mode": mode, "budget_bytes": budget, "matrix_bytes": int(X_train.nbytes),
+                               "chunk_rows": int(chunk_rows), "chunks": int(chunks)}
+        return clf, scl, info
+    finally:
+        matrices = X_train = X_test = None
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def fit_model_version(job=None, path=None, key=None):
+    """Train the RandomForest model with current configuration and return a new ModelVersion.
+
+    If a persisted artifact matches the CSV content and hyperparameters it is loaded
+    instead of refitting. `path` trains on another CSV than cfg['path'] (see
+    `dataset_registry`); `key` loads that artifact (one published by another worker)
+    and never fits. The version is not installed; see `train_model()`. Raises on
+    failure and JobCancelled when `job` is cancelled between phases or tree batches.
+    """
+    settings = _training_settings()
+    if path is not None:
+        settings['path'] = path
+        settings['cfg']['path'] = path
+    path = settings['path']
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"CSV file not found at path: {path}")
+
+    dataset_key = artifacts.file_digest(path)
+    saved = None
+    required = key is not None
+    if required or settings['use_artifacts']:
+        _report(job, 'load_artifact', 0.0)
+        if key is None:
+            key = artifacts.artifact_key(path, settings['numest'], settings['mxdepth'], settings['randstate'],
+                                         _artifact_extra(settings))
+        saved = artifacts.load_artifact(settings['artifact_dir'], key)
+        if saved is None and required:
+            raise FileNotFoundError(f"Model artifact {key} not found")
+
+    out_of_core = settings['cfg'].get('training_memory_budget') is not None
+    _report(job, 'load_csv', 0.02)
+    df = load_csv(path)
+    _report(job, 'preprocess', 0.1)
+    if out_of_core:
+        # No in-memory feature matrix: the fit streams the columns (see _fit_forest_out_of_core)
+        df_proc = df
+        X_columns = feature_columns(df)
+        means = pd.Series([df[c].mean() for c in X_columns], index=X_columns, dtype=np.float64)
+    else:
+        X, y, df_proc = preprocess(df)
+        X_columns, means = X.columns, X.mean()
+
+    if key is not None:
+        CACHE_REQUESTS.inc(cache='model_artifact', result='hit' if saved is not None else 'miss')
+    if saved is not None and list(X_columns) != saved['X_columns']:
+        if required:
+            raise ValueError(f"Model artifact {key} was trained on other columns than {path} has")
+        saved = None
+
+    if saved is None:
+        with _training_lock(settings):
+            # Another worker may have trained the same model while this one waited
+            if key is not None:
+                saved = artifacts.load_artifact(settings['artifact_dir'], key)
+            if saved is None or list(X_columns) != saved['X_columns']:
+                if out_of_core:
+                    clf, scl, info = _fit_forest_out_of_core(settings, df_proc, X_columns, means, job)
+                else:
+                    clf, scl, info = _fit_forest(settings, X, y, job)
+                if key is not None:
+                    _report(job, 'save_artifact', 0.95)
+                    try:
+                        artifacts.save_artifact(settings['artifact_dir'], key, clf, scl, X_columns, info)
+                        info['artifact'] = key
+                    except Exception as e:
+                        # Persisting is an optimisation; serving the fresh model must not depend on it
+                        print("Saving model artifact failed:", repr(e))
+                metrics.mark_phase('build_version')
+                return ModelVersion(clf, scl, X_columns, df_proc, info, means, dataset_key,
+                                    artifact_dir=settings['artifact_dir'])
+
+    info = dict(saved['model_info'], config=settings['cfg'], artifact=key)
+    metrics.mark_phase('build_version')
+    return ModelVersion(saved['model'], saved['scaler'], X_columns, df_proc, info, means, dataset_key,
+                        artifact_dir=settings['artifact_dir'])
+
+
+class IncrementalUnsupported(Exception):
+    """An append cannot be applied to the current version incrementally; refit instead."""
+
+
+def rescale_forest(model, old_mean, old_scale, new_scaler):
+    """Re-express every split threshold of `model` in `new_scaler`'s units (in place).
+
+    StandardScaler is an increasing affine map per feature, so after this each tree
+    splits the raw feature values exactly where it did under the old statistics.
+    """
+    new_mean = new_scaler.mean_
+    new_scale = new_scaler.scale_
+    for est in model.estimators_:
+        tree = est.tree_
+        feat = tree.feature
+        split = feat >= 0
+        f = feat[split]
+        thr = tree.threshold
+        thr[split] = (thr[split] * old_scale[f] + old_mean[f] - new_mean[f]) / new_scale[f]
+
+
+def extend_model_version(prev, rows, dataset_key, add_estimators, job=None):
+    """Build a new ModelVersion from `prev` plus appended `rows` without refitting.
+
+    Column means and the scaler statistics are updated with the new rows (`partial_fit`),
+    the existing trees are rescaled to match, and `add_estimators` trees are grown on
+    the new rows with warm_start. Raises IncrementalUnsupported when the append cannot
+    be applied this way.
+    """
+    settings = _training_settings()
+    X_columns = list(prev.X_columns)
+    classes = list(prev.classes)
+    if len(rows) == 0:
+        raise IncrementalUnsupported("no appended rows with a kept disposition")
+    if list(rows.columns) != list(prev.df_processed.columns):
+        raise IncrementalUnsupported("appended rows do not have the dataset's columns")
+    if not hasattr(prev.scaler, 'partial_fit'):
+        raise IncrementalUnsupported("the scaler cannot be updated incrementally")
+
+    prev_info = prev.model_info or {}
+    inc = prev_info.get('incremental') or {}
+    base_rows = inc.get('base_rows', len(prev.df_processed))
+    appended_total = inc.get('appended_rows', 0) + len(rows)
+    if appended_total > settings['cfg'].get('append_refit_ratio', 0.5) * base_rows:
+        raise IncrementalUnsupported(f"{appended_total} appended rows exceed the refit ratio of {base_rows} fitted rows")
+
+    y_new = rows['koi_disposition'].astype(str)
+    present = y_new.value_counts()
+    if sorted(present.index) != sorted(classes):
+        raise IncrementalUnsupported(f"appended rows must contain every class ({', '.join(classes)})")
+
+    # Update the imputation means from per-column counts and sums
+    _report(job, 'means', 0.05)
+    prev_X = prev.df_processed[X_columns].apply(pd.to_numeric, errors='coerce')
+    old_means = prev.feature_means if prev.feature_means is not None else prev_X.mean()
+    old_counts = prev_X.notna().sum()
+    X_new = rows.reindex(columns=X_columns).apply(pd.to_numeric, errors='coerce')
+    counts = old_counts + X_new.notna().sum()
+    means = (old_means.reindex(X_columns).fillna(0) * old_counts + X_new.sum()) / counts.where(counts > 0)
+    X_new = X_new.fillna(means)
+
+    # Hold out part of the new rows for evaluation when there are enough of them
+    evaluate = len(y_new) >= 10 and (present >= 2).all()
+    if evaluate:
         X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=0.2, random_state=randstate, stratify=y
+            X_new, y_new, test_size=0.2, random_state=settings['randstate'], stratify=y_new
         )
+    else:
+        X_train, y_train = X_new, y_new
+
+    # The served version must not change: work on copies
+    _report(job, 'scale', 0.15)
+    scl = copy.deepcopy(prev.scaler)
+    old_mean, old_scale = np.array(scl.mean_), np.array(scl.scale_)
+    scl.partial_fit(X_train)
+    clf = prev.model_copy()
+    rescale_forest(clf, old_mean, old_scale, scl)
+    clf.set_params(n_jobs=settings['cfg'].get('training_cpus') or -1)
+
+    _report(job, 'fit', 0.25)
+    X_train_scaled = scl.transform(X_train)
+    start = len(clf.estimators_)
+    target = start + max(1, int(add_estimators))
+    step = max(1, (target - start) // 10)
+    clf.set_params(warm_start=True)
+    grown = start
+    while grown < target:
+        grown = min(target, grown + step)
+        clf.set_params(n_estimators=grown)
+        clf.fit(X_train_scaled, y_train)
+        _report(job, 'fit', 0.25 + 0.6 * (grown - start) / (target - start))
+    clf.set_params(warm_start=False)
+
+    info = dict(prev_info)
+    info.pop('artifact', None)
+    # The headline accuracy / confusion_matrix / classification_report stay those of the
+    # full fit's test split; a few held-out appended rows are too small a sample to replace them
+    batch_evaluation = None
+    if evaluate:
+        _report(job, 'evaluate', 0.85)
+        y_pred = clf.predict(scl.transform(X_test))
+        batch_evaluation = {
+            "rows": len(y_test),
+            "accuracy": accuracy_score(y_test, y_pred),
+            "confusion_matrix": confusion_matrix(y_test, y_pred, labels=classes).tolist(),
+            "classification_report": classification_report(y_test, y_pred, output_dict=True, zero_division=0),
+        }
+    df = pd.concat([prev.df_processed, rows], ignore_index=True)
+    info['n_samples'] = len(df)
+    info['config'] = settings['cfg']
+    # The permutation importances measured the previous forest; impurity ones cover the new trees
+    info['feature_importance'] = {"impurity": attribution.impurity_importance(clf, X_columns)}
+    info['incremental'] = {
+        "base_rows": base_rows,
+        "appended_rows": appended_total,
+        "batch_rows": len(rows),
+        "added_estimators": grown - start,
+        "n_estimators": grown,
+        # Scores of the grown forest on the held-out part of this batch (None if too few rows)
+        "batch_evaluation": batch_evaluation,
+    }
+    if settings['cfg'].get('shared_artifacts') and settings['use_artifacts']:
+        # Other workers load this version from its artifact (see publish_version); the key
+        # differs from the CSV's full-fit key, so a later full retrain still refits
+        _report(job, 'save_artifact', 0.88)
+        key = artifacts.artifact_key(settings['path'], settings['numest'], settings['mxdepth'], settings['randstate'],
+                                     dict(_artifact_extra(settings), appended_to=prev.dataset_key, n_estimators=grown))
+        try:
+            artifacts.save_artifact(settings['artifact_dir'], key, clf, scl, X_columns, info)
+            info['artifact'] = key
+        except Exception as e:
+            print("Saving model artifact failed:", repr(e))
+    _report(job, 'publish', 0.9)
+    return ModelVersion(clf, scl, prev.X_columns, df, info, means, dataset_key, base=prev,
+                        artifact_dir=settings['artifact_dir'])
 
-        # Scale
-        scl = StandardScaler()
-        X_train_scaled = scl.fit_transform(X_train)
-        X_test_scaled = scl.transform(X_test)
 
-        clf = RandomForestClassifier(n_estimators=numest, max_depth=mxdepth, random_state=randstate, n_jobs=-1)
-        clf.fit(X_train_scaled, y_train)
+def timed_build(operation, build, *args):
+    """Call `build(*args)` (which returns a ModelVersion) with its phases timed.
 
-        # Evaluate
-        y_pred = clf.predict(X_test_scaled)
-        acc = accuracy_score(y_test, y_pred)
-        conf = confusion_matrix(y_test, y_pred).tolist()
-        class_rep = classification_report(y_test, y_pred, output_dict=True)
-
-        # Update globals
-        model = clf
-        scaler = scl
-        X_columns = X.columns
-        df_processed = df_proc
-        model_info = {
-            "accuracy": acc,
-            "confusion_matrix": conf,
-            "classification_report": class_rep,
-            "n_features": len(X_columns),
-            "n_samples": len(df_proc),
-            "config": cfg.copy()
-        }
+    Phase durations go to the training metrics and to the version's
+    model_info['phase_seconds']; outcomes are counted per operation.
+    """
+    with metrics.PhaseTimer(TRAINING_PHASE_SECONDS, operation) as timer:
+        try:
+            mv = build(*args)
+        except JobCancelled:
+            TRAINING_RUNS.inc(operation=operation, outcome='cancelled')
+            raise
+        except IncrementalUnsupported:
+            TRAINING_RUNS.inc(operation=operation, outcome='unsupported')
+            raise
+        except Exception:
+            TRAINING_RUNS.inc(operation=operation, outcome='failed')
+            raise
+    TRAINING_RUNS.inc(operation=operation, outcome='ok')
+    mv.model_info['phase_seconds'] = {phase: round(secs, 4) for phase, secs in timer.seconds.items()}
+    return mv
+
+
+def _record_training_failure(e):
+    global model_info
+    if active_version is None:
+        model_info = {"error": str(e)}
+    print("Model training failed:", repr(e))
+
+
+def train_model():
+    """Train and install a new model version synchronously. Returns True on success.
+
+    On failure the previous version (if any) keeps serving; the error is stored in
+    `model_info` only when nothing has been trained yet.
+    """
+    try:
+        mv = timed_build('fit', fit_model_version)
+        install_version(mv)
+        publish_version(mv)
         return True
     except Exception as e:
-        model_info = {"error": str(e)}
+        _record_training_failure(e)
         return False
 
 
-def predict_by_kepid(kepid):
-    """Return prediction and probabilities for a kepid. If multiple rows exist, returns all."""
-    if model is None or scaler is None or df_processed is None:
-        return {"error": "Model not trained"}
+def _training_job(job):
+    """Job body used by `submit_training()`."""
+    try:
+        mv = timed_build('fit', fit_model_version, job)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        _record_training_failure(e)
+        raise
+    _report(job, 'install', 0.99)
+    install_version(mv)
+    publish_version(mv)
+    return {"version": mv.id, "accuracy": mv.model_info.get('accuracy')}
 
-    obs = df_processed[df_processed['kepid'] == kepid]
-    if obs.empty:
-        return {"error": f"No observation found with kepid: {kepid}"}
 
-    features = obs[X_columns]
-    feat_scaled = scaler.transform(features)
-    preds = model.predict(feat_scaled)
-    probs = model.predict_proba(feat_scaled)
-    classes = model.classes_
+def submit_training():
+    """Queue a retrain with the current cfg.
 
-    results = []
-    for i in range(len(preds)):
-        prob_map = {str(classes[j]): float(probs[i][j]) for j in range(len(classes))}
-        results.append({
-            "kepid": int(obs.iloc[i]['kepid']) if pd.notnull(obs.iloc[i]['kepid']) else None,
-            "kepler_name": str(obs.iloc[i]['kepler_name']) if pd.notnull(obs.iloc[i]['kepler_name']) else None,
-            "kepoi_name": str(obs.iloc[i]['kepoi_name']) if pd.notnull(obs.iloc[i]['kepoi_name']) else None,
-            "name": str(obs.iloc[i]['kepler_name']) if pd.notnull(obs.iloc[i]['kepler_name']) and obs.iloc[i]['kepler_name'] not in (None, '') else str(obs.iloc[i]['kepoi_name']) if pd.notnull(obs.iloc[i]['kepoi_name']) else None,
-            "koi_steff": float(obs.iloc[i]['koi_steff']) if pd.notnull(obs.iloc[i]['koi_steff']) else None,
-            "koi_disposition": str(obs.iloc[i]['koi_disposition']) if pd.notnull(obs.iloc[i]['koi_disposition']) else None,
-            "koi_duration": float(obs.iloc[i]['koi_duration']) if pd.notnull(obs.iloc[i]['koi_duration']) else None,
-            "koi_srad": float(obs.iloc[i]['koi_srad']) if pd.notnull(obs.iloc[i]['koi_srad']) else None,
-            "koi_slogg": float(obs.iloc[i]['koi_slogg']) if pd.notnull(obs.iloc[i]['koi_slogg']) else None,
-            "koi_model_snr": float(obs.iloc[i]['koi_model_snr']) if pd.notnull(obs.iloc[i]['koi_model_snr']) else None,
-            "koi_depth": float(obs.iloc[i]['koi_depth']) if pd.notnull(obs.iloc[i]['koi_depth']) else None,
-            "koi_period": float(obs.iloc[i]['koi_period']) if pd.notnull(obs.iloc[i]['koi_period']) else None,
-            "prediction": str(preds[i]),
-            "probabilities": prob_map
-        })
-    return {"results": results}
+    Requests made while a retrain is still queued share that job (it reads cfg when
+    it starts, so it picks up the latest settings); a running retrain is never joined.
+    """
+    return training_jobs.submit('train', _training_job, key='train')
+
+
+def _append_job(job, rows, base_key, dataset_key, add_estimators, mode):
+    """Job body for /append_csv: grow the active version with `rows`, or refit from the CSV."""
+    reason = "full refit requested"
+    if mode == 'incremental':
+        prev = active_version
+        if prev is None or prev.dataset_key != base_key:
+            reason = "the served model was not trained on the dataset before this append"
+        else:
+            try:
+                mv = timed_build('append', extend_model_version, prev, rows, dataset_key, add_estimators, job)
+            except IncrementalUnsupported as e:
+                reason = str(e)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                _record_training_failure(e)
+                raise
+            else:
+                install_version(mv)
+                publish_version(mv)
+                return {"version": mv.id, "accuracy": mv.model_info.get('accuracy'), "mode": "incremental"}
+        print(f"Incremental append not applied ({reason}); refitting")
+    result = _training_job(job)
+    return dict(result, mode="full", reason=reason)
 
 
-def row_to_general_entry(row):
-    """Convert a DataFrame row (Series) to the GeneralData JSON-friendly dict."""
-    def safe_str(col):
-        if col in row and pd.notnull(row[col]):
-            return str(row[col])
+# --- multi-worker serving (see wsgi.py) ---
+
+# cfg values a published version carries to the other workers
+SHARED_CONFIG = ('path', 'numest', 'mxdepth', 'randstate', *FOREST_DEFAULTS)
+
+# Modification stamp of the last published record seen, and when it was last checked
+_published = {"stamp": None, "checked": 0.0}
+_published_lock = threading.Lock()
+
+
+def publish_version(mv):
+    """Have the other workers sharing cfg['artifact_dir'] serve `mv` (with cfg['shared_artifacts'])."""
+    key = mv.model_info.get('artifact')
+    if not cfg.get('shared_artifacts') or not key:
+        return
+    conf = mv.model_info.get('config') or {}
+    record = {"artifact": key, "path": conf.get('path'), "config": {k: conf.get(k) for k in SHARED_CONFIG},
+              "dataset_key": mv.dataset_key, "pid": os.getpid(), "published_at": time.time()}
+    try:
+        artifacts.publish(cfg['artifact_dir'], record)
+    except Exception as e:
+        print("Publishing the model version failed:", repr(e))
+        return
+    with _published_lock:
+        _published['stamp'] = artifacts.published_stamp(cfg['artifact_dir'])
+
+
+def _sync_job(job, record):
+    """Job body for `sync_published_version()`: adopt the record's config and load its artifact."""
+    with config_lock:
+        for k, v in record.get('config', {}).items():
+            cfg[k] = v
+    try:
+        mv = timed_build('load', fit_model_version, job, record['path'], record['artifact'])
+    except FileNotFoundError as e:
+        if active_version is not None:
+            raise
+        # Nothing to serve yet: train from the adopted config instead
+        print("Published version unavailable, training instead:", repr(e))
+        return _training_job(job)
+    _report(job, 'install', 0.99)
+    install_version(mv)
+    return {"version": mv.id, "artifact": record['artifact'], "published_by": record.get('pid')}
+
+
+def sync_published_version(force=False):
+    """Queue loading the version another worker published, if it is not the one served here.
+
+    Checks the published record's stamp at most every cfg['sync_interval'] seconds unless
+    `force`. Returns the queued job, or None.
+    """
+    if not cfg.get('shared_artifacts'):
+        return None
+    now = time.monotonic()
+    with _published_lock:
+        if not force and now - _published['checked'] < cfg.get('sync_interval', 2.0):
+            return None
+        _published['checked'] = now
+        stamp = artifacts.published_stamp(cfg['artifact_dir'])
+        if stamp is None or stamp == _published['stamp']:
+            return None
+        _published['stamp'] = stamp
+    record = artifacts.read_published(cfg['artifact_dir'])
+    mv = active_version
+    if record is None or (mv is not None and mv.model_info.get('artifact') == record['artifact']):
         return None
+    return training_jobs.submit('sync', lambda j: _sync_job(j, record), key='sync',
+                                params={"artifact": record['artifact']})
 
-    def safe_num(col):
-        if col in row and pd.notnull(row[col]):
-            v = row[col]
-            if isinstance(v, (np.integer,)):
-                return int(v)
-            try:
-                return float(v)
-            except Exception:
-                return None
+
+def startup(background=False):
+    """Bring up the first model version: the published one (shared mode), else train.
+
+    Returns True when a version was installed (always None with `background`, which
+    only queues the job).
+    """
+    job = sync_published_version(force=True)
+    if job is None and active_version is None:
+        if background:
+            job = submit_training()
+        else:
+            return train_model()
+    if job is not None and not background:
+        job.wait()
+        return job.status == SUCCEEDED
+    return None
+
+
+# --- datasets served side by side (see registry.py) ---
+
+def _version_bytes(mv):
+    return sum(mv.memory_usage().values())
+
+
+# Versions for uploaded CSVs other than cfg['path'], addressed by file name
+dataset_registry = ModelRegistry(cfg['registry_memory_budget'], cfg['registry_max_datasets'], _version_bytes)
+REGISTRY_EVICTIONS = metrics.REGISTRY.counter(
+    'nasa_registry_evictions_total', 'Datasets evicted from the registry to stay within its budget.')
+
+
+def _dataset_path(dataset_id):
+    """Path of the uploaded CSV named `dataset_id`, or None if there is no such file."""
+    name = secure_filename(dataset_id or '')
+    if not name:
         return None
+    path = os.path.join(cfg['upload_dir'], name)
+    return path if os.path.isfile(path) else None
 
-    def safe_id(col):
-        if col in row and pd.notnull(row[col]):
-            try:
-                v = row[col]
-                if isinstance(v, (np.integer,)):
-                    return int(v)
-                fv = float(v)
-                if fv.is_integer():
-                    return int(fv)
-                return int(fv)
-            except Exception:
-                return None
+
+def _dataset_stamp(path):
+    # A re-uploaded or appended CSV invalidates the loaded version
+    try:
+        return os.path.getmtime(path)
+    except OSError:
         return None
 
-    kepler_name = safe_str('kepler_name')
-    kepoi_name = safe_str('kepoi_name')
-    name = kepler_name if kepler_name not in (None, '') else kepoi_name
-
-    return {
-        'kepid': safe_id('kepid'),
-        'kepler_name': kepler_name,
-        'kepoi_name': kepoi_name,
-        'name': name,
-        'koi_steff': safe_num('koi_steff'),
-        'koi_disposition': safe_str('koi_disposition'),
-        'koi_duration': safe_num('koi_duration'),
-        'koi_srad': safe_num('koi_srad'),
-        'koi_slogg': safe_num('koi_slogg'),
-        'koi_model_snr': safe_num('koi_model_snr'),
-        'koi_depth': safe_num('koi_depth'),
-        'koi_period': safe_num('koi_period')
-    }
+
+def _load_dataset_job(job, dataset_id, path):
+    """Job body for dataset loads: fit (or load the artifact of) `path` and register it."""
+    stamp = _dataset_stamp(path)
+    mv = timed_build('fit', fit_model_version, job, path)
+    _report(job, 'register', 0.99)
+    evicted = dataset_registry.put(dataset_id, mv, stamp)
+    REGISTRY_EVICTIONS.inc(len(evicted))
+    return {"dataset": dataset_id, "version": mv.id, "accuracy": mv.model_info.get('accuracy'), "evicted": evicted}
+
+
+def submit_dataset_load(dataset_id, path):
+    """Queue loading `dataset_id`; concurrent requests for it share one job."""
+    return training_jobs.submit('dataset', lambda j: _load_dataset_job(j, dataset_id, path),
+                                key=f"dataset:{dataset_id}", params={"dataset": dataset_id}, join_running=True)
+
+
+def _is_active_path(path):
+    mv = active_version
+    return mv is not None and os.path.abspath(mv.model_info.get('config', {}).get('path', '')) == os.path.abspath(path)
+
+
+def request_version():
+    """The ModelVersion a request addresses, as (version, None) or (None, error response).
+
+    `?dataset=<name>` (or the X-Dataset header) selects an uploaded CSV; without it,
+    or when it names the served CSV, the active version is used (which may be None
+    before the first fit). A dataset that is not loaded yet is queued for loading and
+    answered with 503 + Retry-After and the job to poll.
+    """
+    dataset_id = request.args.get('dataset') or request.headers.get('X-Dataset')
+    if not dataset_id:
+        return active_version, None
+    path = _dataset_path(dataset_id)
+    if path is None:
+        return None, (jsonify({"error": f"Unknown dataset: {dataset_id}"}), 404)
+    if _is_active_path(path):
+        return active_version, None
+    dataset_id = os.path.basename(path)
+    mv = dataset_registry.get(dataset_id, _dataset_stamp(path))
+    if mv is not None:
+        return mv, None
+    job = submit_dataset_load(dataset_id, path)
+    response = jsonify({"error": f"Dataset {dataset_id} is loading; retry shortly", "job": job.to_dict()})
+    response.headers['Retry-After'] = '5'
+    return None, (response, 503)
+
+
+def request_model_info():
+    """model_info of the version a request addresses, as (model_info, None) or (None, error response)."""
+    mv, error = request_version()
+    if error:
+        return None, error
+    return (model_info if mv is active_version else mv.model_info), None
+
+
+def predict_by_kepid(kepid, mv=None):
+    """Return prediction and probabilities for a kepid. If multiple rows exist, returns all."""
+    mv = mv or active_version
+    if mv is None:
+        return {"error": "Model not trained"}
+    rows = mv.index.by_kepid(kepid)
+    if len(rows) == 0:
+        return {"error": f"No observation found with kepid: {kepid}"}
+
+    results = []
+    for i in rows:
+        entry = mv.dataset.record(i)
+        # Numeric fields are always reported as floats here
+        result = {k: float(v) if k in GENERAL_NUM_FIELDS and v is not None else v for k, v in entry.items()}
+        result.update(mv.prediction_for(i) or {"prediction": None, "probabilities": None})
+        results.append(result)
+    return {"results": results}
+
+
+GENAI_MODEL = "gemini-2.5-flash"
 
 
 def call_genai_and_get_text(prompt: str):
@@ -258,7 +1273,7 @@ def call_genai_and_get_text(prompt: str):
 
     try:
         response = genai_client.models.generate_content(
-            model="gemini-2.5-flash",
+            model=GENAI_MODEL,
             contents=prompt
         )
         # response.text contains the generated text
@@ -267,6 +1282,33 @@ def call_genai_and_get_text(prompt: str):
         return None, str(e)
 
 
+def stub_genai_text(prompt: str):
+    """Offline stand-in for `call_genai_and_get_text`: a fixed three-section answer per prompt."""
+    digest = ExplanationCache.key('stub', prompt)[:12]
+    text = (
+        "1) Overview\nRespuesta local de prueba (" + digest + ").\n\n"
+        "2) Key Details\nGenerada sin llamar a Gemini.\n\n"
+        "3) Conclusion\nConfigura GEMINI_API_KEY para respuestas reales."
+    )
+    return text, None
+
+
+# The function used to generate explanations. GENAI_BACKEND=stub selects the
+# offline stub (tests, development without a key); it can also be reassigned.
+genai_generate = stub_genai_text if os.getenv('GENAI_BACKEND', '').lower() == 'stub' else call_genai_and_get_text
+
+
+def explain(prompt: str):
+    """Return (text, error, cached) for `prompt` through the explanation cache.
+
+    Identical prompts requested concurrently share one call to `genai_generate`.
+    """
+    model = GENAI_MODEL if genai_generate is call_genai_and_get_text else getattr(genai_generate, '__name__', 'custom')
+    text, err, cached = explanation_cache.get_or_compute(model, prompt, genai_generate)
+    CACHE_REQUESTS.inc(cache='explanation', result='hit' if cached else 'miss')
+    return text, err, cached
+
+
 def build_general_prompt(model_info: dict):
     """Create a Spanish prompt asking Gemini to explain the overall model results."""
     acc = model_info.get('accuracy') if isinstance(model_info, dict) else None
@@ -295,10 +1337,17 @@ def build_general_prompt(model_info: dict):
     return prompt
 
 
-def build_specific_prompt(entry: dict, prediction: Optional[dict] = None):
-    """Create a Spanish prompt for a single planet using its GeneralData entry and optional prediction info."""
+def build_specific_prompt(entry: dict, prediction: Optional[dict] = None, drivers: Optional[dict] = None):
+    """Create a Spanish prompt for a single planet using its GeneralData entry and optional prediction info.
+
+    `drivers` is the `RowAttributions.top()` result for the predicted class, if available.
+    """
     entry_json = json.dumps(entry, default=str, indent=2, ensure_ascii=False)
     pred_json = json.dumps(prediction, default=str, indent=2, ensure_ascii=False) if prediction else "Sin predicción disponible"
+    if drivers:
+        drivers_text = "\n".join(f"                - {d['feature']}: {d['contribution']:+.3f}" for d in drivers['contributions'])
+    else:
+        drivers_text = "                Sin información disponible"
 
     prompt = f"""
                 Eres un comunicador científico experto. Explica de forma larga pero sencilla la información sobre este candidato a exoplaneta y, si existe, la predicción del modelo.
@@ -309,6 +1358,9 @@ def build_specific_prompt(entry: dict, prediction: Optional[dict] = None):
                 Predicción del modelo:
                 {pred_json}
 
+                Características que más influyeron en la predicción (cambio que aporta cada una a la probabilidad de la clase predicha, partiendo de {drivers['base_value'] if drivers else 'N/A'}):
+{drivers_text}
+
                 Por favor, responde en español y entrega una explicación larga pero simple dividida en estas tres secciones claramente marcadas:
                 1) Overview
                 2) Key Details
@@ -323,43 +1375,443 @@ def build_specific_prompt(entry: dict, prediction: Optional[dict] = None):
 @app.route('/predict/<int:kepid>', methods=['GET'])
 def api_predict(kepid):
     """Predict endpoint: returns prediction for a kepid."""
-    res = predict_by_kepid(kepid)
+    mv, error = request_version()
+    if error:
+        return error
+    res = predict_by_kepid(kepid, mv)
     return jsonify(res)
 
 
+@app.route('/predictions', methods=['GET'])
+def api_predictions():
+    """Stream the precomputed prediction table for every processed row.
+
+    Query param: format=ndjson (default, one JSON object per line) or csv.
+    """
+    mv, error = request_version()
+    if error:
+        return error
+    if mv is None:
+        return jsonify({"error": "Data not loaded / model not trained"}), 400
+    fmt = request.args.get('format', 'ndjson').lower()
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({"error": "format must be 'ndjson' or 'csv'"}), 400
+
+    def generate():
+        chunk_rows = 1000
+        n = len(mv.dataset)
+        if fmt == 'csv':
+            buf = io.StringIO()
+            writer = csv.writer(buf, lineterminator='\n')
+            writer.writerow(['kepid', 'kepoi_name', 'prediction'] + [f"prob_{c}" for c in mv.classes])
+        for start in range(0, n, chunk_rows):
+            lines = []
+            for i, entry in enumerate(mv.dataset.records(start, start + chunk_rows), start):
+                pred = mv.prediction_for(i)
+                if fmt == 'csv':
+                    probs = [f"{p:.6f}" for p in mv.pred_proba[i]] if pred else [''] * len(mv.classes)
+                    writer.writerow([entry['kepid'], entry['kepoi_name'], pred['prediction'] if pred else ''] + probs)
+                else:
+                    lines.append(json.dumps({
+                        "kepid": entry['kepid'],
+                        "kepoi_name": entry['kepoi_name'],
+                        "prediction": pred['prediction'] if pred else None,
+                        "probabilities": pred['probabilities'] if pred else None,
+                    }) + '\n')
+            if fmt == 'csv':
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+            else:
+                yield ''.join(lines)
+        if fmt == 'csv' and n == 0:
+            yield buf.getvalue()
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(generate(), mimetype=mimetype)
+
+
+def _read_ndjson_frames(stream, rows_per_frame):
+    """Yield DataFrames of up to `rows_per_frame` objects parsed from an NDJSON text stream."""
+    batch = []
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        batch.append(json.loads(line))
+        if len(batch) >= rows_per_frame:
+            yield pd.DataFrame.from_records(batch)
+            batch = []
+    if batch:
+        yield pd.DataFrame.from_records(batch)
+
+
+def score_frames(mv, frames, batch_size):
+    """Score DataFrames of raw feature rows with `mv`, `batch_size` rows per model call.
+
+    Yields (frame, pred_class, pred_proba) with the same layout as `predict_table`.
+    """
+    for frame in frames:
+        X = prepare_features(frame, mv.X_columns, mv.feature_means)
+        for start in range(0, len(X), batch_size):
+            probs = mv.predict_proba(mv.scaler.transform(X.iloc[start:start + batch_size]))
+            yield frame.iloc[start:start + batch_size], probs.argmax(axis=1), probs
+
+
+@app.route('/predict/batch', methods=['POST'])
+def api_predict_batch():
+    """Score arbitrary KOI rows uploaded as CSV or NDJSON and stream the results.
+
+    The body is read in chunks and scored `batch_size` rows at a time, so memory stays
+    bounded regardless of the input size. Each row needs the feature columns the model
+    was trained on (see /model_info); missing values are filled with the training means.
+
+    Query params:
+      - format: csv or ndjson (default: from Content-Type, falling back to csv)
+      - batch_size: rows per model call (default 10000)
+    Output uses the input format. Each result has the row number, kepid/kepoi_name when
+    provided, the prediction and the class probabilities.
+    """
+    mv, error = request_version()
+    if error:
+        return error
+    if mv is None or mv.feature_means is None:
+        return jsonify({"error": "Data not loaded / model not trained"}), 400
+
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'ndjson' if 'json' in (request.mimetype or '') else 'csv'
+    fmt = fmt.lower()
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be 'csv' or 'ndjson'"}), 400
+    try:
+        batch_size = max(1, int(request.args.get('batch_size', 10000)))
+    except ValueError:
+        return jsonify({"error": "Invalid batch_size"}), 400
+
+    # Scoring streams the body, so allow inputs above the general upload limit
+    request.max_content_length = cfg.get('batch_max_bytes')
+
+    def generate():
+        text = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        if fmt == 'csv':
+            frames = pd.read_csv(text, chunksize=batch_size)
+            buf = io.StringIO()
+            writer = csv.writer(buf, lineterminator='\n')
+            writer.writerow(['row', 'kepid', 'kepoi_name', 'prediction'] + [f"prob_{c}" for c in mv.classes])
+        else:
+            frames = _read_ndjson_frames(text, batch_size)
+
+        row = 0
+        try:
+            for frame, pred, probs in score_frames(mv, frames, batch_size):
+                kepids = frame['kepid'].tolist() if 'kepid' in frame else [None] * len(frame)
+                kepois = frame['kepoi_name'].tolist() if 'kepoi_name' in frame else [None] * len(frame)
+                out = []
+                for j in range(len(frame)):
+                    kepid = kepids[j] if pd.notnull(kepids[j]) else None
+                    kepoi = kepois[j] if pd.notnull(kepois[j]) else None
+                    if fmt == 'csv':
+                        writer.writerow([row, kepid, kepoi, mv.classes[pred[j]]] + [f"{p:.6f}" for p in probs[j]])
+                    else:
+                        out.append(json.dumps({
+                            "row": row,
+                            "kepid": kepid,
+                            "kepoi_name": kepoi,
+                            "prediction": mv.classes[pred[j]],
+                            "probabilities": {c: round(float(p), 6) for c, p in zip(mv.classes, probs[j])},
+                        }, default=str) + '\n')
+                    row += 1
+                if fmt == 'csv':
+                    yield buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
+                else:
+                    yield ''.join(out)
+        except Exception as e:
+            # Headers are already sent; report the failure in-band and stop
+            msg = f"Batch prediction failed after {row} rows: {e}"
+            if fmt == 'csv':
+                yield buf.getvalue() + f"# error: {msg}\n"
+            else:
+                yield json.dumps({"error": msg}) + '\n'
+            return
+        if fmt == 'csv' and row == 0:
+            yield buf.getvalue()
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def _int_arg(name, default=None, minimum=0):
+    """Integer query parameter >= `minimum`; raises ValueError with a client-facing message."""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}")
+    if value < minimum:
+        raise ValueError(f"{name} must be >= {minimum}")
+    return value
+
+
 @app.route('/planets', methods=['GET'])
 def api_planets():
-    """Return all processed planets (as JSON records)."""
-    if df_processed is None:
+    """Stream the processed planets.
+
+    Query params:
+      - format: json (default, a JSON array), ndjson, csv or arrow (Arrow IPC stream; needs pyarrow)
+      - fields: comma-separated columns to return (default: all)
+      - offset / limit: row range (default: every row)
+    Rows are encoded column-wise in chunks of exports.CHUNK_ROWS and streamed.
+    X-Total-Count has the dataset's row count.
+    """
+    mv, error = request_version()
+    if error:
+        return error
+    if mv is None:
+        return jsonify({"error": "Data not loaded / model not trained"}), 400
+    df = mv.df_processed
+
+    fmt = request.args.get('format', 'json').lower()
+    if fmt not in exports.FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(exports.FORMATS)}"}), 400
+    if fmt == 'arrow' and not exports.arrow_available():
+        return jsonify({"error": "Arrow output needs the pyarrow package on the server"}), 501
+
+    fields = None
+    if request.args.get('fields'):
+        fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+        unknown = [f for f in fields if f not in df.columns]
+        if unknown:
+            return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+    try:
+        offset = _int_arg('offset', 0)
+        limit = _int_arg('limit')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    body = exports.iter_table(fmt, df, fields, offset, limit)
+    response = Response(body, mimetype=exports.MIMETYPES[fmt])
+    response.headers['X-Total-Count'] = str(len(df))
+    return response
+
+
+# Rows per /planets/query page: default and maximum
+QUERY_PAGE_DEFAULT = 50
+QUERY_PAGE_MAX = 1000
+
+
+def _float_arg(name):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        raise QueryError(f"Invalid {name}")
+    if value != value:
+        raise QueryError(f"Invalid {name}")
+    return value
+
+
+def _list_arg(name):
+    values = []
+    for v in request.args.getlist(name):
+        values.extend(x.strip() for x in v.split(',') if x.strip())
+    return values
+
+
+@app.route('/planets/query', methods=['GET'])
+def api_planets_query():
+    """Filter, sort and page the processed planets.
+
+    Query params:
+      - <column>_min / <column>_max (inclusive) for koi_period, koi_depth, koi_steff,
+        koi_srad, koi_slogg and koi_model_snr
+      - disposition, prediction: comma-separated (or repeated) values, any of which match
+      - sort: kepoi_name (default), kepid or one of the range columns; prefix with '-'
+        or pass order=desc for descending. Rows without a value come last.
+      - limit: rows per page (default 50, at most 1000)
+      - cursor: `next_cursor` of the previous page
+    Returns {"count", "results", "next_cursor", "sort", "order", "version"}; each result
+    is the GeneralData entry plus the precomputed prediction and probabilities.
+    """
+    mv, error = request_version()
+    if error:
+        return error
+    if mv is None:
         return jsonify({"error": "Data not loaded / model not trained"}), 400
-    # Convert to records; ensure serializable types
-    records = df_processed.to_dict(orient='records')
-    return jsonify(records)
+    try:
+        sort = request.args.get('sort', DEFAULT_SORT).strip()
+        descending = request.args.get('order', 'asc').lower() == 'desc'
+        if sort.startswith('-'):
+            sort, descending = sort[1:], True
+        ranges = {}
+        for col in RANGE_COLUMNS:
+            lo, hi = _float_arg(f"{col}_min"), _float_arg(f"{col}_max")
+            if lo is not None or hi is not None:
+                ranges[col] = (lo, hi)
+        limit = _int_arg('limit', QUERY_PAGE_DEFAULT, minimum=1)
+        limit = min(limit, QUERY_PAGE_MAX)
+        cursor = decode_cursor(request.args['cursor'], sort, descending) if request.args.get('cursor') else None
+
+        qi = mv.query_index
+        mask = qi.filter_mask(ranges, _list_arg('disposition'), _list_arg('prediction'))
+        rows, more = qi.page(sort, descending, mask, limit, cursor)
+    except ValueError as e:
+        # QueryError and invalid integers
+        return jsonify({"error": str(e)}), 400
+
+    results = []
+    for i in rows.tolist():
+        entry = mv.dataset.record(i)
+        entry.update(mv.prediction_for(i) or {"prediction": None, "probabilities": None})
+        results.append(entry)
+    return jsonify({
+        "count": qi.count(mask),
+        "results": results,
+        "next_cursor": qi.cursor_after(sort, descending, rows[-1]) if more and len(rows) else None,
+        "sort": sort,
+        "order": "desc" if descending else "asc",
+        "version": mv.id,
+    })
+
+
+def _is_truthy(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def _wants_wait(body=None):
+    """True if the client asked to block until the job finishes (?wait=1 or {"wait": true})."""
+    q = request.args.get('wait')
+    if q is not None:
+        return _is_truthy(q)
+    if body is None:
+        return False
+    v = body.get('wait', False)
+    return _is_truthy(v) if isinstance(v, str) else bool(v)
+
+
+def _training_response(response, wait, flag_key='retrain', error_status=200, job=None):
+    """Queue a retrain (unless `job` was already submitted) and attach it to `response`.
+
+    By default returns 202 with the job so the client can poll /jobs/<id>. With
+    `wait`, blocks until the job finishes and reports `flag_key` and `model_info`
+    like the original synchronous endpoints did.
+    """
+    job = job or submit_training()
+    if not wait:
+        response['job'] = job.to_dict()
+        return jsonify(response), 202
+
+    job.wait()
+    ok = job.status == SUCCEEDED
+    response[flag_key] = ok
+    response['model_info'] = model_info if ok else {"error": job.error or job.status}
+    response['job'] = job.to_dict()
+    return jsonify(response), (200 if ok else error_status)
 
 
 @app.route('/config/hyperparams', methods=['POST'])
 def api_set_hyperparams():
-    """Update numest, mxdepth, randstate and retrain the model.
+    """Update numest, mxdepth, randstate and retrain the model in the background.
 
     JSON body example: {"numest":200, "mxdepth":10, "randstate":101}
+    Also accepts max_features, min_samples_leaf, min_samples_split and criterion.
+    Add {"wait": true} (or ?wait=1) to block until the retrain finishes.
     """
     body = request.get_json(force=True)
     updated = {}
     with config_lock:
-        for k in ('numest', 'mxdepth', 'randstate'):
+        for k in ('numest', 'mxdepth', 'randstate', *FOREST_DEFAULTS):
             if k in body:
                 cfg[k] = body[k]
                 updated[k] = body[k]
 
-    ok = train_model()
-    if not ok:
-        return jsonify({"updated": updated, "train": False, "model_info": model_info}), 500
-    return jsonify({"updated": updated, "train": True, "model_info": model_info})
+    return _training_response({"updated": updated}, _wants_wait(body), flag_key='train', error_status=500)
+
+
+def _search_job(job, grid, n_folds, factor, halving, workers, promote):
+    """Job body for /config/search."""
+    settings = _training_settings()
+    path = settings['path']
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"CSV file not found at path: {path}")
+
+    job.update(phase='load_csv', progress=0.0)
+    X, y, _ = preprocess(load_csv(path))
+    base = {"n_estimators": settings['numest'], "max_depth": settings['mxdepth'],
+            "random_state": settings['randstate'], **settings['forest']}
+    candidates = hpsearch.expand_grid(grid, base)
+
+    # Folds depend only on the data, k and the seed: reused by every candidate and later searches
+    job.check_cancelled()
+    job.update(phase='folds')
+    folds_root = os.path.join(settings['artifact_dir'], 'search')
+    folds_dir = hpsearch.folds_dir_for(folds_root, artifacts.file_digest(path), n_folds, settings['randstate'])
+    meta = hpsearch.prepare_folds(folds_dir, X, y, n_folds, settings['randstate'])
+
+    job.check_cancelled()
+    job.update(phase='search')
+    result = hpsearch.run_search(folds_dir, meta, candidates, factor=factor, halving=halving, workers=workers,
+                                 on_progress=job.update, check_cancelled=job.check_cancelled)
+
+    if promote:
+        best = result['best']['params']
+        promoted = {"numest": best['n_estimators'], "mxdepth": best['max_depth'], "randstate": best['random_state']}
+        promoted.update({k: best[k] for k in FOREST_DEFAULTS})
+        with config_lock:
+            cfg.update(promoted)
+        train = submit_training()
+        result['promoted'] = {"config": promoted, "job": train.id}
+    return result
+
+
+@app.route('/config/search', methods=['POST'])
+def api_search_hyperparams():
+    """Cross-validated hyperparameter search in the background.
+
+    JSON body example:
+      {"grid": {"numest": [50, 100, 200], "mxdepth": {"min": 5, "max": 30, "step": 5},
+                "max_features": ["sqrt", "log2"], "min_samples_leaf": [1, 2, 4]},
+       "folds": 5, "factor": 3, "halving": true, "promote": false}
+    Parameters missing from the grid keep their current cfg value. With "promote" the best
+    configuration is written to cfg and a retrain is queued. Returns 202 with the job.
+    """
+    body = request.get_json(force=True) or {}
+    grid = body.get('grid') or {}
+    if not isinstance(grid, dict):
+        return jsonify({"error": "'grid' must be an object"}), 400
+    try:
+        hpsearch.expand_grid(grid)
+        n_folds = int(body.get('folds', 5))
+        factor = int(body.get('factor', 3))
+        with config_lock:
+            workers = int(body.get('workers', cfg['search_workers']))
+        if not 2 <= n_folds <= 20 or factor < 2 or workers < 1:
+            raise ValueError("folds must be 2..20, factor >= 2 and workers >= 1")
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    halving = bool(body.get('halving', True))
+    promote = bool(body.get('promote', False))
+
+    job = search_jobs.submit(
+        'search', lambda j: _search_job(j, grid, n_folds, factor, halving, workers, promote),
+        params={"grid": grid, "folds": n_folds, "factor": factor, "halving": halving,
+                "workers": workers, "promote": promote})
+    if not _wants_wait(body):
+        return jsonify({"job": job.to_dict()}), 202
+    job.wait()
+    status = 200 if job.status == SUCCEEDED else 500
+    return jsonify({"job": job.to_dict()}), status
 
 
 @app.route('/config/path', methods=['POST'])
 def api_set_path():
-    """Update CSV path and retrain.
+    """Update CSV path and retrain in the background.
 
     JSON body example: {"path": "C:/data/kepler.csv"}
     """
@@ -370,10 +1822,7 @@ def api_set_path():
     with config_lock:
         cfg['path'] = body['path']
 
-    ok = train_model()
-    if not ok:
-        return jsonify({"path": cfg['path'], "train": False, "model_info": model_info}), 500
-    return jsonify({"path": cfg['path'], "train": True, "model_info": model_info})
+    return _training_response({"path": body['path']}, _wants_wait(body), flag_key='train', error_status=500)
 
 
 @app.route('/upload_csv', methods=['POST'])
@@ -390,6 +1839,7 @@ def api_upload_csv():
     # 2) application/json with {"csv": "...csv content...", "filename": "kepler.csv", "retrain": true}
 
     retrain_flag = False
+    wait = False
     dest_path = None
 
     # JSON mode
@@ -401,6 +1851,7 @@ def api_upload_csv():
         filename = body.get('filename') or f"kepler_{int(threading.get_ident())}.csv"
         filename = secure_filename(filename)
         retrain_flag = bool(body.get('retrain', False))
+        wait = _wants_wait(body)
 
         # Normalize csv_content to a CSV string if it's not already a string
         try:
@@ -439,7 +1890,8 @@ def api_upload_csv():
             return jsonify({"error": "No selected file"}), 400
 
         form_path = request.form.get('path')
-        retrain_flag = str(request.form.get('retrain', '')).lower() in ('1', 'true', 'yes')
+        retrain_flag = _is_truthy(request.form.get('retrain', ''))
+        wait = _wants_wait(request.form)
 
         with config_lock:
             dest = form_path or cfg.get('path')
@@ -464,9 +1916,7 @@ def api_upload_csv():
 
     response = {"saved": dest_path}
     if retrain_flag:
-        ok = train_model()
-        response['retrain'] = ok
-        response['model_info'] = model_info
+        return _training_response(response, wait)
 
     return jsonify(response)
 
@@ -510,18 +1960,176 @@ def api_upload_raw():
 
     response = {"saved": dest_path}
     retrain_q = request.args.get('retrain')
-    retrain_flag = str(retrain_q).lower() in ('1', 'true', 'yes') if retrain_q is not None else False
+    retrain_flag = _is_truthy(retrain_q) if retrain_q is not None else False
     if retrain_flag:
-        ok = train_model()
-        response['retrain'] = ok
-        response['model_info'] = model_info
+        return _training_response(response, _wants_wait())
 
     return jsonify(response)
 
 
+def _upload_error(e):
+    return jsonify(dict(e.details, error=str(e))), e.status
+
+
+@app.route('/uploads', methods=['POST'])
+def api_create_upload():
+    """Start a resumable upload (see uploads.py).
+
+    JSON body: {"filename": "kepler.csv", "size": <total bytes, optional>, "sha256": "<hex, optional>"}
+    Returns 201 with the session: {"id", "offset", ...}.
+    """
+    body = request.get_json(silent=True) or {}
+    filename = secure_filename(str(body.get('filename') or ''))
+    if not filename:
+        return jsonify({"error": "Missing 'filename'"}), 400
+    if not filename.lower().endswith('.csv'):
+        filename += '.csv'
+    try:
+        size = None if body.get('size') is None else int(body['size'])
+    except (TypeError, ValueError):
+        return jsonify({"error": "size must be an integer"}), 400
+    try:
+        session = upload_store.create(filename, size, body.get('sha256'))
+    except UploadError as e:
+        return _upload_error(e)
+    return jsonify(session), 201
+
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def api_upload_status(upload_id):
+    """Session status; `offset` is where the next chunk must start."""
+    try:
+        return jsonify(upload_store.status(upload_id))
+    except UploadError as e:
+        return _upload_error(e)
+
+
+@app.route('/uploads/<upload_id>', methods=['PUT', 'PATCH'])
+def api_upload_chunk(upload_id):
+    """Append the raw request body at `Upload-Offset` (header) or `?offset=`.
+
+    Send the chunk's sha256 in `X-Chunk-Sha256` to have it verified. A chunk at the
+    wrong offset gets 409 with the current `offset`; a refused chunk is discarded.
+    """
+    raw = request.headers.get('Upload-Offset', request.args.get('offset'))
+    try:
+        offset = int(raw)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Missing or invalid offset (Upload-Offset header or ?offset=)"}), 400
+    try:
+        session = upload_store.write_chunk(upload_id, offset, request.stream, request.headers.get('X-Chunk-Sha256'))
+    except UploadError as e:
+        # Errors a client can resume from carry the offset; the others end the upload
+        if e.status == 422 and 'offset' not in e.details:
+            UPLOADS.inc(outcome='rejected')
+        return _upload_error(e)
+    UPLOAD_BYTES.inc(session['received'])
+    response = jsonify(session)
+    response.headers['Upload-Offset'] = str(session['offset'])
+    return response
+
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def api_abort_upload(upload_id):
+    try:
+        upload_store.abort(upload_id)
+    except UploadError as e:
+        return _upload_error(e)
+    return jsonify({"aborted": upload_id})
+
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def api_finalize_upload(upload_id):
+    """Complete an upload into upload_dir and select it as the dataset.
+
+    JSON body (all optional): {"sha256": "<hex>", "select": true, "retrain": false, "wait": false}
+    An upload identical to a CSV already in upload_dir is dropped and that file is used.
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        result = upload_store.finalize(upload_id, cfg['upload_dir'], body.get('sha256'))
+    except UploadError as e:
+        if e.status == 422:
+            UPLOADS.inc(outcome='rejected')
+        return _upload_error(e)
+    UPLOADS.inc(outcome='deduplicated' if result['deduplicated'] else 'saved')
+
+    response = dict(result, saved=result['path'])
+    if body.get('select', True):
+        with config_lock:
+            cfg['path'] = result['path']
+        if bool(body.get('retrain', False)):
+            return _training_response(response, _wants_wait(body))
+    return jsonify(response)
+
+
+# Serializes appends so each one knows the dataset hash before and after it
+append_lock = threading.Lock()
+
+
+@app.route('/append_csv', methods=['POST'])
+def api_append_csv():
+    """Append KOI rows to the current dataset CSV and update the model with them.
+
+    Body: CSV text with a header line (raw, e.g. --data-binary @new.csv) or JSON {"csv": "..."}.
+    Options (query params or JSON keys):
+      - mode: "incremental" (default) grows the current forest with trees fitted on the
+        new rows; "full" refits from the whole CSV. Incremental falls back to a full
+        refit when it cannot be applied.
+      - estimators: trees to add (default cfg['append_estimators']).
+      - wait: block until the update finishes.
+    """
+    if request.is_json:
+        body = request.get_json(force=True) or {}
+        text = body.get('csv')
+    else:
+        body = {}
+        text = request.get_data(as_text=True)
+    if not text or not str(text).strip():
+        return jsonify({"error": "Provide CSV text in the body or as {\"csv\": ...}"}), 400
+
+    mode = str(request.args.get('mode') or body.get('mode') or 'incremental').lower()
+    if mode not in ('incremental', 'full'):
+        return jsonify({"error": "mode must be 'incremental' or 'full'"}), 400
+    with config_lock:
+        path = cfg['path']
+        use_cache = bool(cfg.get('dataset_cache', True))
+        estimators = request.args.get('estimators') or body.get('estimators') or cfg['append_estimators']
+    try:
+        estimators = int(estimators)
+        if estimators < 1:
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({"error": "estimators must be a positive integer"}), 400
+    if not os.path.exists(path):
+        return jsonify({"error": f"CSV file not found at path: {path}"}), 400
+
+    with append_lock:
+        try:
+            base_key = artifacts.file_digest(path)
+            rows = ingest.append_csv_rows(path, text, dispositions=KEEP_DISPOSITIONS, use_cache=use_cache)
+            dataset_key = artifacts.file_digest(path)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+        response = {"path": path, "appended": len(rows), "mode": mode}
+        if mode == 'full':
+            job = submit_training()
+        else:
+            job = training_jobs.submit(
+                'append', lambda j: _append_job(j, rows, base_key, dataset_key, estimators, mode),
+                params={"rows": len(rows), "estimators": estimators})
+    return _training_response(response, _wants_wait(body), flag_key='train', error_status=500, job=job)
+
+
 @app.route('/model_info', methods=['GET'])
 def api_model_info():
-    return jsonify(model_info)
+    info, error = request_model_info()
+    if error:
+        return error
+    return jsonify(info)
 
 
 @app.route('/model_precision', methods=['GET'])
@@ -530,6 +2138,9 @@ def api_model_precision():
 
     Returns per-class precision and aggregate metrics (macro/weighted) when available.
     """
+    model_info, error = request_model_info()
+    if error:
+        return error
     if not model_info:
         return jsonify({"error": "Model info not available. Train or upload dataset first."}), 400
 
@@ -568,9 +2179,231 @@ def api_model_precision():
     return jsonify(response)
 
 
+# Features listed by /attributions unless `top` says otherwise
+ATTRIBUTION_TOP_DEFAULT = 10
+
+
+@app.route('/feature_importance', methods=['GET'])
+def api_feature_importance():
+    """Global feature importances of the served model, most important first.
+
+    - impurity: mean decrease in impurity over the trees;
+    - permutation: held-out accuracy drop when the feature is shuffled (with its std);
+      missing for models fitted before it was computed and for appended versions;
+    - mean_abs_contribution: mean |path contribution| to the predicted class over all rows.
+    """
+    mv, error = request_version()
+    if error:
+        return error
+    if mv is None:
+        return jsonify({"error": "Data not loaded / model not trained"}), 400
+
+    importance = mv.model_info.get('feature_importance') or {}
+    response = {"version": mv.id}
+    if importance.get('impurity'):
+        response['impurity'] = attribution.ranked(importance['impurity'])
+    permutation = importance.get('permutation')
+    if permutation:
+        response['permutation'] = [dict(item, std=permutation['std'].get(item['feature']))
+                                   for item in attribution.ranked(permutation['mean'])]
+        response['permutation_baseline_accuracy'] = permutation.get('baseline_accuracy')
+        response['permutation_rows'] = permutation.get('rows')
+    else:
+        response['permutation'] = None
+    if importance.get('mean_abs_contribution'):
+        response['mean_abs_contribution'] = attribution.ranked(importance['mean_abs_contribution'])
+    return jsonify(response)
+
+
+@app.route('/attributions/<path:kepoi_name>', methods=['GET'])
+def api_attributions(kepoi_name):
+    """Features that drove the prediction for a planet, computed on first request and cached.
+
+    Query: `top` (default 10, 0 = all features) and `class` (explain this class's
+    probability instead of the predicted one). Contributions add up, with
+    `base_value` and `other`, to the class probability.
+    """
+    mv, error = request_version()
+    if error:
+        return error
+    if mv is None:
+        return jsonify({"error": "Data not loaded / model not trained"}), 400
+    if mv.attributions is None:
+        return jsonify({"error": "Feature attributions are not available for this model version"}), 503
+    try:
+        top = _int_arg('top', ATTRIBUTION_TOP_DEFAULT)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = mv.index.by_kepoi(kepoi_name)
+    if len(rows) == 0:
+        return jsonify({"error": f"No planet found with kepoi_name: {kepoi_name}"}), 404
+    i = rows[0]
+    prediction = mv.prediction_for(i)
+    if prediction is None:
+        return jsonify({"error": f"No prediction available for {kepoi_name}"}), 500
+
+    explained = request.args.get('class') or prediction['prediction']
+    if explained not in mv.classes:
+        return jsonify({"error": f"Unknown class '{explained}'. Choose from: {', '.join(mv.classes)}"}), 400
+    c = mv.classes.index(explained)
+
+    result = mv.attributions.top(i, c, top or None)
+    features = mv.df_processed.iloc[i]
+    for item in result['contributions']:
+        value = features[item['feature']]
+        item['value'] = None if pd.isna(value) else float(value)
+    kepid = mv.df_processed['kepid'].iloc[i]
+    return jsonify(dict(result, kepoi_name=mv.dataset.record(i).get('kepoi_name'),
+                        kepid=None if pd.isna(kepid) else int(kepid), version=mv.id, explained_class=explained,
+                        probability=prediction['probabilities'][explained], **prediction))
+
+
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "ok", "model_trained": model is not None})
+    mv = active_version
+    return jsonify({"status": "ok", "model_trained": mv is not None, "model_version": mv.id if mv else None,
+                    "worker": os.getpid()})
+
+
+# Every job queue whose jobs can be looked up through /jobs
+job_queues = [training_jobs, image_jobs, search_jobs]
+
+
+# --- metrics and profiling ---
+
+PROFILE_SORTS = ('cumulative', 'tottime', 'calls')
+
+
+def _version_memory():
+    mv = active_version
+    if mv is None:
+        return {}
+    return {(part,): size for part, size in mv.memory_usage().items()}
+
+
+def _active_jobs():
+    counts = {}
+    for q in job_queues:
+        for state in ('queued', 'running'):
+            counts[(q.name, state)] = 0
+        for job in q.list():
+            if (q.name, job.status) in counts:
+                counts[(q.name, job.status)] += 1
+    return counts
+
+
+metrics.REGISTRY.gauge('nasa_model_version', 'Id of the served model version (0 before the first fit).',
+                       callback=lambda: active_version.id if active_version is not None else 0)
+metrics.REGISTRY.gauge('nasa_model_rows', 'Rows of the served dataset.',
+                       callback=lambda: len(active_version.df_processed) if active_version is not None else 0)
+metrics.REGISTRY.gauge('nasa_model_memory_bytes', 'Approximate memory held by the served version, per component.',
+                       ('component',), callback=_version_memory)
+metrics.REGISTRY.gauge('nasa_cache_entries', 'Entries held by each in-memory cache.', ('cache',),
+                       callback=lambda: {('explanation',): len(explanation_cache), ('stats',): len(stats_cache)})
+metrics.REGISTRY.gauge('nasa_jobs', 'Unfinished background jobs per queue and state.', ('queue', 'state'),
+                       callback=_active_jobs)
+metrics.REGISTRY.gauge('nasa_registry_datasets', 'Uploaded datasets loaded next to the served one.',
+                       callback=lambda: len(dataset_registry))
+metrics.REGISTRY.gauge('nasa_registry_memory_bytes', 'Approximate memory held by the loaded datasets.',
+                       callback=dataset_registry.total_bytes)
+
+
+def _profile_requested():
+    return request.args.get('profile', '').lower() in ('1', 'true', 'yes')
+
+
+@app.before_request
+def _start_request():
+    g.request_started = time.perf_counter()
+    sync_published_version()
+    if _profile_requested() and cfg.get('profiling'):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Only one profiler can be active per process (Python 3.12+)
+            return jsonify({"error": "Another request is being profiled; try again"}), 409
+        g.profiler = profiler
+
+
+def _profile_response(profiler, response, elapsed):
+    """Replace `response` with the cProfile summary of the request."""
+    sort = request.args.get('profile_sort', 'cumulative')
+    if sort not in PROFILE_SORTS:
+        sort = 'cumulative'
+    try:
+        limit = max(1, int(request.args.get('profile_limit', 40)))
+    except ValueError:
+        limit = 40
+    out = io.StringIO()
+    out.write(f"{request.method} {request.full_path.rstrip('?')} -> {response.status_code} in {elapsed * 1e3:.1f} ms\n")
+    if response.is_streamed:
+        out.write("Note: the body is streamed, so producing it is not included below.\n")
+    out.write("\n")
+    pstats.Stats(profiler, stream=out).strip_dirs().sort_stats(sort).print_stats(limit)
+    profiled = Response(out.getvalue(), mimetype='text/plain')
+    profiled.headers['X-Profiled-Status'] = str(response.status_code)
+    return profiled
+
+
+@app.after_request
+def _finish_request(response):
+    started = g.pop('request_started', None)
+    elapsed = time.perf_counter() - started if started is not None else 0.0
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+    route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+    HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    HTTP_LATENCY.observe(elapsed, route=route, method=request.method)
+    if response.content_length is not None:
+        HTTP_RESPONSE_BYTES.observe(response.content_length, route=route)
+    if profiler is not None:
+        return _profile_response(profiler, response, elapsed)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def api_metrics():
+    """Prometheus text exposition of the server's metrics."""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def find_job(job_id):
+    for q in job_queues:
+        job = q.get(job_id)
+        if job is not None:
+            return q, job
+    return None, None
+
+
+@app.route('/jobs', methods=['GET'])
+def api_list_jobs():
+    """List known background jobs (newest first). Optional ?kind=train filter."""
+    kind = request.args.get('kind')
+    jobs = [j for q in job_queues for j in q.list() if kind is None or j.kind == kind]
+    jobs.sort(key=lambda j: j.created_at, reverse=True)
+    return jsonify({"jobs": [j.to_dict() for j in jobs]})
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def api_job_status(job_id):
+    """Return status/progress of a background job."""
+    _, job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Job not found: {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def api_cancel_job(job_id):
+    """Cancel a queued job, or ask a running one to stop at its next checkpoint."""
+    q, job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Job not found: {job_id}"}), 404
+    q.cancel(job_id)
+    return jsonify(job.to_dict())
 
 
 @app.route('/GeneralData', methods=['GET'])
@@ -590,12 +2423,50 @@ def api_general_data():
       - koi_depth (float or null)
       - koi_period (float or null)
     """
-    if df_processed is None:
+    mv, error = request_version()
+    if error:
+        return error
+    if mv is None:
         return jsonify({"error": "Data not loaded / model not trained"}), 400
 
-    # Use helper to convert each row to the GeneralData shape
-    out = [row_to_general_entry(row) for _, row in df_processed.iterrows()]
-    return jsonify(out)
+    # Serialized once per model version; supports gzip/br and ETag revalidation
+    return mv.general_payload.response()
+
+
+@app.route('/stats', methods=['GET'])
+def api_stats():
+    """Every dashboard chart with its default parameters, in one payload."""
+    mv, error = request_version()
+    if error:
+        return error
+    if mv is None:
+        return jsonify({"error": "Data not loaded / model not trained"}), 400
+    return mv.stats_payload.response()
+
+
+@app.route('/stats/<chart>', methods=['GET'])
+def api_stats_chart(chart):
+    """One dashboard chart, binned server-side.
+
+    Charts and query params:
+      - steff (step=250), slogg (step=0.2): linear histograms per koi_disposition
+      - depth (step=0.5), period (step=0.3): histograms over log10 of the value
+      - snr (edges=0.1,0.3,1,3,10,30,100): histogram over explicit edges
+      - duration (stat=media|mediana): koi_duration summary per disposition
+      - scatter (max_points=1000): downsampled koi_steff vs koi_srad points
+    """
+    mv, error = request_version()
+    if error:
+        return error
+    if mv is None:
+        return jsonify({"error": "Data not loaded / model not trained"}), 400
+    if chart not in stats.CHARTS:
+        return jsonify({"error": f"Unknown chart: {chart}", "charts": sorted(stats.CHARTS)}), 404
+    try:
+        params = stats.parse_params(chart, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return chart_payload(mv, chart, params).response()
 
 
 @app.route('/planet/kepoi/<path:kepoi_name>', methods=['GET'])
@@ -604,23 +2475,93 @@ def api_planet_by_kepoi(kepoi_name):
 
     Returns a list of matching full records from the processed dataframe.
     """
-    if df_processed is None:
+    mv, error = request_version()
+    if error:
+        return error
+    if mv is None:
         return jsonify({"error": "Data not loaded / model not trained"}), 400
 
-    key = str(kepoi_name).strip().upper()
-    # Compare case-insensitively, safely converting to str
+    rows = mv.index.by_kepoi(kepoi_name)
+    if len(rows) == 0:
+        return jsonify({"error": f"No planet found with kepoi_name: {kepoi_name}"}), 404
+
+    out = mv.dataset.records_at(rows)
+    return jsonify(out)
+
+
+# Neighbours returned by /planet/similar (default and maximum `k`)
+SIMILAR_DEFAULT = 10
+SIMILAR_MAX = 100
+
+
+@app.route('/planet/similar/<path:kepoi_name>', methods=['GET'])
+def api_planet_similar(kepoi_name):
+    """The `k` KOIs closest to a planet in the model's standardized feature space.
+
+    Each result has kepid / kepoi_name / kepler_name, the Euclidean `distance`, the
+    catalogue disposition and the model's prediction with its probabilities.
+    """
+    mv, error = request_version()
+    if error:
+        return error
+    if mv is None:
+        return jsonify({"error": "Data not loaded / model not trained"}), 400
     try:
-        mask = df_processed['kepoi_name'].astype(str).str.strip().str.upper() == key
-        matches = df_processed[mask]
-    except Exception:
-        # Fallback to exact match
-        matches = df_processed[df_processed['kepoi_name'] == kepoi_name]
+        k = _int_arg('k', SIMILAR_DEFAULT, minimum=1)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    k = min(k, SIMILAR_MAX)
 
-    if matches.empty:
+    rows = mv.index.by_kepoi(kepoi_name)
+    if len(rows) == 0:
         return jsonify({"error": f"No planet found with kepoi_name: {kepoi_name}"}), 404
+    i = int(rows[0])
 
-    out = [row_to_general_entry(row) for _, row in matches.iterrows()]
-    return jsonify(out)
+    index = mv.similarity_index
+    distances, neighbours = index.neighbors(i, k)
+    results = []
+    for dist, j in zip(distances, neighbours):
+        entry = mv.dataset.record(j)
+        item = {
+            "kepid": entry.get('kepid'),
+            "kepoi_name": entry.get('kepoi_name'),
+            "kepler_name": entry.get('kepler_name'),
+            "distance": round(float(dist), 6),
+            "koi_disposition": entry.get('koi_disposition'),
+        }
+        prediction = mv.prediction_for(j)
+        if prediction is not None:
+            item.update(prediction)
+        results.append(item)
+    entry = mv.dataset.record(i)
+    return jsonify({"kepoi_name": entry.get('kepoi_name'), "kepid": entry.get('kepid'), "k": k,
+                    "metric": "euclidean", "index": index.kind, "version": mv.id, "results": results})
+
+
+@app.route('/planet/search', methods=['GET'])
+def api_planet_search():
+    """Case-insensitive kepoi_name search.
+
+    Query params:
+      - q: exact kepoi_name, or a prefix ending in '*' (e.g. K00001.* for every KOI of a star)
+      - limit: optional max number of results (default 1000)
+    """
+    mv, error = request_version()
+    if error:
+        return error
+    if mv is None:
+        return jsonify({"error": "Data not loaded / model not trained"}), 400
+
+    q = request.args.get('q', '').strip()
+    if not q or q == '*':
+        return jsonify({"error": "Provide a non-empty 'q' query parameter"}), 400
+    try:
+        limit = int(request.args.get('limit', 1000))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    rows = mv.index.search(q, limit=max(0, limit))
+    return jsonify(mv.dataset.records_at(rows))
 
 
 @app.route('/csvs', methods=['GET'])
@@ -638,6 +2579,7 @@ def api_select_csv():
     """Select a CSV filename (from upload_dir) as the current dataset and retrain.
 
     JSON body: {"filename": "kepler.csv", "retrain": true}
+    Without retrain, a saved model artifact for this CSV and config is loaded if one exists.
     """
     body = request.get_json(force=True)
     if 'filename' not in body:
@@ -654,9 +2596,13 @@ def api_select_csv():
     retrain_flag = bool(body.get('retrain', False))
     response = {"selected": src}
     if retrain_flag:
-        ok = train_model()
-        response['retrain'] = ok
-        response['model_info'] = model_info
+        return _training_response(response, _wants_wait(body))
+
+    # A model already trained on this CSV with the current hyperparameters is cheap to load
+    key = find_artifact_key()
+    if key is not None:
+        response['artifact'] = key
+        return _training_response(response, _wants_wait(body))
 
     return jsonify(response)
 
@@ -678,76 +2624,146 @@ def api_select_csv_by_name(filename):
 
     # determine retrain flag: prefer query param, else JSON body
     retrain_flag = False
+    body = request.get_json(silent=True) if request.is_json else None
     q = request.args.get('retrain')
     if q is not None:
-        retrain_flag = str(q).lower() in ('1', 'true', 'yes')
-    else:
-        if request.is_json:
-            retrain_flag = bool(request.get_json().get('retrain', False))
+        retrain_flag = _is_truthy(q)
+    elif body:
+        retrain_flag = bool(body.get('retrain', False))
 
     response = {"selected": src}
     if retrain_flag:
-        ok = train_model()
-        response['retrain'] = ok
-        response['model_info'] = model_info
+        return _training_response(response, _wants_wait(body))
+
+    # A model already trained on this CSV with the current hyperparameters is cheap to load
+    key = find_artifact_key()
+    if key is not None:
+        response['artifact'] = key
+        return _training_response(response, _wants_wait(body))
 
     return jsonify(response)
 
 
+@app.route('/datasets', methods=['GET'])
+def api_list_datasets():
+    """Uploaded CSVs and whether each is loaded in the registry (or is the served dataset)."""
+    upload_dir = cfg.get('upload_dir')
+    try:
+        files = sorted(f for f in os.listdir(upload_dir)
+                       if os.path.isfile(os.path.join(upload_dir, f)) and f.lower().endswith('.csv'))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    loaded = {e['dataset']: e for e in dataset_registry.list()}
+    datasets = []
+    for f in files:
+        entry = {"dataset": f, "active": _is_active_path(os.path.join(upload_dir, f))}
+        if f in loaded:
+            entry.update(loaded[f], loaded=True)
+        else:
+            entry['loaded'] = entry['active']
+        datasets.append(entry)
+    return jsonify({
+        "datasets": datasets,
+        "registry": {"entries": len(dataset_registry), "bytes": dataset_registry.total_bytes(),
+                     "budget_bytes": dataset_registry.budget_bytes, "max_datasets": dataset_registry.max_entries,
+                     "evictions": dataset_registry.evictions},
+    })
+
+
+@app.route('/datasets/<path:dataset_id>/load', methods=['POST'])
+def api_load_dataset(dataset_id):
+    """Load an uploaded CSV into the registry (fitting it, or loading its saved artifact).
+
+    Reloading refits with the current hyperparameters. Returns 202 with the job, or
+    blocks until it finishes with ?wait=1 / {"wait": true}.
+    """
+    path = _dataset_path(dataset_id)
+    if path is None:
+        return jsonify({"error": f"Unknown dataset: {dataset_id}"}), 404
+    dataset_id = os.path.basename(path)
+    job = submit_dataset_load(dataset_id, path)
+    body = request.get_json(silent=True) if request.is_json else None
+    if not _wants_wait(body):
+        return jsonify({"dataset": dataset_id, "job": job.to_dict()}), 202
+    job.wait()
+    if job.status != SUCCEEDED:
+        return jsonify({"error": job.error or job.status, "job": job.to_dict()}), 500
+    return jsonify(dict(job.result, job=job.to_dict()))
+
+
+@app.route('/datasets/<path:dataset_id>', methods=['DELETE'])
+def api_unload_dataset(dataset_id):
+    """Drop a dataset's version from the registry (the CSV itself is kept)."""
+    name = secure_filename(dataset_id)
+    if not dataset_registry.remove(name):
+        return jsonify({"error": f"Dataset not loaded: {dataset_id}"}), 404
+    return jsonify({"unloaded": name})
+
+
 @app.route('/Gemini/ExplainGeneral', methods=['GET'])
 def api_gemini_explain_general():
     """Ask Gemini to explain the overall model_info in Spanish with three sections."""
+    model_info, error = request_model_info()
+    if error:
+        return error
     if not model_info:
         return jsonify({"error": "Model info not available. Train or upload dataset first."}), 400
 
     prompt = build_general_prompt(model_info)
-    text, err = call_genai_and_get_text(prompt)
+    text, err, cached = explain(prompt)
     if err:
         print("GenAI Api Key:", os.getenv('GEMINI_API_KEY'))
         return jsonify({"error": err}), 500
-    return jsonify({"explanation": text})
+    return jsonify({"explanation": text, "cached": cached})
 
 
 @app.route('/Gemini/ExplainSpecific/<path:kepoi_name>', methods=['GET'])
 def api_gemini_explain_specific(kepoi_name):
     """Ask Gemini to explain a specific planet (by kepoi_name) in Spanish with three sections."""
-    if df_processed is None:
+    mv, error = request_version()
+    if error:
+        return error
+    if mv is None:
         return jsonify({"error": "Data not loaded / model not trained"}), 400
 
-    key = str(kepoi_name).strip().upper()
-    try:
-        mask = df_processed['kepoi_name'].astype(str).str.strip().str.upper() == key
-        matches = df_processed[mask]
-    except Exception:
-        matches = df_processed[df_processed['kepoi_name'] == kepoi_name]
-
-    if matches.empty:
+    rows = mv.index.by_kepoi(kepoi_name)
+    if len(rows) == 0:
         return jsonify({"error": f"No planet found with kepoi_name: {kepoi_name}"}), 404
 
     # Use the first match for the specific explanation
-    first = matches.iloc[0]
-    entry = row_to_general_entry(first)
+    entry = mv.dataset.record(rows[0])
 
-    # Optionally include model prediction if available: try to predict using model
-    prediction = None
-    if model is not None and scaler is not None and X_columns is not None:
-        try:
-            features = first[X_columns]
-            feat_scaled = scaler.transform([features])[0].reshape(1, -1)
-            pred = model.predict(feat_scaled)[0]
-            probs = model.predict_proba(feat_scaled)[0]
-            classes = model.classes_
-            prob_map = {str(classes[j]): float(probs[j]) for j in range(len(classes))}
-            prediction = {"prediction": str(pred), "probabilities": prob_map}
-        except Exception:
-            prediction = None
+    # Include the model prediction (precomputed for every row) and what drove it, when available
+    prediction = mv.prediction_for(rows[0])
+    drivers = None
+    if prediction is not None and mv.attributions is not None:
+        drivers = mv.attributions.top(rows[0], mv.classes.index(prediction['prediction']), 5)
 
-    prompt = build_specific_prompt(entry, prediction)
-    text, err = call_genai_and_get_text(prompt)
+    prompt = build_specific_prompt(entry, prediction, drivers)
+    text, err, cached = explain(prompt)
     if err:
         print("GenAI Api Key:", os.getenv('GEMINI_API_KEY'))
         return jsonify({"error": err}), 500
-    return jsonify({"explanation": text})
+    return jsonify({"explanation": text, "cached": cached})
+
+
+def _image_job(job):
+    """Job body for /GeneratePlanetImage: call the image API and save exoplanets/<name>.png."""
+    with config_lock:
+        api_url = cfg['image_api_url']
+        workers = int(cfg['image_workers'])
+    job.update(phase='generating', progress=0.0)
+    res = generate_image(job.params['prompt'], api_url=api_url, save=False,
+                         session=get_session(workers), check_cancelled=job.check_cancelled)
+    if not res.get('ok'):
+        details = res.get('details')
+        msg = res.get('error') or 'Image generation failed'
+        if details:
+            msg = f"{msg}: {json.dumps(details, default=str)[:500]}"
+        raise RuntimeError(msg)
+    job.update(phase='store', progress=0.9)
+    entry = image_store.put(job.params['name'], res['content'])
+    return {"path": image_store.path(entry['file']), "digest": entry['digest'], "url": f"/images/{entry['file']}"}
 
 
 @app.route('/GeneratePlanetImage', methods=['POST'])
@@ -760,8 +2776,14 @@ def api_generate_planet_image():
       - {"kepoi_name": "K00001.01"}
 
     Optional: {"prompt_extra": "..."} to append creative instructions.
+
+    Returns 202 with the queued job (poll /jobs/<id>); add {"wait": true} (or ?wait=1)
+    to block and get {"path": ...} like before.
     """
-    if df_processed is None:
+    mv, error = request_version()
+    if error:
+        return error
+    if mv is None:
         return jsonify({"error": "Data not loaded / model not trained"}), 400
 
     body = request.get_json(force=True)
@@ -769,28 +2791,21 @@ def api_generate_planet_image():
     kepoi_name = body.get('kepoi_name')
 
     # Find the planet row
-    matches = None
     if kepid is not None:
         try:
             kepid = int(kepid)
         except Exception:
             return jsonify({"error": "Invalid kepid"}), 400
-        matches = df_processed[df_processed['kepid'] == kepid]
+        rows = mv.index.by_kepid(kepid)
     elif kepoi_name:
-        key = str(kepoi_name).strip().upper()
-        try:
-            mask = df_processed['kepoi_name'].astype(str).str.strip().str.upper() == key
-            matches = df_processed[mask]
-        except Exception:
-            matches = df_processed[df_processed['kepoi_name'] == kepoi_name]
+        rows = mv.index.by_kepoi(kepoi_name)
     else:
         return jsonify({"error": "Provide 'kepid' or 'kepoi_name' in body"}), 400
 
-    if matches is None or matches.empty:
+    if len(rows) == 0:
         return jsonify({"error": "No matching planet found"}), 404
 
-    row = matches.iloc[0]
-    entry = row_to_general_entry(row)
+    entry = mv.dataset.record(rows[0])
 
     # Build a descriptive prompt from available fields
     parts = []
@@ -834,50 +2849,82 @@ def api_generate_planet_image():
     else:
         save_name = f"planet_{int(time.time())}"
 
-    # Call the image generator
-    gen_res = generate_image(prompt, exoplanet_name=save_name)
-    if not gen_res.get('ok'):
-        return jsonify({"error": gen_res.get('error'), "details": gen_res.get('details', None)}), 500
+    # Generate in the background; requests for the same planet share one job
+    job = image_jobs.submit('image', _image_job, key=f"image:{normalize_kepoi(save_name)}",
+                            params={"name": save_name, "prompt": prompt}, join_running=True)
+    if not _wants_wait(body):
+        return jsonify({"job": job.to_dict()}), 202
 
-    return jsonify({"path": gen_res.get('path')})
+    job.wait()
+    if job.status != SUCCEEDED:
+        return jsonify({"error": job.error or job.status, "job": job.to_dict()}), 500
+    return jsonify({"path": job.result['path'], "job": job.to_dict()})
+
+
+def _send_image(fname, cache_control):
+    """Serve a stored image with a strong ETag (its content hash) and Range support."""
+    resp = send_file(image_store.path(fname), mimetype=mimetype_for(fname), conditional=True,
+                     etag=fname.rsplit('.', 1)[0])
+    resp.headers['Cache-Control'] = cache_control
+    return resp
 
 
 @app.route('/ExoplanetImage/<path:kepoi_name>', methods=['GET'])
 def api_get_exoplanet_image(kepoi_name):
-    """Serve the generated image for a given kepoi_name from the ./exoplanets folder.
+    """Serve the generated image for a given kepoi_name from the image store.
+
+    Optional ?variant=original (default), webp or thumb (downscaled, for list views).
+    The image may be regenerated, so clients revalidate with If-None-Match.
 
     Example: GET /ExoplanetImage/K00001.01
     """
-    exo_dir = os.path.join(os.getcwd(), 'exoplanets')
-    if not os.path.isdir(exo_dir):
-        return jsonify({"error": "No exoplanets directory found"}), 404
-
-    safe = secure_filename(kepoi_name)
-    # Try common extensions, prefer .png
-    candidates = [f"{safe}.png", f"{safe}.jpg", f"{safe}.jpeg", safe]
-    for fname in candidates:
-        fpath = os.path.join(exo_dir, fname)
-        if os.path.exists(fpath) and os.path.isfile(fpath):
-            # send_from_directory will set correct headers
-            return send_from_directory(exo_dir, fname)
-
-    # Also attempt case-insensitive or prefix match as a fallback
-    for entry in os.listdir(exo_dir):
-        if entry.lower().startswith(safe.lower()):
-            return send_from_directory(exo_dir, entry)
-
-    return jsonify({"error": f"Image not found for {kepoi_name}"}), 404
+    variant = request.args.get('variant', 'original')
+    try:
+        fname = image_store.variant_file(kepoi_name, variant)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if fname is None:
+        return jsonify({"error": f"Image not found for {kepoi_name}"}), 404
+    return _send_image(fname, 'no-cache')
+
+
+@app.route('/images/<fname>', methods=['GET'])
+def api_get_image_file(fname):
+    """Serve a stored image by content-hashed file name. The content never changes, so it is cacheable forever."""
+    if not is_stored_file(fname) or not os.path.isfile(image_store.path(fname)):
+        return jsonify({"error": "Image not found"}), 404
+    return _send_image(fname, 'public, max-age=31536000, immutable')
+
+
+@app.route('/images', methods=['GET'])
+def api_list_images():
+    """Manifest of stored planet images: name, digest and URLs of the original and thumbnail."""
+    images = []
+    for name in image_store.names():
+        entry = image_store.get(name)
+        if entry is None:
+            continue
+        images.append({
+            "name": entry['name'],
+            "digest": entry['digest'],
+            "url": f"/images/{entry['file']}",
+            "thumb": f"/ExoplanetImage/{entry['name']}?variant=thumb",
+            "updated_at": entry['updated_at'],
+        })
+    return jsonify({"count": len(images), "images": images})
 
 
 if __name__ == '__main__':
-    # Train model at startup (best effort)
-    trained = train_model()
+    # Train model at startup (best effort), or load the version published by other workers
+    trained = startup()
     if trained:
         print("Model trained on startup.")
     else:
         print("Model training failed on startup:", model_info)
 
-    if genai_client:
+    if genai_generate is not call_genai_and_get_text:
+        print("Using the offline GenAI stub (GENAI_BACKEND=stub).")
+    elif genai_client:
         print("GenAI client initialized.")
     else:
         print("GenAI client not available. Set GEMINI_API_KEY and install google-genai SDK to enable.")
@@ -0,0 +1,78 @@
+"""Pre-serialized JSON responses with compression variants and ETags.
+
+Endpoints whose output only changes when a new model version is installed build a
+`CachedPayload` once and serve its bytes directly: no per-request serialization,
+gzip/brotli variants picked from `Accept-Encoding`, and `If-None-Match`
+revalidation answered with 304.
+"""
+
+import gzip
+import hashlib
+import json
+
+from flask import Response, request
+
+# --- optional brotli support ---
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def dumps(obj) -> bytes:
+    """Serialize like Flask's jsonify (sorted keys, compact, ASCII-safe)."""
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+
+
+class CachedPayload:
+    """A JSON body serialized once, plus its compressed variants and a strong ETag."""
+
+    def __init__(self, body: bytes, mimetype: str = 'application/json'):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {'identity': body}
+        # Tiny bodies are not worth compressing
+        if len(body) >= 1024:
+            self.variants['gzip'] = gzip.compress(body, compresslevel=6, mtime=0)
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(body, quality=5)
+
+    @classmethod
+    def from_obj(cls, obj):
+        return cls(dumps(obj))
+
+    def extended(self, items) -> 'CachedPayload':
+        """Payload for this body (a JSON array) with `items` appended, without re-serializing it."""
+        if not items:
+            return self
+        tail = dumps(list(items))
+        if self.body == b'[]':
+            return CachedPayload(tail, self.mimetype)
+        return CachedPayload(self.body[:-1] + b',' + tail[1:], self.mimetype)
+
+    def __len__(self):
+        return len(self.body)
+
+    def etag_for(self, encoding: str) -> str:
+        # Each encoded representation gets its own strong validator
+        return self.etag if encoding == 'identity' else f"{self.etag}-{encoding}"
+
+    def response(self, cache_control: str = 'no-cache') -> Response:
+        """Build the Flask response for the current request (304 when the client's copy is current)."""
+        encoding = 'identity'
+        for enc in ('br', 'gzip'):
+            if enc in self.variants and request.accept_encodings[enc]:
+                encoding = enc
+                break
+
+        if any(request.if_none_match.contains(self.etag_for(enc)) for enc in self.variants):
+            resp = Response(status=304)
+        else:
+            resp = Response(self.variants[encoding], mimetype=self.mimetype)
+            if encoding != 'identity':
+                resp.headers['Content-Encoding'] = encoding
+        resp.set_etag(self.etag_for(encoding))
+        resp.headers['Cache-Control'] = cache_control
+        resp.vary.add('Accept-Encoding')
+        return resp
@@ -0,0 +1,206 @@
+"""Filtered, sorted, keyset-paginated queries over a processed Kepler dataframe.
+
+A `QueryIndex` is built once per model version (on its first query) and holds:
+
+- for each sortable / range-filterable column, the row permutation that sorts it
+  (ties and the cursor broken by kepoi_name) and the sorted values, so a range
+  filter is two binary searches and the rows between them;
+- boolean masks for every disposition and every predicted class.
+
+A query ANDs the masks of its filters and walks the permutation of its sort key
+from the cursor position, keeping rows whose mask bit is set, until the page is
+full. Nothing is copied from the dataframe per request.
+
+Cursors are keyset cursors: the sort value and kepoi_name of the last row
+returned. They stay valid across model versions, so paging through a dataset
+that was appended to or retrained continues where it left off.
+"""
+
+import base64
+import json
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+RANGE_COLUMNS = ('koi_period', 'koi_depth', 'koi_steff', 'koi_srad', 'koi_slogg', 'koi_model_snr')
+SORT_KEYS = ('kepoi_name', 'kepid') + RANGE_COLUMNS
+DEFAULT_SORT = 'kepoi_name'
+
+
+class QueryError(ValueError):
+    """Invalid query parameters (reported to the client as 400)."""
+
+
+class _SortedColumn:
+    """Rows ordered by (value, kepoi_name); rows without a value come last, by name."""
+
+    def __init__(self, values: np.ndarray, name_rank: np.ndarray):
+        self.row_values = values
+        valid = np.flatnonzero(~np.isnan(values))
+        self.valid = valid[np.lexsort((name_rank[valid], values[valid]))].astype(name_rank.dtype)
+        missing = np.flatnonzero(np.isnan(values))
+        self.missing = missing[np.argsort(name_rank[missing], kind='stable')].astype(name_rank.dtype)
+        self.values = values[self.valid]
+        self.valid_ranks = name_rank[self.valid]
+        self.missing_ranks = name_rank[self.missing]
+
+    def between(self, lo: Optional[float], hi: Optional[float]) -> np.ndarray:
+        """Rows with lo <= value <= hi (either bound may be None)."""
+        a = 0 if lo is None else int(np.searchsorted(self.values, lo, 'left'))
+        b = len(self.values) if hi is None else int(np.searchsorted(self.values, hi, 'right'))
+        return self.valid[a:max(a, b)]
+
+    def segments(self, descending: bool) -> List[np.ndarray]:
+        return [self.valid[::-1] if descending else self.valid, self.missing]
+
+    def position(self, value: Optional[float], rank_le: int, rank_lt: int, descending: bool) -> int:
+        """Number of rows that come before or at the cursor in the walk order.
+
+        `rank_le` / `rank_lt`: name ranks below which a name sorts <= / < the cursor's name.
+        """
+        n_valid = len(self.values)
+        if value is None:
+            return n_valid + int(np.searchsorted(self.missing_ranks, rank_le, 'left'))
+        lo = int(np.searchsorted(self.values, value, 'left'))
+        hi = int(np.searchsorted(self.values, value, 'right'))
+        run = self.valid_ranks[lo:hi]
+        if descending:
+            # Rows after the cursor in ascending order come first when descending
+            return n_valid - lo - int(np.searchsorted(run, rank_lt, 'left'))
+        return lo + int(np.searchsorted(run, rank_le, 'left'))
+
+
+class QueryIndex:
+    """Sorted column permutations and category masks for one dataframe."""
+
+    def __init__(self, df: pd.DataFrame, pred_class: np.ndarray, classes: Sequence[str]):
+        self.n_rows = len(df)
+        if 'kepoi_name' in df:
+            names = df['kepoi_name'].astype(object).where(df['kepoi_name'].notna(), '')
+            names = np.array([str(n).strip().upper() for n in names], dtype=object)
+        else:
+            names = np.full(self.n_rows, '', dtype=object)
+        self.names = names
+        # Row positions and ranks are int32 unless the frame is too large for it
+        pos_dtype = np.int32 if self.n_rows < np.iinfo(np.int32).max else np.int64
+        self.name_order = np.argsort(names, kind='stable').astype(pos_dtype)
+        self.sorted_names = names[self.name_order]
+        self.name_rank = np.empty(self.n_rows, dtype=pos_dtype)
+        self.name_rank[self.name_order] = np.arange(self.n_rows, dtype=pos_dtype)
+
+        self.columns: Dict[str, _SortedColumn] = {}
+        for col in SORT_KEYS[1:]:
+            if col in df:
+                values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+            else:
+                values = np.full(self.n_rows, np.nan)
+            self.columns[col] = _SortedColumn(values, self.name_rank)
+
+        self.disposition_masks: Dict[str, np.ndarray] = {}
+        if 'koi_disposition' in df:
+            disp = df['koi_disposition'].astype(object).where(df['koi_disposition'].notna(), None).to_numpy()
+            for value in pd.unique(disp[pd.notna(disp)]):
+                self.disposition_masks[str(value).upper()] = disp == value
+        self.prediction_masks = {str(c).upper(): pred_class == i for i, c in enumerate(classes)}
+
+    # --- filters ---
+
+    def _category_mask(self, masks: Dict[str, np.ndarray], values: Iterable[str], what: str) -> np.ndarray:
+        mask = np.zeros(self.n_rows, dtype=bool)
+        for v in values:
+            key = str(v).strip().upper()
+            if key not in masks:
+                raise QueryError(f"Unknown {what} '{v}'. Known: {', '.join(sorted(masks))}")
+            mask |= masks[key]
+        return mask
+
+    def filter_mask(self, ranges: Dict[str, Tuple[Optional[float], Optional[float]]],
+                    dispositions: Sequence[str] = (), predictions: Sequence[str] = ()) -> Optional[np.ndarray]:
+        """Rows matching every filter, or None when there are no filters."""
+        mask = None
+        for col, (lo, hi) in ranges.items():
+            if col not in self.columns:
+                raise QueryError(f"Cannot filter on '{col}'")
+            m = np.zeros(self.n_rows, dtype=bool)
+            m[self.columns[col].between(lo, hi)] = True
+            mask = m if mask is None else mask & m
+        for masks, values, what in ((self.disposition_masks, dispositions, 'disposition'),
+                                    (self.prediction_masks, predictions, 'prediction')):
+            if values:
+                m = self._category_mask(masks, values, what)
+                mask = m if mask is None else mask & m
+        return mask
+
+    # --- sorting and paging ---
+
+    def _segments(self, sort: str, descending: bool) -> List[np.ndarray]:
+        if sort == 'kepoi_name':
+            return [self.name_order[::-1] if descending else self.name_order]
+        return self.columns[sort].segments(descending)
+
+    def _position(self, sort: str, descending: bool, cursor: dict) -> int:
+        name = str(cursor.get('n', '')).strip().upper()
+        rank_le = int(np.searchsorted(self.sorted_names, name, 'right'))
+        rank_lt = int(np.searchsorted(self.sorted_names, name, 'left'))
+        if sort == 'kepoi_name':
+            return self.n_rows - rank_lt if descending else rank_le
+        value = cursor.get('v')
+        return self.columns[sort].position(None if value is None else float(value), rank_le, rank_lt, descending)
+
+    def cursor_after(self, sort: str, descending: bool, row: int) -> str:
+        """Cursor for the page that follows `row`."""
+        value = None
+        if sort != 'kepoi_name':
+            v = self.columns[sort].row_values[row]
+            value = None if np.isnan(v) else float(v)
+        return encode_cursor(sort, descending, value, self.names[row])
+
+    def page(self, sort: str = DEFAULT_SORT, descending: bool = False, mask: Optional[np.ndarray] = None,
+             limit: int = 50, cursor: Optional[dict] = None) -> Tuple[np.ndarray, bool]:
+        """Row positions of one page and whether more rows follow."""
+        if sort not in SORT_KEYS:
+            raise QueryError(f"Cannot sort by '{sort}'. Use one of: {', '.join(SORT_KEYS)}")
+        skip = self._position(sort, descending, cursor) if cursor else 0
+        need = limit + 1
+        out = []
+        found = 0
+        for seg in self._segments(sort, descending):
+            if skip >= len(seg):
+                skip -= len(seg)
+                continue
+            start, skip = skip, 0
+            block = max(256, 4 * need)
+            while start < len(seg) and found < need:
+                rows = seg[start:start + block]
+                if mask is not None:
+                    rows = rows[mask[rows]]
+                rows = rows[:need - found]
+                out.append(rows)
+                found += len(rows)
+                start += block
+                block *= 2
+            if found >= need:
+                break
+        rows = np.concatenate(out) if out else np.empty(0, dtype=np.int64)
+        return rows[:limit], len(rows) > limit
+
+    def count(self, mask: Optional[np.ndarray]) -> int:
+        return self.n_rows if mask is None else int(np.count_nonzero(mask))
+
+
+def encode_cursor(sort: str, descending: bool, value, name: str) -> str:
+    raw = json.dumps({'s': sort, 'd': bool(descending), 'v': value, 'n': name}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str, sort: str, descending: bool) -> dict:
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        cursor = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise QueryError("Invalid cursor")
+    if not isinstance(cursor, dict) or cursor.get('s') != sort or bool(cursor.get('d')) != bool(descending):
+        raise QueryError("Cursor belongs to a different sort order")
+    return cursor
@@ -0,0 +1,99 @@
+"""Registry of model versions for several datasets served side by side.
+
+The server's default dataset (`cfg['path']`) is served by `active_version`.
+Other uploaded CSVs can be loaded next to it: each gets its own ModelVersion,
+with its own indexes, prediction table and cached payloads, and requests pick
+one with a dataset id.
+
+`ModelRegistry` keeps those versions in least-recently-used order and evicts the
+oldest when the approximate memory they hold exceeds `budget_bytes` (or there
+are more than `max_entries`). An evicted dataset is loaded again on its next
+use, which is cheap when its model artifact is on disk.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+
+class ModelRegistry:
+    """dataset id -> ModelVersion, LRU-evicted under a memory budget."""
+
+    def __init__(self, budget_bytes: Optional[int], max_entries: Optional[int],
+                 size_of: Callable[[Any], int]):
+        self.budget_bytes = budget_bytes
+        self.max_entries = max_entries
+        self.size_of = size_of
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # dataset id -> {"version", "stamp", "bytes", "loaded_at", "last_used", "hits"}
+        self._entries: 'OrderedDict[str, dict]' = OrderedDict()
+
+    def get(self, dataset_id: str, stamp: Any = None):
+        """The version serving `dataset_id`, or None if it is not loaded.
+
+        An entry put with a different `stamp` (e.g. the source file's mtime) is stale:
+        it is dropped and None is returned.
+        """
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is None:
+                return None
+            if entry['stamp'] != stamp:
+                del self._entries[dataset_id]
+                return None
+            self._entries.move_to_end(dataset_id)
+            entry['last_used'] = time.time()
+            entry['hits'] += 1
+            return entry['version']
+
+    def put(self, dataset_id: str, version, stamp: Any = None) -> List[str]:
+        """Serve `version` for `dataset_id` and return the ids evicted to make room.
+
+        The entry being put is never evicted, even if it alone exceeds the budget.
+        """
+        size = int(self.size_of(version))
+        now = time.time()
+        with self._lock:
+            self._entries[dataset_id] = {'version': version, 'stamp': stamp, 'bytes': size, 'loaded_at': now,
+                                         'last_used': now, 'hits': 0}
+            self._entries.move_to_end(dataset_id)
+            evicted = []
+            while len(self._entries) > 1 and self._over_budget():
+                old_id, _ = self._entries.popitem(last=False)
+                evicted.append(old_id)
+            self.evictions += len(evicted)
+        for old_id in evicted:
+            print(f"Evicted dataset '{old_id}' from the model registry")
+        return evicted
+
+    def _over_budget(self) -> bool:
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        return self.budget_bytes is not None and self.total_bytes() > self.budget_bytes
+
+    def remove(self, dataset_id: str) -> bool:
+        with self._lock:
+            return self._entries.pop(dataset_id, None) is not None
+
+    def total_bytes(self) -> int:
+        return sum(e['bytes'] for e in self._entries.values())
+
+    def list(self) -> List[dict]:
+        """Loaded datasets, most recently used first (without the version objects)."""
+        with self._lock:
+            items = list(self._entries.items())
+        out = []
+        for dataset_id, e in reversed(items):
+            mv = e['version']
+            out.append({"dataset": dataset_id, "version": mv.id, "bytes": e['bytes'],
+                        "loaded_at": e['loaded_at'], "last_used": e['last_used'], "hits": e['hits'],
+                        "rows": len(mv.df_processed), "accuracy": mv.model_info.get('accuracy')})
+        return out
+
+    def __contains__(self, dataset_id: str) -> bool:
+        return dataset_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,56 @@
+"""Nearest-neighbour search over the model's feature space ("similar planets").
+
+A `SimilarityIndex` is built once per model version (on its first query) from
+the standardized feature matrix: the `X_columns` of every row, with gaps filled
+by the training means and transformed by the version's scaler, i.e. the space
+the forest was trained in. Euclidean distances there weigh every feature by its
+spread in the training data.
+
+The rows go into a scikit-learn KD-tree, or a ball tree when there are many
+features (KD-trees degrade towards a full scan in high dimensions). A query
+visits a few leaves instead of computing the distance to every row, so it stays
+fast on datasets with 100k+ rows.
+"""
+
+from typing import Tuple
+
+import numpy as np
+from sklearn.neighbors import BallTree, KDTree
+
+
+# Up to this many features a KD-tree is used, beyond it a ball tree
+KD_TREE_MAX_FEATURES = 16
+LEAF_SIZE = 40
+
+
+class SimilarityIndex:
+    """Spatial tree over the scaled feature rows of a dataset."""
+
+    def __init__(self, X_scaled: np.ndarray):
+        X = np.ascontiguousarray(X_scaled, dtype=np.float64)
+        if X.ndim != 2:
+            raise ValueError(f"Expected a 2-D feature matrix, got shape {X.shape}")
+        self.n_rows, self.n_features = X.shape
+        self.kind = 'kd_tree' if self.n_features <= KD_TREE_MAX_FEATURES else 'ball_tree'
+        tree_cls = KDTree if self.kind == 'kd_tree' else BallTree
+        self.tree = tree_cls(X, leaf_size=LEAF_SIZE)
+
+    @property
+    def nbytes(self) -> int:
+        data, idx, nodes, bounds = self.tree.get_arrays()
+        return int(sum(np.asarray(a).nbytes for a in (data, idx, nodes, bounds)))
+
+    def neighbors(self, row: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The `k` rows closest to row position `row` (excluding it), nearest first.
+
+        Returns (distances, row positions).
+        """
+        k = min(int(k), self.n_rows - 1)
+        if k <= 0:
+            return np.empty(0), np.empty(0, dtype=np.intp)
+        point = np.asarray(self.tree.data[row]).reshape(1, -1)
+        # One extra neighbour: the row itself (or an identical row) comes back at distance 0
+        dist, idx = self.tree.query(point, k=k + 1)
+        dist, idx = dist[0], idx[0]
+        keep = idx != row
+        return dist[keep][:k], idx[keep][:k]
@@ -0,0 +1,194 @@
+"""Chart aggregations for the iOS dashboards, computed with NumPy.
+
+Each function mirrors the binning the Swift app (`HomeViewModel`) used to do on
+device over the whole GeneralData array, so the app can fetch a few KB of
+ready-to-plot rows instead:
+
+- `linear_bins`: fixed-width histogram (optionally over log10 of the value),
+  split by `koi_disposition` (SteffBin, SloggBin, DepthLogBin, PeriodLogBin);
+- `edge_bins`: histogram over explicit edges (ModelSNRBin);
+- `duration_summary`: mean or median per disposition (DurationByDisposition);
+- `scatter_sample`: deterministic downsample of a 2-D scatter (SteffVsSradPoint).
+
+Bin labels use the app's formatting ("4000–4250", "0.2–0.4") and rows are sorted
+by (label, disposition) like the app sorted them.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_SNR_EDGES = (0.1, 0.3, 1, 3, 10, 30, 100)
+
+
+def trim_number(x: float) -> str:
+    """Compact number formatting without trailing zeros ("%.4f" based, like the app)."""
+    s = f"{x:.4f}"
+    s = re.sub(r'(\.\d*?[1-9])0+$', r'\1', s)
+    return re.sub(r'\.0+$', '', s)
+
+
+def disposition_labels(values) -> np.ndarray:
+    """Trimmed disposition strings, "N/A" for missing or empty values."""
+    s = pd.Series(values, dtype=object)
+    out = s.where(s.notna(), '').astype(str).str.strip()
+    return out.where(out != '', 'N/A').to_numpy(dtype=object)
+
+
+def _grouped_counts(bin_idx: np.ndarray, disp: np.ndarray):
+    """Count rows per (bin index, disposition). Returns [(bin_idx, disposition, count)]."""
+    if len(bin_idx) == 0:
+        return []
+    disp_names, disp_codes = np.unique(disp.astype(str), return_inverse=True)
+    combined = (bin_idx.astype(np.int64) - bin_idx.min()) * len(disp_names) + disp_codes
+    keys, counts = np.unique(combined, return_counts=True)
+    bins = keys // len(disp_names) + bin_idx.min()
+    return [(int(b), str(disp_names[k % len(disp_names)]), int(c)) for b, k, c in zip(bins, keys, counts)]
+
+
+def linear_bins(values, dispositions, step: float, log: bool = False):
+    """Histogram with bins of width `step` (over log10(value) when `log`) per disposition."""
+    v = np.asarray(values, dtype=np.float64)
+    disp = disposition_labels(dispositions)
+    mask = np.isfinite(v)
+    if log:
+        mask &= v > 0
+    v = v[mask]
+    if log:
+        v = np.log10(v)
+    idx = np.floor(v / step).astype(np.int64)
+    rows = []
+    for b, d, c in _grouped_counts(idx, disp[mask]):
+        start, end = b * step, (b + 1) * step
+        rows.append({
+            'bin_label': f"{trim_number(start)}–{trim_number(end)}",
+            'bin_start': start,
+            'bin_end': end,
+            'count': c,
+            'disposition': d,
+        })
+    rows.sort(key=lambda r: (r['bin_label'], r['disposition']))
+    return rows
+
+
+def edge_bins(values, dispositions, edges=DEFAULT_SNR_EDGES):
+    """Histogram over consecutive `edges` pairs ([e0,e1), ..., last bin includes its right edge)."""
+    edges = np.asarray(edges, dtype=np.float64)
+    if len(edges) < 2:
+        return []
+    v = np.asarray(values, dtype=np.float64)
+    disp = disposition_labels(dispositions)
+    mask = np.isfinite(v) & (v > 0) & (v >= edges[0]) & (v <= edges[-1])
+    v = v[mask]
+    idx = np.searchsorted(edges, v, side='right') - 1
+    idx = np.minimum(idx, len(edges) - 2)
+    rows = []
+    for b, d, c in _grouped_counts(idx, disp[mask]):
+        rows.append({
+            'bin_label': f"{trim_number(edges[b])}–{trim_number(edges[b + 1])}",
+            'bin_start': float(edges[b]),
+            'bin_end': float(edges[b + 1]),
+            'count': c,
+            'disposition': d,
+        })
+    rows.sort(key=lambda r: (r['bin_label'], r['disposition']))
+    return rows
+
+
+def duration_summary(values, dispositions, stat: str = 'media'):
+    """Mean ("media") or median ("mediana") of the values per disposition."""
+    v = np.asarray(values, dtype=np.float64)
+    disp = disposition_labels(dispositions)
+    mask = np.isfinite(v)
+    v, disp = v[mask], disp[mask]
+    median = str(stat).lower() in ('mediana', 'median')
+    rows = []
+    for d in sorted(set(disp.tolist())):
+        group = v[disp == d]
+        value = float(np.median(group)) if median else float(group.mean())
+        rows.append({
+            'disposition': d,
+            'value': value,
+            'stat': 'mediana' if median else 'media',
+            'count': int(len(group)),
+        })
+    return rows
+
+
+def scatter_sample(x, y, dispositions, max_points: int = 1000, seed: int = 0, names=('x', 'y')):
+    """Finite (x, y) points with their disposition, uniformly downsampled to `max_points`.
+
+    Sampling uses a fixed seed so the same dataset always yields the same points.
+    `names` are the keys used for x and y in each point.
+    """
+    xv = np.asarray(x, dtype=np.float64)
+    yv = np.asarray(y, dtype=np.float64)
+    disp = disposition_labels(dispositions)
+    keep = np.flatnonzero(np.isfinite(xv) & np.isfinite(yv))
+    total = len(keep)
+    if max_points is not None and total > max_points:
+        rng = np.random.default_rng(seed)
+        keep = np.sort(rng.choice(keep, size=max_points, replace=False))
+    points = [{names[0]: float(a), names[1]: float(b), 'disposition': d}
+              for a, b, d in zip(xv[keep], yv[keep], disp[keep])]
+    return {'total': total, 'returned': len(points), 'points': points}
+
+
+def _col(df, name):
+    return df[name].to_numpy() if name in df else np.full(len(df), np.nan)
+
+
+def _parse_float(args, key, default, positive=True):
+    raw = args.get(key)
+    if raw is None:
+        return default
+    value = float(raw)
+    if positive and not value > 0:
+        raise ValueError(f"'{key}' must be positive")
+    return value
+
+
+def _parse_edges(args):
+    raw = args.get('edges')
+    if raw is None:
+        return DEFAULT_SNR_EDGES
+    edges = tuple(float(e) for e in str(raw).split(',') if e.strip())
+    if len(edges) < 2 or any(b <= a for a, b in zip(edges, edges[1:])):
+        raise ValueError("'edges' must be at least two increasing numbers")
+    return edges
+
+
+# Chart name -> (params parser, builder). Builders take the processed dataframe.
+CHARTS = {
+    'steff': (lambda a: {'step': _parse_float(a, 'step', 250.0)},
+              lambda df, p: linear_bins(_col(df, 'koi_steff'), _col(df, 'koi_disposition'), p['step'])),
+    'slogg': (lambda a: {'step': _parse_float(a, 'step', 0.2)},
+              lambda df, p: linear_bins(_col(df, 'koi_slogg'), _col(df, 'koi_disposition'), p['step'])),
+    'snr': (lambda a: {'edges': _parse_edges(a)},
+            lambda df, p: edge_bins(_col(df, 'koi_model_snr'), _col(df, 'koi_disposition'), p['edges'])),
+    'depth': (lambda a: {'step': _parse_float(a, 'step', 0.5)},
+              lambda df, p: linear_bins(_col(df, 'koi_depth'), _col(df, 'koi_disposition'), p['step'], log=True)),
+    'period': (lambda a: {'step': _parse_float(a, 'step', 0.3)},
+               lambda df, p: linear_bins(_col(df, 'koi_period'), _col(df, 'koi_disposition'), p['step'], log=True)),
+    'duration': (lambda a: {'stat': 'mediana' if str(a.get('stat', 'media')).lower() in ('mediana', 'median') else 'media'},
+                 lambda df, p: duration_summary(_col(df, 'koi_duration'), _col(df, 'koi_disposition'), p['stat'])),
+    'scatter': (lambda a: {'max_points': int(_parse_float(a, 'max_points', 1000))},
+                lambda df, p: scatter_sample(_col(df, 'koi_steff'), _col(df, 'koi_srad'), _col(df, 'koi_disposition'),
+                                             p['max_points'], names=('steff', 'srad'))),
+}
+
+
+def parse_params(name: str, args) -> dict:
+    """Validated parameters for chart `name` from a mapping of query args. Raises ValueError."""
+    return CHARTS[name][0](args)
+
+
+def compute_chart(df: pd.DataFrame, name: str, params: dict):
+    return CHARTS[name][1](df, params)
+
+
+def dashboard(df: pd.DataFrame) -> dict:
+    """Every chart with its default parameters."""
+    return {name: compute_chart(df, name, parse_params(name, {})) for name in CHARTS}
@@ -0,0 +1,120 @@
+"""Every endpoint scores a row the same way: /predict/batch on dataset rows reproduces /predictions."""
+
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+FEATURES = ('koi_period', 'koi_depth', 'koi_prad', 'koi_steff', 'koi_srad', 'koi_model_snr')
+
+
+def kepler_frame(n=600, seed=0):
+    rng = np.random.default_rng(seed)
+    confirmed = rng.random(n) < 0.5
+    df = pd.DataFrame({
+        'kepid': 757000 + np.arange(n) // 2,
+        'kepoi_name': [f"K{i:05d}.01" for i in range(n)],
+        'kepler_name': '',
+        'koi_disposition': np.where(confirmed, 'CONFIRMED', 'FALSE POSITIVE'),
+    })
+    for j, col in enumerate(FEATURES):
+        # Some signal, rounded so the exported text is exact, and about a fifth missing
+        values = np.round(rng.normal(confirmed * (1 + j % 3), 1.0, n) * 10 + 50, 2)
+        values[rng.random(n) < 0.2] = np.nan
+        df[col] = values
+    return df
+
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory):
+    root = tmp_path_factory.mktemp('server')
+    # The app creates its upload, image and cache directories under the working directory
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        import nasa
+    finally:
+        os.chdir(cwd)
+    path = str(root / 'kepler.csv')
+    kepler_frame().to_csv(path, index=False)
+    nasa.cfg.update(path=path, artifact_dir=str(root / 'artifacts'), numest=30, mxdepth=8)
+    mv = nasa.fit_model_version()
+    nasa.install_version(mv)
+    return nasa.app.test_client(), mv
+
+
+def ndjson(body):
+    return [json.loads(line) for line in body.decode('utf-8').splitlines() if line.strip()]
+
+
+def test_rows_with_gaps_are_scored_with_the_training_means(server):
+    client, mv = server
+    features = mv.df_processed[list(mv.X_columns)]
+    assert features.isna().any(axis=1).mean() > 0.5
+    X = mv.scaler.transform(features.fillna(mv.feature_means))
+    np.testing.assert_allclose(mv.pred_proba, mv.model_copy().predict_proba(X), atol=1e-6)
+
+
+@pytest.mark.parametrize('batch_size', [100, 1000])
+def test_batch_on_exported_rows_reproduces_the_prediction_table(server, batch_size):
+    client, mv = server
+    table = {r['kepoi_name']: r for r in ndjson(client.get('/predictions').data)}
+    assert len(table) == len(mv.df_processed)
+
+    exported = client.get('/planets?format=csv').data
+    response = client.post(f'/predict/batch?format=csv&batch_size={batch_size}', data=exported,
+                           content_type='text/csv')
+    assert response.status_code == 200
+    scored = pd.read_csv(io.BytesIO(response.data), comment='#')
+    assert len(scored) == len(table)
+    for row in scored.to_dict('records'):
+        expected = table[row['kepoi_name']]
+        assert row['prediction'] == expected['prediction']
+        assert [row[f"prob_{c}"] for c in mv.classes] == pytest.approx(
+            [expected['probabilities'][c] for c in mv.classes], abs=2e-6)
+
+
+def test_engine_and_attributions_explain_the_served_prediction(server):
+    client, mv = server
+    row = int(np.flatnonzero(mv.df_processed[list(mv.X_columns)].isna().any(axis=1).to_numpy())[0])
+    name = mv.df_processed['kepoi_name'].iloc[row]
+    body = client.get(f'/attributions/{name}?top=0').get_json()
+    total = body['base_value'] + sum(item['contribution'] for item in body['contributions']) + body['other']
+    assert total == pytest.approx(body['probability'], abs=1e-5)
+    assert body['probability'] == pytest.approx(float(mv.pred_proba[row, mv.classes.index(body['prediction'])]),
+                                                abs=1e-6)
+
+
+def test_large_batches_are_scored_without_reloading_the_forest(server, monkeypatch):
+    client, mv = server
+    # The version was saved as an artifact, so it serves from the memory-mapped engine
+    assert mv._model is None and mv.model_info['engine'].get('bytes')
+    monkeypatch.setattr(type(mv), 'model', property(lambda self: pytest.fail("sklearn forest reloaded")))
+    rows = client.get('/planets?format=csv').data
+    response = client.post('/predict/batch?format=csv&batch_size=500', data=rows, content_type='text/csv')
+    assert response.status_code == 200 and b'# error' not in response.data
+    assert mv._model is None
+
+
+def test_attributions_are_computed_per_row_and_cached(server, monkeypatch):
+    client, mv = server
+    attributions = mv.attributions
+    monkeypatch.setattr(attributions, 'cache_rows', 16)
+    n = attributions.cache_rows + 5
+    X = mv.scaler.transform(mv.df_processed[list(mv.X_columns)].iloc[:n].fillna(mv.feature_means))
+    _, expected = attributions.forest.contributions(X)
+    for row in range(n):
+        np.testing.assert_allclose(attributions.row(row), expected[row])
+    assert len(attributions._cache) == attributions.cache_rows
+    assert attributions.row(n - 1) is attributions.row(n - 1)
+
+    # The aggregate covers every row: recompute it from the full table
+    _, table = attributions.forest.contributions(
+        mv.scaler.transform(mv.df_processed[list(mv.X_columns)].fillna(mv.feature_means)))
+    rows = np.arange(len(table))
+    mean_abs = np.abs(table[rows, :, mv.pred_class]).mean(axis=0)
+    assert [attributions.mean_abs[c] for c in mv.X_columns] == pytest.approx(mean_abs.tolist(), abs=1e-6)
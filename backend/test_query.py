@@ -0,0 +1,121 @@
+"""Keyset paging of QueryIndex: every row exactly once, in order, across ties and missing values."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from query import SORT_KEYS, QueryError, QueryIndex, decode_cursor
+
+
+CLASSES = ['CONFIRMED', 'FALSE POSITIVE']
+
+
+def make_frame(n=60, seed=0):
+    rng = np.random.default_rng(seed)
+    names = [f"K{i:05d}.0{1 + i % 3}" for i in rng.permutation(n)]
+    df = pd.DataFrame({
+        'kepid': rng.integers(757000, 757010, n),
+        'kepoi_name': names,
+        'koi_disposition': rng.choice(CLASSES, n),
+    })
+    for col in SORT_KEYS[2:]:
+        # Few distinct values (many ties) and about a quarter missing
+        values = rng.integers(0, 5, n).astype(float)
+        values[rng.random(n) < 0.25] = np.nan
+        df[col] = values
+    return df
+
+
+def make_index(df):
+    pred_class = (df['koi_disposition'] == CLASSES[1]).to_numpy().astype(np.int16)
+    return QueryIndex(df, pred_class, CLASSES)
+
+
+def walk(index, sort, descending, limit, mask=None, cursor=None):
+    """Row positions of every page (from `cursor` on), following the cursors as a client would."""
+    rows = []
+    # A cursor that does not advance would page forever
+    for _ in range(index.n_rows + 1):
+        page, more = index.page(sort, descending, mask, limit, cursor)
+        rows.extend(page.tolist())
+        if not more:
+            return rows
+        token = index.cursor_after(sort, descending, page[-1])
+        cursor = decode_cursor(token, sort, descending)
+    pytest.fail("paging did not end")
+
+
+@pytest.mark.parametrize('sort', SORT_KEYS)
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('limit', [1, 3, 7])
+def test_paging_visits_every_row_once_in_order(sort, descending, limit):
+    df = make_frame()
+    index = make_index(df)
+    everything, more = index.page(sort, descending, None, len(df), None)
+    assert not more
+    assert sorted(everything.tolist()) == list(range(len(df)))
+    assert walk(index, sort, descending, limit) == everything.tolist()
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_value_sort_breaks_ties_by_name_and_puts_missing_last(descending):
+    df = make_frame()
+    index = make_index(df)
+    rows = walk(index, 'koi_period', descending, 4)
+    values = df['koi_period'].to_numpy()[rows]
+    names = df['kepoi_name'].to_numpy()[rows]
+    missing = np.isnan(values)
+    n_valid = int((~missing).sum())
+    assert not missing[:n_valid].any() and missing[n_valid:].all()
+    keys = list(zip(values[:n_valid], names[:n_valid]))
+    assert keys == sorted(keys, reverse=descending)
+    assert list(names[n_valid:]) == sorted(names[n_valid:])
+
+
+def test_paging_with_a_filter_mask():
+    df = make_frame()
+    index = make_index(df)
+    mask = index.filter_mask({'koi_depth': (1.0, 3.0)}, dispositions=['confirmed'])
+    expected = [r for r in index.page('koi_depth', False, None, len(df), None)[0].tolist() if mask[r]]
+    assert expected
+    assert walk(index, 'koi_depth', False, 2, mask) == expected
+    assert index.count(mask) == len(expected)
+
+
+def test_cursor_continues_after_rows_are_added():
+    df = make_frame()
+    first = make_index(df)
+    page, more = first.page('koi_steff', False, None, 10, None)
+    assert more
+    cursor = decode_cursor(first.cursor_after('koi_steff', False, page[-1]), 'koi_steff', False)
+
+    grown = pd.concat([df, make_frame(20, seed=1).assign(
+        kepoi_name=[f"K9{i:04d}.01" for i in range(20)])], ignore_index=True)
+    second = make_index(grown)
+    order = second.page('koi_steff', False, None, len(grown), None)[0].tolist()
+    last = order.index(int(page[-1]))
+    rest = walk(second, 'koi_steff', False, 5, cursor=cursor)
+    assert rest == order[last + 1:]
+
+
+def test_cursor_round_trip_keeps_value_and_name():
+    df = make_frame()
+    index = make_index(df)
+    row = int(np.flatnonzero(df['koi_srad'].isna().to_numpy())[0])
+    cursor = decode_cursor(index.cursor_after('koi_srad', True, row), 'koi_srad', True)
+    assert cursor['v'] is None
+    assert cursor['n'] == df['kepoi_name'][row].upper()
+    row = int(np.flatnonzero(df['koi_srad'].notna().to_numpy())[0])
+    cursor = decode_cursor(index.cursor_after('koi_srad', False, row), 'koi_srad', False)
+    assert cursor['v'] == df['koi_srad'][row]
+
+
+def test_decode_cursor_rejects_other_orders_and_garbage():
+    index = make_index(make_frame())
+    token = index.cursor_after('koi_period', False, 0)
+    with pytest.raises(QueryError):
+        decode_cursor(token, 'koi_depth', False)
+    with pytest.raises(QueryError):
+        decode_cursor(token, 'koi_period', True)
+    with pytest.raises(QueryError):
+        decode_cursor('not a cursor!', 'koi_period', False)
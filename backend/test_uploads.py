@@ -0,0 +1,183 @@
+"""Resumable uploads: offsets, checksums, header validation, resume and finalize."""
+
+import hashlib
+import io
+import os
+
+import pandas as pd
+import pytest
+
+import ingest
+import uploads
+from uploads import UploadError, UploadStore
+
+
+KEEP = ('CONFIRMED', 'FALSE POSITIVE')
+
+
+def kepler_csv(n=300):
+    lines = ['kepid,kepoi_name,kepler_name,koi_disposition,koi_period,koi_depth,koi_fpflag_nt,koi_prad']
+    for i in range(n):
+        disposition = ('CONFIRMED', 'FALSE POSITIVE', 'CANDIDATE')[i % 3]
+        name = f'"Kepler-{i} b"' if i % 4 == 0 else ''
+        lines.append(f"{757000 + i // 2},K{i:05d}.01,{name},{disposition},{1.5 + i / 7:.6f},{100 + i},{i % 2},{0.5 + i / 100}")
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return UploadStore(str(tmp_path / 'uploads' / '.uploads'), dispositions=KEEP)
+
+
+def upload_in_chunks(store, upload_id, data, chunk_size, start=0):
+    offset = start
+    while offset < len(data):
+        chunk = data[offset:offset + chunk_size]
+        status = store.write_chunk(upload_id, offset, io.BytesIO(chunk), sha(chunk))
+        offset = status['offset']
+    return offset
+
+
+def test_chunked_upload_finalizes_with_the_parsed_cache(store, tmp_path, monkeypatch):
+    # Enough rows for the schema sample, parsed in several batches while chunks arrive
+    monkeypatch.setattr(uploads, 'PARSE_BYTES', 8192)
+    data = kepler_csv(ingest.SAMPLE_ROWS + 500)
+    session = store.create('k.csv', size=len(data), sha256=sha(data))
+    # Chunk boundaries fall inside the header and inside rows
+    store.write_chunk(session['id'], 0, io.BytesIO(data[:37]))
+    assert upload_in_chunks(store, session['id'], data, 997, start=37) == len(data)
+    dest_dir = str(tmp_path / 'uploads')
+    result = store.finalize(session['id'], dest_dir)
+
+    assert result['deduplicated'] is False and result['cached'] is True
+    assert result['sha256'] == sha(data) and result['size'] == len(data)
+    with open(result['path'], 'rb') as f:
+        assert f.read() == data
+    expected = ingest.read_kepler_csv(result['path'], KEEP)
+    assert result['rows'] == len(expected)
+    cached = ingest.read_cache(ingest.cache_dir_for(result['path']))
+    pd.testing.assert_frame_equal(cached.apply(lambda s: s.to_numpy().copy() if s.dtype.kind in 'iuf' else s),
+                                  expected, check_dtype=False)
+    with pytest.raises(UploadError) as e:
+        store.status(session['id'])
+    assert e.value.status == 404
+
+
+def test_chunk_at_the_wrong_offset_is_refused(store):
+    data = kepler_csv()
+    session = store.create('k.csv')
+    store.write_chunk(session['id'], 0, io.BytesIO(data[:100]))
+    for offset in (0, 50, 150):
+        with pytest.raises(UploadError) as e:
+            store.write_chunk(session['id'], offset, io.BytesIO(data[offset:offset + 100]))
+        assert e.value.status == 409 and e.value.details['offset'] == 100
+    assert store.status(session['id'])['offset'] == 100
+
+
+def test_bad_chunk_checksum_keeps_nothing(store):
+    data = kepler_csv()
+    session = store.create('k.csv')
+    store.write_chunk(session['id'], 0, io.BytesIO(data[:100]))
+    with pytest.raises(UploadError) as e:
+        store.write_chunk(session['id'], 100, io.BytesIO(data[100:200]), sha(b'something else'))
+    assert e.value.status == 422 and e.value.details['offset'] == 100
+    assert store.status(session['id'])['offset'] == 100
+    # The same chunk with the right checksum is then accepted
+    assert store.write_chunk(session['id'], 100, io.BytesIO(data[100:200]), sha(data[100:200]))['offset'] == 200
+
+
+def test_chunk_past_the_declared_size_is_refused(store):
+    data = kepler_csv()
+    session = store.create('k.csv', size=150)
+    with pytest.raises(UploadError) as e:
+        store.write_chunk(session['id'], 0, io.BytesIO(data[:200]))
+    assert e.value.status == 413
+    assert store.status(session['id'])['offset'] == 0
+
+
+def test_upload_resumes_in_a_new_process(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, 'PARSE_BYTES', 8192)
+    data = kepler_csv(ingest.SAMPLE_ROWS + 500)
+    session = store.create('k.csv', size=len(data), sha256=sha(data))
+    half = upload_in_chunks(store, session['id'], data[:len(data) // 2], 997)
+
+    # A restarted server (or another worker) only has the session files
+    resumed = UploadStore(store.root, dispositions=KEEP)
+    status = resumed.status(session['id'])
+    assert status['offset'] == half
+    upload_in_chunks(resumed, session['id'], data, 997, start=status['offset'])
+    result = resumed.finalize(session['id'], str(tmp_path / 'uploads'))
+    assert result['sha256'] == sha(data) and result['cached'] is True
+    assert result['rows'] == len(ingest.read_kepler_csv(result['path'], KEEP))
+
+
+def test_workers_sharing_a_session_rebuild_stale_state(store, tmp_path):
+    data = kepler_csv()
+    other = UploadStore(store.root, dispositions=KEEP)
+    session = store.create('k.csv', sha256=sha(data))
+    # Chunks alternate between two workers; each must pick up the other's bytes
+    offset, workers = 0, (store, other)
+    for i, start in enumerate(range(0, len(data), 1500)):
+        chunk = data[start:start + 1500]
+        offset = workers[i % 2].write_chunk(session['id'], offset, io.BytesIO(chunk))['offset']
+    result = store.finalize(session['id'], str(tmp_path / 'uploads'))
+    assert result['sha256'] == sha(data)
+    assert result['rows'] == len(ingest.read_kepler_csv(result['path'], KEEP))
+
+
+def test_finalize_before_the_last_chunk_is_refused(store, tmp_path):
+    data = kepler_csv()
+    session = store.create('k.csv', size=len(data))
+    store.write_chunk(session['id'], 0, io.BytesIO(data[:500]))
+    with pytest.raises(UploadError) as e:
+        store.finalize(session['id'], str(tmp_path / 'uploads'))
+    assert e.value.status == 409 and e.value.details['offset'] == 500
+    # The session is still there to resume
+    assert store.status(session['id'])['offset'] == 500
+
+
+def test_finalize_with_a_wrong_file_checksum_drops_the_upload(store, tmp_path):
+    data = kepler_csv()
+    session = store.create('k.csv', sha256=sha(b'another file'))
+    upload_in_chunks(store, session['id'], data, 1000)
+    with pytest.raises(UploadError) as e:
+        store.finalize(session['id'], str(tmp_path / 'uploads'))
+    assert e.value.status == 422 and e.value.details['sha256'] == sha(data)
+    assert not os.path.exists(tmp_path / 'uploads' / 'k.csv')
+    with pytest.raises(UploadError):
+        store.status(session['id'])
+
+
+def test_non_kepler_header_is_refused_at_the_first_chunk(store):
+    session = store.create('other.csv')
+    with pytest.raises(UploadError) as e:
+        store.write_chunk(session['id'], 0, io.BytesIO(b'a,b,c\n1,2,3\n'))
+    assert e.value.status == 422
+    with pytest.raises(UploadError) as e:
+        store.status(session['id'])
+    assert e.value.status == 404
+
+
+def test_identical_upload_is_deduplicated(store, tmp_path):
+    data = kepler_csv()
+    dest_dir = str(tmp_path / 'uploads')
+    first = store.create('k.csv')
+    upload_in_chunks(store, first['id'], data, 4096)
+    saved = store.finalize(first['id'], dest_dir)
+
+    second = store.create('copy.csv')
+    upload_in_chunks(store, second['id'], data, 4096)
+    result = store.finalize(second['id'], dest_dir)
+    assert result['deduplicated'] is True and result['path'] == saved['path']
+    assert not os.path.exists(os.path.join(dest_dir, 'copy.csv'))
+
+
+def test_unknown_or_malformed_ids(store):
+    for upload_id in ('0' * 32, '../etc'):
+        with pytest.raises(UploadError) as e:
+            store.status(upload_id)
+        assert e.value.status == 404
@@ -0,0 +1,225 @@
+"""RandomForest fits with a bounded CPU budget, optionally in a separate process.
+
+Serving workers should not compete with a retrain for every core. `fit_forest()`
+grows the forest with `n_jobs` threads. With `in_process=False` it does so in a
+child process (spawned, like hpsearch's pool) that runs at a lower priority
+(`nice`). The child memory-maps the training matrix from a temp directory and
+writes the fitted model back there. The server process only polls the child, so
+its request threads keep running while the fit takes the CPUs it was given.
+
+The forest is grown in batches of trees with warm_start, so progress can be
+reported and cancellation honoured between batches (a cancelled child process is
+terminated). The result is identical to a single fit.
+
+For datasets larger than memory, `fit_forest_chunked()` grows the forest as
+sub-forests fitted on stratified row chunks of a (memory-mapped) matrix, one chunk
+in memory at a time, and merges their trees. `rows_per_chunk()` sizes chunks for a
+memory budget.
+
+`TrainingLock` serializes fits across the worker processes of a multi-worker
+server that share one artifact directory. It uses `fcntl` and is a no-op where
+`fcntl` is unavailable (Windows).
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import traceback
+from typing import Callable, Optional
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Seconds between checks for progress / cancellation while a child process fits
+POLL_SECONDS = 0.5
+
+
+def _grow(clf: RandomForestClassifier, X, y, n_estimators: int, on_batch: Optional[Callable[[int], None]]):
+    if on_batch is None:
+        clf.fit(X, y)
+        return clf
+    clf.set_params(warm_start=True)
+    step = max(1, n_estimators // 10)
+    grown = 0
+    while grown < n_estimators:
+        grown = min(n_estimators, grown + step)
+        clf.set_params(n_estimators=grown)
+        clf.fit(X, y)
+        on_batch(grown)
+    clf.set_params(warm_start=False)
+    return clf
+
+
+def _child_fit(workdir: str, params: dict, nice: int, conn):
+    """Entry point of the training process."""
+    try:
+        if nice and hasattr(os, 'nice'):
+            os.nice(nice)
+        X = np.load(os.path.join(workdir, 'X.npy'), mmap_mode='r')
+        y = np.load(os.path.join(workdir, 'y.npy'), allow_pickle=True)
+        clf = RandomForestClassifier(**params)
+        _grow(clf, X, y, params['n_estimators'], lambda grown: conn.send(('progress', grown)))
+        joblib.dump(clf, os.path.join(workdir, 'model.joblib'), compress=0)
+        conn.send(('done', None))
+    except Exception:
+        conn.send(('error', traceback.format_exc(limit=5)))
+    finally:
+        conn.close()
+
+
+def fit_forest(X, y, params: dict, n_jobs: Optional[int] = None, in_process: bool = True, nice: int = 0,
+               on_progress: Optional[Callable[[float], None]] = None,
+               check_cancelled: Optional[Callable[[], None]] = None,
+               tmp_dir: Optional[str] = None) -> RandomForestClassifier:
+    """Fit RandomForestClassifier(**params) on X, y with `n_jobs` threads (None = all cores).
+
+    `on_progress(fraction)` is called after each batch of trees and `check_cancelled()`
+    may raise to stop the fit; without either, the forest is fitted in one call.
+    With `in_process=False` the fit runs in a child process at priority `nice`, with
+    its files in a temp directory under `tmp_dir` (default: the system's).
+    """
+    params = dict(params, n_jobs=-1 if n_jobs is None else int(n_jobs))
+    n_estimators = int(params.get('n_estimators', 100))
+    params['n_estimators'] = n_estimators
+
+    if in_process:
+        def on_batch(grown):
+            if on_progress is not None:
+                on_progress(grown / n_estimators)
+            if check_cancelled is not None:
+                check_cancelled()
+        tracked = on_progress is not None or check_cancelled is not None
+        return _grow(RandomForestClassifier(**params), X, y, n_estimators, on_batch if tracked else None)
+
+    workdir = tempfile.mkdtemp(prefix='nasa-fit-', dir=tmp_dir)
+    ctx = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    proc = None
+    try:
+        # Trees split float32 values, so this is the copy sklearn would make anyway
+        np.save(os.path.join(workdir, 'X.npy'), np.ascontiguousarray(X, dtype=np.float32))
+        # Labels keep their dtype (object strings) so classes_ match an in-process fit
+        np.save(os.path.join(workdir, 'y.npy'), np.asarray(y), allow_pickle=True)
+        proc = ctx.Process(target=_child_fit, args=(workdir, params, nice, child_conn),
+                           name='nasa-trainer', daemon=True)
+        proc.start()
+        child_conn.close()
+        result = None
+        while result is None:
+            if check_cancelled is not None:
+                check_cancelled()
+            if parent_conn.poll(POLL_SECONDS):
+                try:
+                    kind, value = parent_conn.recv()
+                except EOFError:
+                    break
+                if kind == 'progress':
+                    if on_progress is not None:
+                        on_progress(value / n_estimators)
+                else:
+                    result = (kind, value)
+            elif not proc.is_alive():
+                break
+        if result is None:
+            proc.join(timeout=1)
+            raise RuntimeError(f"Training process exited unexpectedly (exit code {proc.exitcode})")
+        if result[0] == 'error':
+            raise RuntimeError(f"Training process failed:\n{result[1]}")
+        proc.join()
+        return joblib.load(os.path.join(workdir, 'model.joblib'))
+    finally:
+        if proc is not None and proc.is_alive():
+            proc.terminate()
+            proc.join(timeout=5)
+        parent_conn.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def rows_per_chunk(budget_bytes: int, n_features: int, copies: int = 4) -> int:
+    """Rows of which `copies` float64 working copies fit in `budget_bytes` (at least 1000)."""
+    return max(1000, int(budget_bytes) // max(1, n_features * 8 * copies))
+
+
+def fit_forest_chunked(X, y, params: dict, chunk_rows: int, on_progress: Optional[Callable[[float], None]] = None,
+                       **fit_kwargs):
+    """Fit the forest as sub-forests on stratified chunks of about `chunk_rows` rows of `X`.
+
+    Each chunk is copied out of `X` (typically a memory map) and gets its share of
+    the `n_estimators` trees, fitted with `fit_forest(**fit_kwargs)`. The trees are
+    merged into one RandomForestClassifier. Every chunk holds every class, so there
+    are at most as many chunks as rows of the rarest class.
+    Returns (model, number of chunks).
+    """
+    y = np.asarray(y)
+    n_estimators = int(params.get('n_estimators', 100))
+    labels, counts = np.unique(y, return_counts=True)
+    n_chunks = max(1, -(-len(y) // max(1, int(chunk_rows))))
+    n_chunks = max(1, min(n_chunks, int(counts.min()), n_estimators))
+    if n_chunks * int(chunk_rows) < len(y):
+        print(f"Chunks of {-(-len(y) // n_chunks)} rows exceed the {chunk_rows} rows the memory budget allows")
+
+    seed = params.get('random_state')
+    rng = np.random.default_rng(seed)
+    parts = [[] for _ in range(n_chunks)]
+    for label in labels:
+        rows = rng.permutation(np.flatnonzero(y == label))
+        for part, chunk in zip(parts, np.array_split(rows, n_chunks)):
+            part.append(chunk)
+    shares = [len(t) for t in np.array_split(np.arange(n_estimators), n_chunks)]
+
+    forests = []
+    done = 0
+    for i, (part, share) in enumerate(zip(parts, shares)):
+        # Sorted row ids read the mapped matrix front to back
+        idx = np.sort(np.concatenate(part))
+        X_chunk = np.asarray(X[idx], dtype=np.float32)
+        sub_params = dict(params, n_estimators=share, random_state=None if seed is None else int(seed) + i)
+        progress = None
+        if on_progress is not None:
+            progress = (lambda fraction, done=done, share=share: on_progress((done + fraction * share) / n_estimators))
+        forests.append(fit_forest(X_chunk, y[idx], sub_params, on_progress=progress, **fit_kwargs))
+        del X_chunk
+        done += share
+        if on_progress is not None:
+            on_progress(done / n_estimators)
+
+    forest = forests[0]
+    forest.estimators_ = [est for f in forests for est in f.estimators_]
+    forest.set_params(n_estimators=len(forest.estimators_), random_state=seed)
+    return forest, n_chunks
+
+
+class TrainingLock:
+    """Exclusive lock on the file `path`, held by one `with` block at a time across processes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fh = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return self
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._fh = open(self.path, 'a+')
+        started = time.time()
+        fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+        waited = time.time() - started
+        if waited > 1:
+            print(f"Waited {waited:.1f}s for another process's training to finish")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._fh is not None:
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+            self._fh.close()
+            self._fh = None
+        return False
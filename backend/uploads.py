@@ -0,0 +1,396 @@
+"""Resumable, chunked CSV uploads.
+
+The protocol (served by the /uploads endpoints in nasa.py):
+
+1. `create()` opens a session for a file name, optionally with the total size and
+   sha256 the client expects, and returns its id.
+2. `write_chunk()` appends the bytes of one request at a given offset, verified
+   against the chunk's sha256 when the client sends one. A chunk that does not
+   start at the current offset is refused with the offset to resume from, so a
+   client whose connection dropped asks for `status()` and carries on.
+3. `finalize()` checks the size and hash and moves the file into the upload
+   directory. If a file with the same content is already there, the upload is
+   dropped and the existing file is returned instead.
+
+While chunks arrive the session hashes the content. It validates the CSV header
+against the Kepler schema as soon as the first line is complete, so a wrong file
+is refused at its first chunk. It also parses complete rows into typed chunks
+with ingest.py's schema, which lets `finalize()` write the columnar cache
+without parsing the file again.
+
+A session is a `<id>.part` file plus `<id>.json` under `<upload_dir>/.uploads/`.
+The part file's size is the offset. After a server restart (or in another
+worker) the hash and the parser are rebuilt from the part file on the next chunk.
+"""
+
+import csv
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Iterable, Optional
+
+import pandas as pd
+
+import artifacts
+import ingest
+
+
+# Bytes read from the request stream per write
+READ_BYTES = 64 * 1024
+# Complete rows are parsed in batches of about this many bytes
+PARSE_BYTES = 4 * 1024 * 1024
+
+
+class UploadError(ValueError):
+    """A refused upload request; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+class CsvPreparser:
+    """Parses the records of a CSV as its bytes arrive, with ingest.py's schema.
+
+    The header is validated when its line is complete (ValueError if it does not fit
+    the Kepler schema). The schema is inferred from the first ingest.SAMPLE_ROWS rows,
+    like `ingest.infer_schema()`, then complete rows are parsed in batches. If a batch
+    does not parse with that schema, pre-parsing stops and `finish()` returns None
+    (the dataset is then parsed from the file on first load).
+    """
+
+    def __init__(self, dispositions: Optional[Iterable[str]] = None):
+        self.dispositions = dispositions
+        self.header = None
+        self.failed = None
+        self._header_line = b''
+        self._pending = b''
+        self._batch = []
+        self._batch_bytes = 0
+        self._batch_rows = 0
+        self._schema = None
+        self._chunks = []
+
+    def _complete_records(self, data: bytes) -> bytes:
+        """Bytes of the complete records in pending + `data`; keeps the rest pending."""
+        buf = self._pending + data
+        if b'"' not in buf:
+            cut = buf.rfind(b'\n')
+        else:
+            # A newline inside a quoted field does not end a record
+            cut = -1
+            quotes = 0
+            pos = 0
+            for piece in buf.split(b'\n')[:-1]:
+                quotes += piece.count(b'"')
+                pos += len(piece) + 1
+                if quotes % 2 == 0:
+                    cut = pos - 1
+        if cut < 0:
+            self._pending = buf
+            return b''
+        self._pending = buf[cut + 1:]
+        return buf[:cut + 1]
+
+    def feed(self, data: bytes):
+        records = self._complete_records(data)
+        if not records:
+            return
+        if self.header is None:
+            end = records.find(b'\n') + 1
+            self._header_line, records = records[:end], records[end:]
+            line = self._header_line.decode('utf-8-sig', errors='replace')
+            self.header = next(csv.reader([line.rstrip('\r\n')]), [])
+            ingest.validate_header(self.header)
+        if records and self.failed is None:
+            self._batch.append(records)
+            self._batch_bytes += len(records)
+            self._batch_rows += records.count(b'\n')
+            if self._schema is None and self._batch_rows >= ingest.SAMPLE_ROWS:
+                self._infer_schema()
+            if self._schema is not None and self._batch_bytes >= PARSE_BYTES:
+                self._parse_batch()
+
+    def _text(self, parts) -> io.BytesIO:
+        return io.BytesIO(self._header_line + b''.join(parts))
+
+    def _infer_schema(self):
+        sample = pd.read_csv(self._text(self._batch), nrows=ingest.SAMPLE_ROWS)
+        self._schema = ingest.schema_from_sample(sample)
+
+    def _parse_batch(self):
+        usecols, dtypes = self._schema
+        try:
+            self._chunks.extend(ingest.iter_csv_chunks(self._text(self._batch), usecols, dtypes,
+                                                       self.dispositions))
+        except (ValueError, TypeError) as e:
+            self.failed = f"rows did not parse with the inferred schema: {e}"
+            self._chunks = []
+        self._batch = []
+        self._batch_bytes = 0
+
+    def finish(self) -> Optional[pd.DataFrame]:
+        """The typed, filtered table of everything fed, or None if it could not be pre-parsed."""
+        if self._pending.strip():
+            # The last record may lack a trailing newline
+            pending, self._pending = self._pending, b''
+            self.feed(pending + b'\n')
+        if self.header is None:
+            raise ValueError("The CSV has no header row")
+        if self.failed is not None:
+            return None
+        if self._schema is None:
+            self._infer_schema()
+        if self._batch:
+            self._parse_batch()
+        if self.failed is not None:
+            return None
+        usecols, dtypes = self._schema
+        return ingest.frame_from_chunks(self._chunks, usecols, dtypes)
+
+
+class _Live:
+    """In-memory state of a session: content hash and pre-parser at `offset`."""
+
+    def __init__(self, dispositions):
+        self.offset = 0
+        self.hasher = hashlib.sha256()
+        self.parser = CsvPreparser(dispositions)
+
+    def feed(self, data: bytes):
+        self.offset += len(data)
+        self.hasher.update(data)
+        self.parser.feed(data)
+
+
+class UploadStore:
+    """Upload sessions kept under `root` (one .part and one .json file each)."""
+
+    def __init__(self, root: str, dispositions: Optional[Iterable[str]] = None, expiry_seconds: float = 86400):
+        self.root = root
+        self.dispositions = dispositions
+        self.expiry_seconds = expiry_seconds
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._live = {}
+
+    # --- session files ---
+
+    def _part(self, upload_id: str) -> str:
+        return os.path.join(self.root, f"{upload_id}.part")
+
+    def _meta_path(self, upload_id: str) -> str:
+        return os.path.join(self.root, f"{upload_id}.json")
+
+    def _session_lock(self, upload_id: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def _read_meta(self, upload_id: str) -> dict:
+        # Ids are generated hex strings; anything else cannot name a session
+        if not upload_id.isalnum():
+            raise UploadError(f"Unknown upload: {upload_id}", 404)
+        try:
+            with open(self._meta_path(upload_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise UploadError(f"Unknown upload: {upload_id}", 404)
+
+    def _write_meta(self, meta: dict):
+        path = self._meta_path(meta['id'])
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp, path)
+
+    def _remove(self, upload_id: str):
+        with self._lock:
+            self._live.pop(upload_id, None)
+            self._locks.pop(upload_id, None)
+        for path in (self._part(upload_id), self._meta_path(upload_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _offset(self, upload_id: str) -> int:
+        try:
+            return os.path.getsize(self._part(upload_id))
+        except OSError:
+            return 0
+
+    def _status(self, meta: dict) -> dict:
+        return dict(meta, offset=self._offset(meta['id']))
+
+    def _live_state(self, upload_id: str, offset: int) -> _Live:
+        """Hash + parser at `offset`, rebuilt from the part file if this process lost track."""
+        live = self._live.get(upload_id)
+        if live is None or live.offset != offset:
+            live = _Live(self.dispositions)
+            with open(self._part(upload_id), 'rb') as f:
+                while live.offset < offset:
+                    data = f.read(min(PARSE_BYTES, offset - live.offset))
+                    if not data:
+                        break
+                    live.feed(data)
+            self._live[upload_id] = live
+        return live
+
+    def cleanup(self):
+        """Drop sessions not written to for `expiry_seconds`."""
+        now = time.time()
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            upload_id = name[:-5]
+            try:
+                meta = self._read_meta(upload_id)
+            except UploadError:
+                continue
+            if now - meta.get('updated_at', 0) > self.expiry_seconds:
+                self._remove(upload_id)
+
+    # --- protocol ---
+
+    def create(self, filename: str, size: Optional[int] = None, sha256: Optional[str] = None) -> dict:
+        if size is not None and size < 0:
+            raise UploadError("size must be >= 0")
+        os.makedirs(self.root, exist_ok=True)
+        self.cleanup()
+        now = time.time()
+        meta = {"id": uuid.uuid4().hex, "filename": filename, "size": size,
+                "sha256": sha256.lower() if sha256 else None, "created_at": now, "updated_at": now}
+        open(self._part(meta['id']), 'wb').close()
+        self._write_meta(meta)
+        with self._lock:
+            self._live[meta['id']] = _Live(self.dispositions)
+        return self._status(meta)
+
+    def status(self, upload_id: str) -> dict:
+        return self._status(self._read_meta(upload_id))
+
+    def write_chunk(self, upload_id: str, offset: int, stream, chunk_sha256: Optional[str] = None) -> dict:
+        """Append the bytes of `stream` at `offset` (which must be the current offset)."""
+        meta = self._read_meta(upload_id)
+        with self._session_lock(upload_id):
+            current = self._offset(upload_id)
+            if offset != current:
+                raise UploadError(f"Chunk starts at {offset} but the upload is at {current}", 409, offset=current)
+            live = self._live_state(upload_id, current)
+
+            digest = hashlib.sha256()
+            written = 0
+            with open(self._part(upload_id), 'r+b') as f:
+                f.seek(current)
+                try:
+                    while True:
+                        data = stream.read(READ_BYTES)
+                        if not data:
+                            break
+                        if meta['size'] is not None and current + written + len(data) > meta['size']:
+                            raise UploadError(f"Chunk goes past the declared size of {meta['size']} bytes", 413,
+                                              offset=current)
+                        f.write(data)
+                        digest.update(data)
+                        written += len(data)
+                    if chunk_sha256 and digest.hexdigest() != chunk_sha256.lower():
+                        raise UploadError("Chunk checksum mismatch", 422, offset=current)
+                except BaseException:
+                    # Nothing of a refused or interrupted chunk is kept
+                    f.truncate(current)
+                    raise
+
+            # Hash and pre-parse only what was accepted, read back from the page cache
+            try:
+                with open(self._part(upload_id), 'rb') as f:
+                    f.seek(current)
+                    remaining = written
+                    while remaining:
+                        data = f.read(min(PARSE_BYTES, remaining))
+                        remaining -= len(data)
+                        live.feed(data)
+            except ValueError as e:
+                # The header does not fit the Kepler schema: the whole upload is refused
+                self._remove(upload_id)
+                raise UploadError(f"Not a Kepler dataset: {e}", 422)
+
+            meta['updated_at'] = time.time()
+            if live.parser.header is not None:
+                meta['columns'] = len(live.parser.header)
+            self._write_meta(meta)
+            return dict(self._status(meta), received=written)
+
+    def finalize(self, upload_id: str, dest_dir: str, sha256: Optional[str] = None) -> dict:
+        """Complete the upload into `dest_dir` and return {"path", "sha256", "size", ...}.
+
+        `deduplicated` is true when an identical file already existed (its path is
+        returned); `cached` when the columnar cache was written from the pre-parsed rows.
+        """
+        meta = self._read_meta(upload_id)
+        with self._session_lock(upload_id):
+            size = self._offset(upload_id)
+            if meta['size'] is not None and size != meta['size']:
+                raise UploadError(f"Upload incomplete: {size} of {meta['size']} bytes received", 409, offset=size)
+            live = self._live_state(upload_id, size)
+            digest = live.hasher.hexdigest()
+            expected = (sha256 or meta.get('sha256') or '').lower()
+            if expected and digest != expected:
+                self._remove(upload_id)
+                raise UploadError("Upload checksum mismatch; start a new upload", 422, sha256=digest)
+            try:
+                df = live.parser.finish()
+            except ValueError as e:
+                self._remove(upload_id)
+                raise UploadError(f"Not a Kepler dataset: {e}", 422)
+
+            existing = self._find_identical(dest_dir, size, digest)
+            if existing is not None:
+                self._remove(upload_id)
+                return {"path": existing, "sha256": digest, "size": size, "deduplicated": True, "cached": False}
+
+            os.makedirs(dest_dir, exist_ok=True)
+            dest = os.path.join(dest_dir, meta['filename'])
+            os.replace(self._part(upload_id), dest)
+            self._remove(upload_id)
+            artifacts.remember_digest(dest, digest)
+            cached = False
+            if df is not None:
+                try:
+                    ingest.store_cache(dest, df, self.dispositions)
+                    cached = True
+                except Exception as e:
+                    print(f"Writing dataset cache for {dest} failed: {e!r}")
+            return {"path": dest, "sha256": digest, "size": size, "deduplicated": False, "cached": cached,
+                    "rows": None if df is None else len(df)}
+
+    def abort(self, upload_id: str):
+        self._read_meta(upload_id)
+        with self._session_lock(upload_id):
+            self._remove(upload_id)
+
+    @staticmethod
+    def _find_identical(dest_dir: str, size: int, digest: str) -> Optional[str]:
+        """A CSV in `dest_dir` with this content, if any (only files of the same size are hashed)."""
+        try:
+            names = sorted(os.listdir(dest_dir))
+        except OSError:
+            return None
+        for name in names:
+            path = os.path.join(dest_dir, name)
+            if not name.lower().endswith('.csv') or not os.path.isfile(path) or os.path.getsize(path) != size:
+                continue
+            try:
+                if artifacts.file_digest(path) == digest:
+                    return path
+            except OSError:
+                continue
+        return None
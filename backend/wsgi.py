@@ -0,0 +1,37 @@
+"""Production entry point for multi-worker WSGI servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Each worker process imports the app and serves requests on its own threads.
+Workers share cfg['artifact_dir'], so a model is fitted once and loaded by the
+others. Only memory-mapped arrays are shared in memory: the compiled engine of a
+saved artifact (which scores /predict/batch once the version has released its
+sklearn forest) and the numeric columns of the dataset cache (see ingest.py).
+The rest of a version (prediction table, name columns, payloads, indexes,
+attributions, and the sklearn forest until it is released) lives on each
+worker's heap, so it is held once per worker.
+
+A retrain requested from any worker runs in a separate, lower-priority process
+limited to cfg['training_cpus'] cores (one fit at a time across workers); when
+it finishes the version is published and the other workers load it on their
+next request (see nasa.publish_version).
+
+Environment overrides: NASA_CSV_PATH, NASA_ARTIFACT_DIR and NASA_TRAINING_CPUS.
+"""
+
+import os
+
+import nasa
+
+nasa.cfg.update(training_process=True, shared_artifacts=True)
+if os.getenv('NASA_CSV_PATH'):
+    nasa.cfg['path'] = os.path.abspath(os.environ['NASA_CSV_PATH'])
+if os.getenv('NASA_ARTIFACT_DIR'):
+    nasa.cfg['artifact_dir'] = os.path.abspath(os.environ['NASA_ARTIFACT_DIR'])
+if os.getenv('NASA_TRAINING_CPUS'):
+    nasa.cfg['training_cpus'] = max(1, int(os.environ['NASA_TRAINING_CPUS']))
+
+# Load the published version (or train the first one) without delaying the worker's boot
+nasa.startup(background=True)
+
+app = nasa.app